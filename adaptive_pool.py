@@ -0,0 +1,99 @@
+import threading
+from collections import deque
+from time import time
+
+
+class AdaptivePoolController:
+    """
+    Sizes the dispatcher's worker set between `min_workers` and `max_workers`.
+    `decide` grows the pool when the backlog per worker or the delivery latency is above target.
+    Idle workers retire after `idle_timeout` seconds through `may_retire`, so the pool shrinks
+    back once a burst is absorbed. Every change is kept in a bounded decision log.
+    """
+
+    def __init__(self, min_workers=2, max_workers=16, backlog_per_worker=8, target_latency=0.05,
+                 idle_timeout=5.0, latency_smoothing=0.2, history=100):
+        if not 1 <= min_workers <= max_workers:
+            raise ValueError("Worker bounds must satisfy 1 <= min_workers <= max_workers")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.backlog_per_worker = backlog_per_worker  # Pending deliveries one worker is expected to absorb
+        self.target_latency = target_latency  # Seconds from routing to the PUBLISH being written
+        self.idle_timeout = idle_timeout
+        self.latency_smoothing = latency_smoothing  # Weight of the newest sample in the moving average
+        self.latency = 0.0  # Exponential moving average of the delivery latency
+        self.samples = 0
+        self.scale_ups = 0
+        self.scale_downs = 0
+        self.last_backlog = 0
+        self.decisions = deque(maxlen=history)  # Most recent sizing decisions, oldest first
+        self.lock = threading.Lock()
+
+    def record_latency(self, seconds: float) -> None:
+        with self.lock:
+            if self.samples == 0:
+                self.latency = seconds
+            else:
+                self.latency += self.latency_smoothing * (seconds - self.latency)
+            self.samples += 1
+
+    def decide(self, workers: int, backlog: int, lanes: int = None) -> int:
+        """
+        Returns the number of workers to add (0 if the pool is large enough).
+        `lanes` is the number of subscribers with pending deliveries; a lane is served by one worker
+        at a time, so workers beyond that count would only sit idle.
+        """
+        with self.lock:
+            self.last_backlog = backlog
+            limit = self.max_workers if lanes is None else min(self.max_workers, max(lanes, self.min_workers))
+            if workers >= limit:
+                return 0
+            overloaded = backlog > workers * self.backlog_per_worker
+            slow = backlog > 0 and self.latency > self.target_latency
+            if not (overloaded or slow):
+                return 0
+            # Grow geometrically so a burst is absorbed within a few control intervals
+            wanted = max(1, workers // 2)
+            if overloaded:
+                wanted = max(wanted, -(-backlog // self.backlog_per_worker) - workers)
+            added = min(wanted, limit - workers)
+            self.scale_ups += 1
+            self._log("grow", workers, workers + added, backlog,
+                      "backlog" if overloaded else "latency")
+            return added
+
+    def may_retire(self, workers: int) -> bool:
+        """Called by a worker that stayed idle for `idle_timeout`. True if it should exit."""
+        with self.lock:
+            if workers <= self.min_workers:
+                return False
+            self.scale_downs += 1
+            self._log("shrink", workers, workers - 1, self.last_backlog, "idle")
+            return True
+
+    def _log(self, action, before, after, backlog, reason):
+        self.decisions.append({
+            "time": time(),
+            "action": action,
+            "workers_before": before,
+            "workers_after": after,
+            "backlog": backlog,
+            "latency": round(self.latency, 6),
+            "reason": reason,
+        })
+        print(f"Dispatcher pool {action}: {before} -> {after} worker(s) ({reason}, backlog {backlog})")
+
+    def metrics(self, workers=None) -> dict:
+        """Snapshot of the controller state, for the GUI or logs."""
+        with self.lock:
+            return {
+                "workers": workers,
+                "min_workers": self.min_workers,
+                "max_workers": self.max_workers,
+                "backlog": self.last_backlog,
+                "latency_avg": self.latency,
+                "latency_samples": self.samples,
+                "scale_ups": self.scale_ups,
+                "scale_downs": self.scale_downs,
+                "decisions": list(self.decisions),
+            }
@@ -0,0 +1,103 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+
+class TokenBucket:
+    __slots__ = ("capacity", "refill_rate", "tokens", "updated")
+
+    def __init__(self, capacity, refill_rate, now=None):
+        self.capacity = capacity  # Maximum burst size
+        self.refill_rate = refill_rate  # Tokens added per second
+        self.tokens = capacity
+        self.updated = monotonic() if now is None else now
+
+    def available(self, now=None, tokens=1) -> bool:
+        """Refills the bucket up to `now`. Returns True if `tokens` could be taken, without taking them."""
+        now = monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_rate)
+        self.updated = now
+        return self.tokens >= tokens
+
+    def consume(self, now=None, tokens=1) -> bool:
+        """Takes tokens from the bucket. Returns False if not enough tokens are available."""
+        if not self.available(now, tokens):
+            return False
+        self.tokens -= tokens
+        return True
+
+
+class AdmissionController:
+    """
+    Decides whether a CONNECT may proceed using in-memory state only: an active connection counter,
+    the set of banned client IDs and token buckets per client ID and per source IP.
+    Runs before authentication, so a reconnect storm is filtered without touching the database.
+    """
+
+    def __init__(self, db, max_connections=50, min_connection_interval=1, ip_rate=50.0, ip_burst=200,
+                 max_tracked_buckets=100000):
+        self.db = db
+        self.max_connections = max_connections
+        self.client_rate = 1.0 / min_connection_interval if min_connection_interval > 0 else float('inf')
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.max_tracked_buckets = max_tracked_buckets
+        self.lock = threading.Lock()
+        self.active_connections = 0
+        self.client_buckets = OrderedDict()  # {client_id: TokenBucket}, least recently used first
+        self.ip_buckets = OrderedDict()  # {ip address: TokenBucket}, least recently used first
+        self.banned_clients = set(db.load_banned_clients())
+
+    def admit(self, client_id, ip_address) -> int:
+        """
+        Reserves a connection slot for the client. Returns 0x00 on success, otherwise the CONNACK
+        reason code to reject with. A successful admit must be paired with `release`.
+        Both rate limits are checked before either is charged, so a rejected CONNECT costs no token.
+        """
+        now = monotonic()
+        with self.lock:
+            if self.active_connections >= self.max_connections:
+                return 0x89  # Server Busy
+            if client_id in self.banned_clients:
+                return 0x8A  # Client Banned
+            ip_bucket = self._bucket(self.ip_buckets, ip_address, self.ip_burst, self.ip_rate, now)
+            if not ip_bucket.available(now):
+                print(f"Connection rate exceeded for address '{ip_address}'")
+                return 0x9F  # Connection Rate Exceeded
+            client_bucket = self._bucket(self.client_buckets, client_id, 1, self.client_rate, now) if client_id else None
+            if client_bucket is not None and not client_bucket.available(now):
+                print(f"Client '{client_id}' exceeded connection rate limit.")
+                return 0x9F  # Connection Rate Exceeded
+            ip_bucket.consume(now)
+            if client_bucket is not None:
+                client_bucket.consume(now)
+            self.active_connections += 1
+            return 0x00
+
+    def release(self) -> None:
+        """Frees the connection slot reserved by a successful `admit`."""
+        with self.lock:
+            self.active_connections = max(0, self.active_connections - 1)
+
+    def ban_client(self, client_id) -> bool:
+        """Bans a client ID, both in memory and in the database."""
+        with self.lock:
+            self.banned_clients.add(client_id)
+        return self.db.set_client_banned(client_id, True)
+
+    def unban_client(self, client_id) -> bool:
+        """Lifts the ban on a client ID, both in memory and in the database."""
+        with self.lock:
+            self.banned_clients.discard(client_id)
+        return self.db.set_client_banned(client_id, False)
+
+    def _bucket(self, buckets, key, capacity, refill_rate, now):
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = TokenBucket(capacity, refill_rate, now)
+            # Forget the least recently seen keys so the tables stay bounded
+            while len(buckets) > self.max_tracked_buckets:
+                buckets.popitem(last=False)
+        else:
+            buckets.move_to_end(key)
+        return bucket
@@ -0,0 +1,115 @@
+import lzma
+import zlib
+from collections import Counter
+from topic import matches_topic_filter
+
+CODECS = ("none", "zlib", "lzma")
+MAX_DICTIONARY_SIZE = 32 * 1024  # zlib only looks back 32 KiB, a longer preset dictionary is wasted
+
+
+def train_dictionary(samples, size=MAX_DICTIONARY_SIZE) -> bytes:
+    """
+    Builds a zlib preset dictionary from sample payloads of one topic prefix. zlib finds matches
+    within its 32 KiB window and codes near ones cheaper, so distinct samples are laid out from the
+    rarest to the most frequent and only the last `size` bytes are kept.
+    """
+    counts = Counter(sample.encode() if isinstance(sample, str) else bytes(sample) for sample in samples if sample)
+    ordered = sorted(counts, key=lambda sample: counts[sample])
+    return b"".join(ordered)[-min(size, MAX_DICTIONARY_SIZE):]
+
+
+class ArchiveCompression:
+    """
+    Opt-in compression of archived payloads. The first matching (topic filter, codec) rule picks the
+    codec of a topic, unmatched topics use `default`; codecs are "zlib", "lzma" or "none" (verbatim).
+    Payloads below `min_size` bytes, or that would not get smaller, are stored verbatim.
+    zlib payloads use the newest preset dictionary of the longest matching topic prefix, if any;
+    dictionaries are stored with the archive so older rows keep decoding after retraining.
+    Stored payloads carry an encoding such as "zlib:d3:bin" (codec, dictionary id, bytes payload);
+    None means verbatim.
+    """
+
+    def __init__(self, rules=None, default="none", min_size=256, level=6):
+        if default not in CODECS:
+            raise ValueError(f"Unknown compression codec '{default}'")
+        self.rules = []  # [(topic filter, codec)], checked in order
+        for topic_filter, codec in rules or []:
+            self.add_rule(topic_filter, codec)
+        self.default = default
+        self.min_size = min_size
+        self.level = level
+        self.dictionaries = {}  # {dictionary id: bytes}, every dictionary rows may refer to
+        self.active = {}  # {topic prefix: dictionary id} used for new payloads
+
+    def add_rule(self, topic_filter: str, codec: str) -> None:
+        if codec not in CODECS:
+            raise ValueError(f"Unknown compression codec '{codec}'")
+        self.rules.append((topic_filter, codec))
+
+    def add_dictionary(self, dictionary_id: int, prefix: str, dictionary: bytes) -> None:
+        """Registers a stored dictionary; the newest one of a prefix is used for new payloads."""
+        self.dictionaries[dictionary_id] = dictionary
+        if dictionary_id >= self.active.get(prefix, -1):
+            self.active[prefix] = dictionary_id
+
+    def codec_for(self, topic: str) -> str:
+        for topic_filter, codec in self.rules:
+            if matches_topic_filter(topic_filter, topic):
+                return codec
+        return self.default
+
+    def _dictionary_id(self, topic: str):
+        matches = [prefix for prefix in self.active if topic.startswith(prefix)]
+        return self.active[max(matches, key=len)] if matches else None
+
+    def compress(self, topic: str, payload):
+        """Returns (stored payload, encoding) for an archived payload; encoding None means verbatim."""
+        codec = self.codec_for(topic)
+        if codec == "none" or payload is None:
+            return payload, None
+        binary = isinstance(payload, (bytes, bytearray))
+        data = bytes(payload) if binary else str(payload).encode()
+        if len(data) < self.min_size:
+            return payload, None
+        parts = [codec]
+        if codec == "zlib":
+            dictionary_id = self._dictionary_id(topic)
+            if dictionary_id is None:
+                compressor = zlib.compressobj(self.level)
+            else:
+                compressor = zlib.compressobj(self.level, zdict=self.dictionaries[dictionary_id])
+                parts.append(f"d{dictionary_id}")
+            compressed = compressor.compress(data) + compressor.flush()
+        else:
+            compressed = lzma.compress(data, preset=min(self.level, 9))
+        if len(compressed) >= len(data):
+            return payload, None
+        if binary:
+            parts.append("bin")
+        return compressed, ":".join(parts)
+
+    def decompress(self, payload, encoding):
+        """Restores an archived payload. Raises ValueError if it cannot be decoded."""
+        if not encoding:
+            return payload
+        codec, *options = encoding.split(":")
+        try:
+            if codec == "zlib":
+                dictionary_ids = [int(option[1:]) for option in options if option.startswith("d")]
+                if dictionary_ids:
+                    if dictionary_ids[0] not in self.dictionaries:
+                        raise ValueError(f"Unknown compression dictionary {dictionary_ids[0]}")
+                    decompressor = zlib.decompressobj(zdict=self.dictionaries[dictionary_ids[0]])
+                else:
+                    decompressor = zlib.decompressobj()
+                data = decompressor.decompress(payload) + decompressor.flush()
+            elif codec == "lzma":
+                data = lzma.decompress(payload)
+            else:
+                raise ValueError(f"Unknown payload encoding '{encoding}'")
+        except (zlib.error, lzma.LZMAError, TypeError) as e:
+            raise ValueError(f"Corrupt '{encoding}' payload: {e}")
+        return data if "bin" in options else data.decode()
+
+    def __repr__(self):
+        return f"<ArchiveCompression default={self.default} rules={self.rules} dictionaries={len(self.dictionaries)}>"
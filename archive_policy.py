@@ -0,0 +1,29 @@
+from topic import matches_topic_filter
+
+
+class ArchivePolicy:
+    """
+    Decides which published messages are written to the `messages` archive.
+    Modes:
+    - "all": archive every message (default)
+    - "none": archive nothing
+    - "filters": archive only topics matching one of `topic_filters`
+    """
+
+    MODES = ("all", "none", "filters")
+
+    def __init__(self, mode="all", topic_filters=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown archive mode '{mode}'")
+        self.mode = mode
+        self.topic_filters = list(topic_filters or [])
+
+    def should_archive(self, topic: str) -> bool:
+        if self.mode == "all":
+            return True
+        if self.mode == "none":
+            return False
+        return any(matches_topic_filter(topic_filter, topic) for topic_filter in self.topic_filters)
+
+    def __repr__(self):
+        return f"<ArchivePolicy mode={self.mode} topic_filters={self.topic_filters}>"
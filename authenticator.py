@@ -0,0 +1,120 @@
+import hashlib
+import hmac
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Authenticator:
+    """
+    Verifies CONNECT credentials against the `users` table using salted PBKDF2-SHA256 hashes.
+    Unknown usernames are rejected; users are created with `add_user`. `db` may be left None
+    when the authenticator is handed to MQTT5Server, which binds it to its storage.
+    The slow hash runs in a small worker pool, and recent successful logins are remembered in a
+    bounded LRU keyed by an HMAC of the credentials, so reconnect storms do not re-pay the hash cost.
+    """
+
+    HASH_SCHEME = "pbkdf2_sha256"
+
+    def __init__(self, db=None, iterations=200000, max_workers=4, cache_size=10000, allow_anonymous=False,
+                 verify_timeout=10):
+        self.db = db
+        self.iterations = iterations
+        self.cache_size = cache_size
+        self.allow_anonymous = allow_anonymous  # Accept CONNECT packets without a username
+        self.verify_timeout = verify_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._cache_key = os.urandom(32)  # Per-process key, cached digests are useless outside this broker
+        self._cache = OrderedDict()  # {credential digest: username}, least recently used first
+        self._generations = {}  # {username: changes so far}, a login verified across a change is not cached
+        self.lock = threading.Lock()
+
+    def hash_password(self, password: str, salt: bytes = None, iterations: int = None) -> str:
+        """Returns the stored form of a password: scheme$iterations$salt$hash."""
+        salt = os.urandom(16) if salt is None else salt
+        iterations = self.iterations if iterations is None else iterations
+        digest = hashlib.pbkdf2_hmac("sha256", password.encode(), salt, iterations)
+        return f"{self.HASH_SCHEME}${iterations}${salt.hex()}${digest.hex()}"
+
+    def verify_password(self, password: str, stored_hash: str) -> bool:
+        """Checks a password against its stored form. Also accepts legacy unsalted SHA-256 hashes."""
+        if not stored_hash or password is None:
+            return False
+        if stored_hash.startswith(self.HASH_SCHEME + "$"):
+            try:
+                _, iterations, salt, expected = stored_hash.split("$")
+                digest = hashlib.pbkdf2_hmac("sha256", password.encode(), bytes.fromhex(salt), int(iterations))
+            except ValueError:
+                print("Malformed password hash in the users table")
+                return False
+            return hmac.compare_digest(digest.hex(), expected)
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        return hmac.compare_digest(legacy, stored_hash)
+
+    def authenticate(self, username, password) -> int:
+        """
+        Checks the credentials of a CONNECT packet. Returns 0x00 on success or a CONNACK reason code.
+        Blocks the calling connection thread only; the hash itself runs in the worker pool.
+        """
+        if username is None:
+            return 0x00 if self.allow_anonymous and password is None else 0x86  # Bad Username or Password
+
+        key = self._credential_digest(username, password)
+        with self.lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return 0x00
+            generation = self._generations.get(username, 0)
+
+        try:
+            reason_code = self.executor.submit(self._verify, username, password).result(timeout=self.verify_timeout)
+        except Exception as e:
+            print(f"Error authenticating user '{username}': {e}")
+            return 0x80  # Unspecified Error
+
+        if reason_code == 0x00:
+            with self.lock:
+                if self._generations.get(username, 0) != generation:
+                    return reason_code  # The user changed while the hash ran: checked, but not remembered
+                self._cache[key] = username
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return reason_code
+
+    def _verify(self, username, password) -> int:
+        stored_hash = self.db.get_password_hash(username)
+        if stored_hash is None or not self.verify_password(password, stored_hash):
+            return 0x86  # Bad Username or Password
+        if not stored_hash.startswith(self.HASH_SCHEME + "$"):
+            # Upgrade legacy SHA-256 hashes on the first successful login
+            self.db.set_password_hash(username, self.hash_password(password))
+        return 0x00
+
+    def add_user(self, username: str, password: str) -> bool:
+        """Creates a user or changes its password."""
+        changed = self.db.set_password_hash(username, self.hash_password(password))
+        self.invalidate(username)
+        return changed
+
+    def remove_user(self, username: str) -> bool:
+        removed = self.db.remove_user(username)
+        self.invalidate(username)
+        return removed
+
+    def invalidate(self, username: str) -> None:
+        """
+        Drops the cached logins of a user, e.g. after a password change. Called once the change is
+        stored; logins still being verified against the old hash are then not cached either.
+        """
+        with self.lock:
+            self._generations[username] = self._generations.get(username, 0) + 1
+            for key in [key for key, cached_username in self._cache.items() if cached_username == username]:
+                del self._cache[key]
+
+    def _credential_digest(self, username, password) -> bytes:
+        message = username.encode() + b"\x00" + (password or "").encode()
+        return hmac.new(self._cache_key, message, hashlib.sha256).digest()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
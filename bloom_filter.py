@@ -0,0 +1,53 @@
+import hashlib
+import threading
+
+
+class CountingBloomFilter:
+    """
+    Counting Bloom filter: answers "definitely absent" or "maybe present" for string keys and,
+    unlike a plain Bloom filter, supports removal. Counters saturate at 255 and then stay put.
+    """
+
+    def __init__(self, size=1 << 16, hash_count=4):
+        self.size = size
+        self.hash_count = hash_count
+        self.counters = bytearray(size)
+        self.items = 0
+        self.lock = threading.Lock()  # Counter updates are read-modify-write
+
+    def _indexes(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:], 'big') | 1
+        # Double hashing gives hash_count independent-enough positions from one digest
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str) -> None:
+        indexes = self._indexes(key)
+        with self.lock:
+            for index in indexes:
+                if self.counters[index] < 255:
+                    self.counters[index] += 1
+            self.items += 1
+
+    def remove(self, key: str) -> None:
+        indexes = self._indexes(key)
+        with self.lock:
+            if not all(self.counters[index] for index in indexes):
+                return  # Never added
+            for index in indexes:
+                # A saturated counter no longer knows its real count, so it is never decremented
+                if self.counters[index] < 255:
+                    self.counters[index] -= 1
+            self.items = max(0, self.items - 1)
+
+    def might_contain(self, key: str) -> bool:
+        return all(self.counters[index] for index in self._indexes(key))
+
+    def clear(self) -> None:
+        with self.lock:
+            self.counters = bytearray(self.size)
+            self.items = 0
+
+    def __contains__(self, key: str) -> bool:
+        return self.might_contain(key)
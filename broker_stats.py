@@ -0,0 +1,97 @@
+import threading
+from collections import deque
+from time import monotonic, time
+
+
+class BrokerStats:
+    """
+    In-process throughput and latency metrics. The server and the dispatcher add to running counters
+    as traffic flows; `tick`, called about once per second, turns them into one sample (rates,
+    gauges and delivery latency percentiles) kept in a ring buffer of `window` samples and pushed to
+    the subscribed listeners. Nothing is read from or written to the database.
+    """
+
+    def __init__(self, window=120, latency_window=10, latency_samples=4096):
+        self.samples = deque(maxlen=window)  # Most recent samples, oldest first
+        self.latency_window = latency_window  # Seconds of deliveries the percentiles are computed over
+        self.latencies = deque(maxlen=latency_samples)  # (monotonic time, seconds), newest last
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._last_totals = (0, 0, 0, 0)
+        self._last_tick = monotonic()
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    # Recording, called from the connection threads and the dispatcher
+    def record_in(self, messages=0, nbytes=0) -> None:
+        with self.lock:
+            self.messages_in += messages
+            self.bytes_in += nbytes
+
+    def record_out(self, messages=0, nbytes=0) -> None:
+        with self.lock:
+            self.messages_out += messages
+            self.bytes_out += nbytes
+
+    def record_latency(self, seconds: float) -> None:
+        with self.lock:
+            self.latencies.append((monotonic(), seconds))
+
+    # Sampling
+    def subscribe(self, listener) -> None:
+        """Registers `listener(sample)`, called from the sampling thread after every tick."""
+        with self.lock:
+            self.listeners.append(listener)
+
+    def unsubscribe(self, listener) -> None:
+        with self.lock:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+
+    def tick(self, sessions=0, queue_depth=0) -> dict:
+        """Closes the current interval: appends a sample to the ring buffer and notifies the listeners."""
+        now = monotonic()
+        with self.lock:
+            elapsed = max(now - self._last_tick, 1e-6)
+            totals = (self.messages_in, self.messages_out, self.bytes_in, self.bytes_out)
+            rates = [(total - last) / elapsed for total, last in zip(totals, self._last_totals)]
+            self._last_totals = totals
+            self._last_tick = now
+            while self.latencies and self.latencies[0][0] < now - self.latency_window:
+                self.latencies.popleft()
+            latencies = sorted(seconds for _, seconds in self.latencies)
+            sample = {
+                "time": time(),
+                "messages_in": rates[0],
+                "messages_out": rates[1],
+                "bytes_in": rates[2],
+                "bytes_out": rates[3],
+                "sessions": sessions,
+                "queue_depth": queue_depth,
+                "latency_p50": _percentile(latencies, 50),
+                "latency_p95": _percentile(latencies, 95),
+                "latency_p99": _percentile(latencies, 99),
+            }
+            self.samples.append(sample)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            try:
+                listener(sample)
+            except Exception as e:
+                print(f"Error notifying stats listener: {e}")
+        return sample
+
+    def history(self) -> list:
+        """The samples in the ring buffer, oldest first."""
+        with self.lock:
+            return list(self.samples)
+
+
+def _percentile(values, percent):
+    """Nearest-rank percentile of sorted `values`, 0.0 when there are none."""
+    if not values:
+        return 0.0
+    rank = max(1, -(-len(values) * percent // 100))
+    return values[int(rank) - 1]
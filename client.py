@@ -1,5 +1,8 @@
+import threading
+
+
 class Client:
-    def __init__(self, client_id, username=None, password=None, clean_session=True, keep_alive=60, session_expiry=0, isLastWill=0):
+    def __init__(self, client_id, username=None, password=None, clean_session=True, keep_alive=60, session_expiry=0, isLastWill=0, receive_maximum=65535):
         self.client_id = client_id
         self.username = username
         self.password = password
@@ -7,8 +10,13 @@ class Client:
         self.keep_alive = keep_alive
         self.session_expiry = session_expiry
         self.connected = False
+        self.session_present = False  # Set when CONNECT resumed an existing session
         self.last_seen = None
         self.isLastWill = isLastWill
+        self.receive_maximum = receive_maximum  # Receive Maximum requested by the client in CONNECT
+        # Flow-control window: QoS 1/2 deliveries awaiting acknowledgement for this session
+        self.send_window = threading.BoundedSemaphore(receive_maximum)
+        self.inbound_qos2 = {}  # {packet_id: Message} received with QoS 2, published on PUBREL
 
         #self.subscriptions = {}  # {topic: qos}
 
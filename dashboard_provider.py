@@ -0,0 +1,120 @@
+import threading
+from PyQt5.QtCore import QThread, pyqtSignal
+
+
+class DashboardDataProvider(QThread):
+    """
+    Runs the dashboard's reads against the broker's storage backend on a background thread and
+    hands the results to the widgets through signals, so the Qt event loop never waits on the
+    storage (SQLServer serves these reads over a read-only connection). Requests are coalesced per
+    kind: while a query runs, newer requests of the same kind replace older pending ones.
+    """
+
+    topics_loaded = pyqtSignal(object)  # set of topic paths
+    clients_loaded = pyqtSignal(object)  # {client_id: [(topic_filter, columns)]}
+    subscriptions_loaded = pyqtSignal(object)  # {topic path: [(client_id, columns)]}
+    last_messages_loaded = pyqtSignal(str, object)  # topic, [(payload, published_at)]
+    qos_page_loaded = pyqtSignal(int, str, object)  # generation, "older" or "newer", rows
+    query_failed = pyqtSignal(str)
+
+    def __init__(self, storage, parent=None):
+        super().__init__(parent)
+        self.storage = storage  # StorageBackend with the dashboard read methods
+        self._pending = {}  # {request kind: arguments}, only the latest request of each kind
+        self._condition = threading.Condition()
+        self._stopping = False
+
+    # Requests, called from the GUI thread
+    def request_refresh(self):
+        """Reloads the topic list and both subscription trees."""
+        self._submit("refresh", ())
+
+    def request_last_messages(self, topic):
+        self._submit("last_messages", (topic,))
+
+    def request_qos_page(self, generation, direction, filters, key, page_size):
+        """
+        Loads one page of QoS 1/2 messages, newest first: rows older than `key` ("older") or
+        newer than `key` ("newer"). `generation` is echoed back so the model can drop stale pages.
+        """
+        self._submit("qos_" + direction, (generation, direction, filters, key, page_size))
+
+    def set_storage(self, storage):
+        """Reads from another backend, e.g. the one of a newly started server."""
+        with self._condition:
+            self.storage = storage
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+    def _submit(self, kind, arguments):
+        with self._condition:
+            self._pending[kind] = arguments
+            self._condition.notify()
+
+    # Provider thread
+    def run(self):
+        while True:
+            with self._condition:
+                while not self._pending and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    break
+                pending, self._pending = self._pending, {}
+            for kind, arguments in pending.items():
+                self._handle(kind, arguments)
+
+    def _handle(self, kind, arguments):
+        # A None result means the read failed; the widgets keep what they show
+        if kind == "refresh":
+            topics = self.storage.list_topics()
+            self._emit(self.topics_loaded, kind, None if topics is None else set(topics))
+            self._emit(self.clients_loaded, kind, self._load_connected_clients())
+            self._emit(self.subscriptions_loaded, kind, self._load_subscribed_clients())
+        elif kind == "last_messages":
+            topic, = arguments
+            messages = self.storage.last_messages(topic, 10)
+            if messages is None:
+                self.query_failed.emit(kind)
+            else:
+                self.last_messages_loaded.emit(topic, messages)
+        else:
+            generation, direction, filters, key, page_size = arguments
+            rows = self.storage.qos_message_page(direction, filters, key, page_size)
+            # An empty page still ends the model's pending request
+            self.qos_page_loaded.emit(generation, direction, [] if rows is None else rows)
+            if rows is None:
+                self.query_failed.emit(kind)
+
+    def _emit(self, signal, kind, result):
+        if result is None:
+            self.query_failed.emit(kind)
+        else:
+            signal.emit(result)
+
+    def _load_connected_clients(self):
+        rows = self.storage.connected_client_subscriptions()
+        if rows is None:
+            return None
+        groups = {}
+        for client_id, topic_filter, qos in rows:
+            children = groups.setdefault(client_id, [])
+            if topic_filter is not None:
+                children.append((topic_filter, (topic_filter, f"QoS: {qos}")))
+        for children in groups.values():
+            if not children:
+                children.append(("", ("No subscriptions",)))
+        return groups
+
+    def _load_subscribed_clients(self):
+        rows = self.storage.topic_subscribers()
+        if rows is None:
+            return None
+        groups = {}
+        for full_path, client_id in rows:
+            children = groups.setdefault(full_path, [])
+            if client_id is not None:
+                children.append((client_id, (client_id,)))
+        return groups
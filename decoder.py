@@ -72,6 +72,12 @@ class MQTTDecoder:
                 properties["response_topic"], index = self._decode_string(data, index)
             elif prop_id == 0x09:  # Correlation Data (Binary Data)
                 properties["correlation_data"], index = self._decode_binary_data(data, index)
+            elif prop_id == 0x18:  # Will Delay Interval (4-byte integer)
+                properties["will_delay_interval"] = struct.unpack("!I", data[index:index + 4])[0]
+                index += 4
+            elif prop_id == 0x21:  # Receive Maximum (2-byte integer)
+                properties["receive_maximum"] = struct.unpack("!H", data[index:index + 2])[0]
+                index += 2
             elif prop_id == 0x26:  # User Properties (UTF-8 key-value pairs)
                 if "user_properties" not in properties:
                     properties["user_properties"] = []
@@ -124,7 +130,9 @@ class MQTTDecoder:
 
         # Will fields
         will_flag = bool(connect_flags & 0x04)
-        print(f"Will Flag: {will_flag}")
+        will_qos = (connect_flags >> 3) & 0x03 if will_flag else 0
+        will_retain = bool(connect_flags & 0x20) if will_flag else False
+        print(f"Will Flag: {will_flag}, Will QoS: {will_qos}, Will Retain: {will_retain}")
         will_properties = {}
         will_topic = None
         will_message = None
@@ -166,6 +174,8 @@ class MQTTDecoder:
             "properties": properties,
             "client_id": client_id,
             "will_flag": will_flag,
+            "will_qos": will_qos,
+            "will_retain": will_retain,
             "will_properties": will_properties,
             "will_topic": will_topic,
             "will_message": will_message,
@@ -315,12 +325,19 @@ class MQTTDecoder:
     def _decode_disconnect(self, data):
         remaining_length, index = self._decode_remaining_length(data, 1)
 
+        # Reason code (absent means 0x00, Normal disconnection)
+        reason_code = 0x00
+        if remaining_length > 0:
+            reason_code = data[index]
+            index += 1
+
         # Properties
         properties = {}
-        if remaining_length > 0:
+        if remaining_length > 1:
             properties, _ = self._decode_properties(data, index)
 
         return {
             "packet_type": "DISCONNECT",
+            "reason_code": reason_code,
             "properties": properties
         }
@@ -0,0 +1,66 @@
+from collections import deque
+from time import monotonic
+
+
+class DeliveryLane:
+    """
+    Ordered queues of pending deliveries for one subscriber, one per priority class. A lane is
+    served by at most one dispatcher worker at a time; within a class its messages leave in the
+    order they were routed, and more urgent classes are sent first.
+    """
+
+    __slots__ = ("subscriber_id", "queues", "scheduled", "scheduled_priority", "serving", "delivered")
+
+    def __init__(self, subscriber_id, priorities=("normal",)):
+        self.subscriber_id = subscriber_id
+        # {priority class: deque of (message, granted QoS, connection, enqueued at)}, most urgent first
+        self.queues = {priority: deque() for priority in priorities}
+        self.scheduled = False  # True while the lane waits in the ready queue or is being served
+        self.scheduled_priority = None  # Most urgent class the lane is queued under
+        self.serving = False  # True while a worker sends from the lane
+        self.delivered = 0
+
+    def append(self, message, qos, conn, priority=None):
+        queue = self.queues.get(priority)
+        if queue is None:
+            queue = next(reversed(self.queues.values()))  # Unknown classes wait with the least urgent
+        queue.append((message, qos, conn, monotonic()))
+
+    def take(self, limit):
+        """Removes and returns up to `limit` deliveries, most urgent class first."""
+        batch = []
+        for queue in self.queues.values():
+            while queue and len(batch) < limit:
+                batch.append(queue.popleft())
+        return batch
+
+    def push_front(self, items):
+        """Puts deliveries taken with `take` back at the head of their class, keeping their order."""
+        for item in reversed(items):
+            queue = self.queues.get(item[0].priority)
+            if queue is None:
+                queue = next(reversed(self.queues.values()))
+            queue.appendleft(item)
+
+    def top_priority(self):
+        """Most urgent class with pending deliveries, or None if the lane is empty."""
+        for priority, queue in self.queues.items():
+            if queue:
+                return priority
+        return None
+
+    def discard(self, message) -> int:
+        """Drops the pending deliveries of one message, searching only its class. Returns the number removed."""
+        priority = message.priority if message.priority in self.queues else next(reversed(self.queues))
+        queue = self.queues[priority]
+        kept = [item for item in queue if item[0] is not message]
+        if len(kept) == len(queue):
+            return 0
+        self.queues[priority] = deque(kept)
+        return len(queue) - len(kept)
+
+    def __len__(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def __repr__(self):
+        return f"<DeliveryLane subscriber_id={self.subscriber_id} pending={len(self)}>"
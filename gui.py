@@ -2,11 +2,13 @@ import sys
 from PyQt5.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QLabel,
     QTabWidget, QListWidget, QListWidgetItem, QTextEdit, QHBoxLayout,
-    QPushButton, QLineEdit, QTreeWidget, QTreeWidgetItem, QHeaderView
+    QPushButton, QLineEdit, QTreeWidget, QTreeWidgetItem, QHeaderView, QTableView
 )
 from PyQt5.QtCore import QTimer, QThread
-import sqlite3
 from server import MQTT5Server
+from dashboard_provider import DashboardDataProvider
+from qos_message_model import QosMessageTableModel
+from stats_tab import StatsTab
 
 class ServerThread(QThread):
     def __init__(self, server_instance):
@@ -20,11 +22,17 @@ class MQTTGUI(QMainWindow):
     def __init__(self, db_name="mqtt_server.db"):
         super().__init__()
         self.db_name = db_name
+        # Rows currently shown, so refreshes only apply what changed
+        self.topic_items = {}  # {full_path: QListWidgetItem}
+        self.client_items = {}  # {client_id: (QTreeWidgetItem, {topic_filter: QTreeWidgetItem})}
+        self.subscription_items = {}  # {full_path: (QTreeWidgetItem, {client_id: QTreeWidgetItem})}
         self.setWindowTitle("MQTT Broker Dashboard")
         self.setGeometry(100, 100, 1000, 600)
 
-        self.server_instance = MQTT5Server()
+        self.server_instance = MQTT5Server(db_file=db_name)
         self.server_thread = None
+        # Every query runs on this thread against the server's storage, results come back through signals
+        self.data_provider = DashboardDataProvider(self.server_instance.db)
 
         self.tabs = QTabWidget()
         self.setCentralWidget(self.tabs)
@@ -34,12 +42,15 @@ class MQTTGUI(QMainWindow):
         self.connected_clients_tab = QWidget()  # New Tab
         self.subscribed_clients_tab = QWidget()
         self.qos_messages_tab = QWidget()
+        self.stats_tab = StatsTab()
 
         self.tabs.addTab(self.topic_history_tab, "Topic History")
         self.tabs.addTab(self.last_messages_tab, "Last 10 Messages")
         self.tabs.addTab(self.connected_clients_tab, "Connected Clients")  # Add the new tab
         self.tabs.addTab(self.subscribed_clients_tab, "Subscribed Clients")
         self.tabs.addTab(self.qos_messages_tab, "QoS 1/2 Messages")
+        self.tabs.addTab(self.stats_tab, "Live Stats")
+        self.stats_tab.attach(self.server_instance.stats)
 
         self.init_topic_history_tab()
         self.init_last_messages_tab()
@@ -49,24 +60,34 @@ class MQTTGUI(QMainWindow):
 
         self.init_server_controls()
 
+        self.data_provider.topics_loaded.connect(self.show_topic_history)
+        self.data_provider.clients_loaded.connect(self.show_connected_clients)
+        self.data_provider.subscriptions_loaded.connect(self.show_subscribed_clients)
+        self.data_provider.last_messages_loaded.connect(self.show_last_messages)
+        self.data_provider.start()
+        self.refresh_all_tabs()
+
         # Set up timers for refreshing data
         self.refresh_interval = 5000  # milliseconds
         self.setup_timers()
 
-    def _get_connection(self):
-        return sqlite3.connect(self.db_name)
-
     def setup_timers(self):
         self.timer = QTimer()
         self.timer.timeout.connect(self.refresh_all_tabs)
         self.timer.start(self.refresh_interval)
 
     def refresh_all_tabs(self):
-        self.load_topic_history()
-        self.load_connected_clients()  # Refresh connected clients
-        self.load_subscribed_clients()
+        # Requests are coalesced by the provider, a slow query never stacks refreshes
+        self.data_provider.request_refresh()
         self.load_qos_messages()
 
+    def closeEvent(self, event):
+        self.timer.stop()
+        self.data_provider.stop()
+        self.data_provider.wait()
+        self.stop_server()
+        super().closeEvent(event)
+
     # Server Controls
     def init_server_controls(self):
         control_layout = QHBoxLayout()
@@ -81,17 +102,55 @@ class MQTTGUI(QMainWindow):
         control_layout.addWidget(self.start_server_button)
         control_layout.addWidget(self.stop_server_button)
 
+        # Broker users: clients connecting with a username need an account
+        user_layout = QHBoxLayout()
+        self.username_input = QLineEdit()
+        self.username_input.setPlaceholderText("Username")
+        self.password_input = QLineEdit()
+        self.password_input.setPlaceholderText("Password")
+        self.password_input.setEchoMode(QLineEdit.Password)
+        self.add_user_button = QPushButton("Add / Update User")
+        self.add_user_button.clicked.connect(self.add_user)
+        self.remove_user_button = QPushButton("Remove User")
+        self.remove_user_button.clicked.connect(self.remove_user)
+        user_layout.addWidget(self.username_input)
+        user_layout.addWidget(self.password_input)
+        user_layout.addWidget(self.add_user_button)
+        user_layout.addWidget(self.remove_user_button)
+
         main_layout = QVBoxLayout()
         main_layout.addLayout(control_layout)
+        main_layout.addLayout(user_layout)
         self.server_control_widget = QWidget()
         self.server_control_widget.setLayout(main_layout)
 
         self.tabs.addTab(self.server_control_widget, "Server Controls")
 
+    def add_user(self):
+        username = self.username_input.text().strip()
+        password = self.password_input.text()
+        if not username or not password or self.server_instance is None:
+            print("A username, a password and a server instance are needed to add a user")
+            return
+        if self.server_instance.add_user(username, password):
+            print(f"User '{username}' saved")
+        self.password_input.clear()
+
+    def remove_user(self):
+        username = self.username_input.text().strip()
+        if not username or self.server_instance is None:
+            return
+        if self.server_instance.remove_user(username):
+            print(f"User '{username}' removed")
+
     def start_server(self):
         if not self.server_thread or not self.server_thread.isRunning():
             print("Starting Server....................")
-            self.server_instance.shutdown_event.clear()
+            if self.server_instance is None:
+                # A shut down server cannot be restarted; the new one warm starts from its snapshot
+                self.server_instance = MQTT5Server(db_file=self.db_name)
+                self.stats_tab.attach(self.server_instance.stats)
+                self.data_provider.set_storage(self.server_instance.db)
             self.server_thread = ServerThread(self.server_instance)
 
             self.server_thread.start()
@@ -107,8 +166,10 @@ class MQTTGUI(QMainWindow):
             #self.server_thread.wait()
             #self.server_thread = None
             print(f'Stopping server........................')
-            self.server_instance.shutdown_event.set()
+            self.stats_tab.detach()
+            self.server_instance.shutdown()
             self.server_thread.wait()
+            self.server_instance = None
             (self.start_server_button.setEnabled(True))
             self.stop_server_button.setEnabled(False)
 
@@ -116,18 +177,17 @@ class MQTTGUI(QMainWindow):
     def init_topic_history_tab(self):
         layout = QVBoxLayout()
         self.topic_list = QListWidget()
+        self.topic_list.setSortingEnabled(True)
         layout.addWidget(self.topic_list)
         self.topic_history_tab.setLayout(layout)
-        self.load_topic_history()
 
-    def load_topic_history(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT DISTINCT full_path FROM topics ORDER BY full_path")
-            topics = cursor.fetchall()
-            self.topic_list.clear()
-            for topic in topics:
-                self.topic_list.addItem(topic[0])
+    def show_topic_history(self, topics):
+        """Applies a topic list loaded by the data provider."""
+        for full_path in set(self.topic_items) - topics:
+            self.topic_list.takeItem(self.topic_list.row(self.topic_items.pop(full_path)))
+        for full_path in topics - set(self.topic_items):
+            item = self.topic_items[full_path] = QListWidgetItem(full_path)
+            self.topic_list.addItem(item)  # The list is sorted, new topics land in place
 
     # Last 10 Messages Tab
     def init_last_messages_tab(self):
@@ -156,23 +216,24 @@ class MQTTGUI(QMainWindow):
             self.messages_display.setPlainText("Please enter a topic.")
             return
 
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT payload, published_at FROM messages
-                JOIN topics ON messages.topic_id = topics.id
-                WHERE topics.full_path = ?
-                ORDER BY published_at DESC
-                LIMIT 10
-            """, (topic,))
-            messages = cursor.fetchall()
-            if messages:
-                display_text = ""
-                for payload, published_at in messages:
-                    display_text += f"[{published_at}] {payload}\n"
-                self.messages_display.setPlainText(display_text)
-            else:
-                self.messages_display.setPlainText("No messages found for this topic.")
+        if self.server_instance is not None:
+            # Served from the broker's in-memory ring, without a database query
+            history = self.server_instance.topic_history.last(topic, 10)
+            self.show_last_messages(topic, [(payload, published_at) for payload, _, published_at in history])
+            return
+        self.messages_display.setPlainText("Loading...")
+        self.data_provider.request_last_messages(topic)
+
+    def show_last_messages(self, topic, messages):
+        if topic != self.topic_input.text():
+            return  # The topic changed while the query ran
+        if messages:
+            display_text = ""
+            for payload, published_at in messages:
+                display_text += f"[{published_at}] {payload}\n"
+            self.messages_display.setPlainText(display_text)
+        else:
+            self.messages_display.setPlainText("No messages found for this topic.")
 
     # Connected Clients Tab
     def init_connected_clients_tab(self):
@@ -182,48 +243,10 @@ class MQTTGUI(QMainWindow):
         self.clients_tree.header().setSectionResizeMode(QHeaderView.Stretch)
         layout.addWidget(self.clients_tree)
         self.connected_clients_tab.setLayout(layout)
-        self.load_connected_clients()
-
-    def load_connected_clients(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT client_id FROM clients
-                WHERE connected = 1
-                ORDER BY client_id
-            """)
-            clients = cursor.fetchall()
-            self.clients_tree.clear()
-            for (client_id,) in clients:
-                client_item = QTreeWidgetItem([client_id])
-                # Get subscriptions for this client
-                cursor.execute("""
-                    SELECT topic_filter, qos FROM subscriptions
-                    WHERE client_id = ? AND topic_filter IS NOT NULL
-                """, (client_id,))
-                wildcard_subs = cursor.fetchall()
-                cursor.execute("""
-                    SELECT topics.full_path, subscriptions.qos
-                    FROM subscriptions
-                    JOIN topics ON subscriptions.topic_id = topics.id
-                    WHERE subscriptions.client_id = ? AND subscriptions.topic_id IS NOT NULL
-                """, (client_id,))
-                direct_subs = cursor.fetchall()
-                # Combine subscriptions
-                all_subs = []
-                for topic_filter, qos in wildcard_subs:
-                    all_subs.append((topic_filter, qos))
-                for full_path, qos in direct_subs:
-                    all_subs.append((full_path, qos))
-                if all_subs:
-                    for topic, qos in all_subs:
-                        sub_item = QTreeWidgetItem([topic, f"QoS: {qos}"])
-                        client_item.addChild(sub_item)
-                else:
-                    sub_item = QTreeWidgetItem(["No subscriptions"])
-                    client_item.addChild(sub_item)
-                self.clients_tree.addTopLevelItem(client_item)
-            self.clients_tree.expandAll()
+
+    def show_connected_clients(self, groups):
+        """Applies connected clients and their subscriptions loaded by the data provider."""
+        self._sync_tree(self.clients_tree, self.client_items, groups)
 
     # Subscribed Clients Tab
     def init_subscribed_clients_tab(self):
@@ -233,54 +256,80 @@ class MQTTGUI(QMainWindow):
         self.subscriptions_tree.header().setSectionResizeMode(QHeaderView.Stretch)
         layout.addWidget(self.subscriptions_tree)
         self.subscribed_clients_tab.setLayout(layout)
-        self.load_subscribed_clients()
-
-    def load_subscribed_clients(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            # Get all topics
-            cursor.execute("SELECT id, full_path FROM topics ORDER BY full_path")
-            topics = cursor.fetchall()
-            self.subscriptions_tree.clear()
-            for topic_id, full_path in topics:
-                topic_item = QTreeWidgetItem([full_path])
-                # Get clients subscribed to this topic
-                cursor.execute("""
-                    SELECT clients.client_id
-                    FROM subscriptions
-                    JOIN clients ON subscriptions.client_id = clients.client_id
-                    WHERE subscriptions.topic_id = ?
-                """, (topic_id,))
-                clients = cursor.fetchall()
-                for client in clients:
-                    client_item = QTreeWidgetItem([client[0]])
-                    topic_item.addChild(client_item)
-                self.subscriptions_tree.addTopLevelItem(topic_item)
-            self.subscriptions_tree.expandAll()
+
+    def show_subscribed_clients(self, groups):
+        """Applies topics and their subscribers loaded by the data provider."""
+        self._sync_tree(self.subscriptions_tree, self.subscription_items, groups)
 
     # QoS Messages Tab
     def init_qos_messages_tab(self):
         layout = QVBoxLayout()
-        self.qos_messages_list = QListWidget()
-        layout.addWidget(self.qos_messages_list)
+
+        # Filters: MQTT topic filter and published_at bounds
+        filter_layout = QHBoxLayout()
+        self.qos_topic_filter_input = QLineEdit()
+        self.qos_topic_filter_input.setPlaceholderText("Topic filter (e.g. sensors/+/temp or alarms/#)")
+        self.qos_since_input = QLineEdit()
+        self.qos_since_input.setPlaceholderText("From (YYYY-MM-DD HH:MM:SS)")
+        self.qos_until_input = QLineEdit()
+        self.qos_until_input.setPlaceholderText("Until (YYYY-MM-DD HH:MM:SS)")
+        self.qos_filter_button = QPushButton("Apply Filters")
+        self.qos_filter_button.clicked.connect(self.apply_qos_filters)
+        for widget in (self.qos_topic_filter_input, self.qos_since_input, self.qos_until_input,
+                       self.qos_filter_button):
+            filter_layout.addWidget(widget)
+        layout.addLayout(filter_layout)
+
+        # Rows are fetched page by page as the view scrolls
+        self.qos_messages_model = QosMessageTableModel(self.data_provider)
+        self.qos_messages_view = QTableView()
+        self.qos_messages_view.setModel(self.qos_messages_model)
+        self.qos_messages_view.horizontalHeader().setSectionResizeMode(QHeaderView.Interactive)
+        self.qos_messages_view.horizontalHeader().setStretchLastSection(True)
+        self.qos_messages_view.verticalHeader().setVisible(False)
+        layout.addWidget(self.qos_messages_view)
         self.qos_messages_tab.setLayout(layout)
-        self.load_qos_messages()
+
+    def apply_qos_filters(self):
+        self.qos_messages_model.set_filters(
+            topic_filter=self.qos_topic_filter_input.text().strip(),
+            since=self.qos_since_input.text().strip(),
+            until=self.qos_until_input.text().strip()
+        )
 
     def load_qos_messages(self):
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT messages.payload, topics.full_path, messages.qos, messages.published_at
-                FROM messages
-                JOIN topics ON messages.topic_id = topics.id
-                WHERE messages.qos IN (1, 2)
-                ORDER BY messages.published_at DESC
-            """)
-            messages = cursor.fetchall()
-            self.qos_messages_list.clear()
-            for payload, topic, qos, published_at in messages:
-                item_text = f"[{published_at}] Topic: {topic}, QoS: {qos}, Message: {payload}"
-                self.qos_messages_list.addItem(item_text)
+        # Only the messages stored since the newest loaded row are queried
+        self.qos_messages_model.refresh()
+
+    def _sync_tree(self, tree, index, groups):
+        """
+        Updates a two-level tree in place. `groups` maps each top-level key to its
+        [(child key, column texts)] in display order; `index` maps the keys already shown to
+        (item, {child key: item}). Only added, removed or changed rows touch the widget.
+        """
+        for key in [key for key in index if key not in groups]:
+            item, _ = index.pop(key)
+            tree.takeTopLevelItem(tree.indexOfTopLevelItem(item))
+        for position, (key, children) in enumerate(groups.items()):
+            entry = index.get(key)
+            if entry is None:
+                item = QTreeWidgetItem([key])
+                tree.insertTopLevelItem(position, item)
+                item.setExpanded(True)
+                entry = index[key] = (item, {})
+            item, child_items = entry
+            wanted = {child_key for child_key, _ in children}
+            for child_key in [child_key for child_key in child_items if child_key not in wanted]:
+                item.removeChild(child_items.pop(child_key))
+            for child_position, (child_key, columns) in enumerate(children):
+                child = child_items.get(child_key)
+                if child is None:
+                    child = child_items[child_key] = QTreeWidgetItem(list(columns))
+                    item.insertChild(child_position, child)
+                else:
+                    for column, text in enumerate(columns):
+                        if child.text(column) != text:
+                            child.setText(column, text)
 
 
 def main():
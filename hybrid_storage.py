@@ -0,0 +1,222 @@
+import threading
+from time import time
+from queue import Queue, Empty
+from typing import Optional, List, Tuple
+from client import Client
+from message import Message
+from memory_storage import MemoryStorage, _timestamp
+from sqlServer import SQLServer
+
+
+class HybridStorage(MemoryStorage):
+    """
+    In-memory storage with asynchronous SQLite durability. Sessions, users, subscriptions, retained
+    messages, wills and topic history are loaded from the database at startup and then served from
+    memory; every change is queued and applied to an SQLServer by a writer thread, so callers never
+    wait on disk. Consecutive archived messages are written in one transaction.
+    The message archive itself is not kept in memory: its reads and retention go to SQLite.
+    Changes still queued when the process dies are lost; `flush` waits until the queue is written.
+    """
+
+    def __init__(self, db_name="mqtt_server.db", batch_size=500, **settings):
+        super().__init__(**settings)
+        self.sqlite = SQLServer(db_name, **settings)
+        self.batch_size = batch_size  # Queued changes applied per writer round
+        self.writes = Queue()  # (SQLServer method name, arguments), None stops the writer
+        self._load()
+        self._writer = threading.Thread(target=self._write_behind, daemon=True)
+        self._writer.start()
+
+    def _load(self):
+        for client_id, banned, clean_session, keep_alive, session_expiry, last_seen in self.sqlite.load_clients():
+            self.clients[client_id] = {
+                "banned": banned, "clean_session": clean_session, "connected": False, "keep_alive": keep_alive,
+                "session_expiry": session_expiry, "last_seen": time() if last_seen is None else last_seen
+            }
+        self.users = self.sqlite.load_users()
+        for client_id, topic_filter, qos, options in self.sqlite.load_subscriptions():
+            self.subscriptions.setdefault(client_id, {})[topic_filter] = (qos, options)
+        self.topics = set(self.sqlite.list_topics() or [])
+        self.retained = {message.topic: message for message in self.sqlite.load_retained_messages()}
+        self.wills = {will.client_id: will for will in self.sqlite.load_will_messages()}
+
+    # Write-behind
+    def _enqueue(self, method: str, *arguments) -> None:
+        self.writes.put((method, arguments))
+
+    def _write_behind(self):
+        while True:
+            batch = [self.writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.writes.get_nowait())
+                except Empty:
+                    break
+            stopping = self._apply(batch)
+            for _ in batch:
+                self.writes.task_done()
+            if stopping:
+                return
+
+    def _apply(self, batch) -> bool:
+        """Applies queued changes in order. Returns True if the batch contains the stop marker."""
+        messages = []
+        for operation in batch:
+            if operation is not None and operation[0] == "save_message":
+                messages.append(operation[1])
+                continue
+            if messages:
+                self.sqlite.save_message_batch(messages)
+                messages = []
+            if operation is None:
+                return True
+            method, arguments = operation
+            try:
+                getattr(self.sqlite, method)(*arguments)
+            except Exception as e:
+                print(f"Error writing '{method}' behind to SQLite: {e}")
+        if messages:
+            self.sqlite.save_message_batch(messages)
+        return False
+
+    def flush(self) -> None:
+        """Blocks until every queued change has been written to SQLite."""
+        self.writes.join()
+
+    def close(self) -> None:
+        if self._writer.is_alive():
+            self.writes.put(None)
+            self._writer.join()
+
+    # Changes: applied to memory, then queued for SQLite
+    def establish_session(self, decoded_packet: dict) -> Optional[Client]:
+        session = super().establish_session(decoded_packet)
+        self._enqueue("establish_session", decoded_packet)
+        return session
+
+    def update_disconnect_time(self, client_id: str) -> None:
+        super().update_disconnect_time(client_id)
+        self._enqueue("update_disconnect_time", client_id)
+
+    def reset_connected_flags(self) -> None:
+        super().reset_connected_flags()
+        self._enqueue("reset_connected_flags")
+
+    def expire_sessions(self, batch_size: int = 500) -> dict:
+        reclaimed = super().expire_sessions(batch_size)
+        if any(reclaimed.values()):
+            self._enqueue("expire_sessions", batch_size)
+        return reclaimed
+
+    def set_client_banned(self, client_id: str, banned: bool) -> bool:
+        super().set_client_banned(client_id, banned)
+        self._enqueue("set_client_banned", client_id, banned)
+        return True
+
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        super().set_password_hash(username, password_hash)
+        self._enqueue("set_password_hash", username, password_hash)
+        return True
+
+    def remove_user(self, username: str) -> bool:
+        removed = super().remove_user(username)
+        if removed:
+            self._enqueue("remove_user", username)
+        return removed
+
+    def save_subscriptions(self, client_id: str, subscriptions: List[Tuple[str, int, int]]) -> Optional[List[bool]]:
+        new_flags = super().save_subscriptions(client_id, subscriptions)
+        if subscriptions:
+            self._enqueue("save_subscriptions", client_id, list(subscriptions))
+        return new_flags
+
+    def remove_subscriptions(self, client_id: str, topics: List[str]) -> Optional[List[bool]]:
+        removed = super().remove_subscriptions(client_id, topics)
+        if any(removed):
+            self._enqueue("remove_subscriptions", client_id, list(topics))
+        return removed
+
+    def remove_all_subscriptions_for_client(self, client_id: str) -> bool:
+        removed = super().remove_all_subscriptions_for_client(client_id)
+        if removed:
+            self._enqueue("remove_all_subscriptions_for_client", client_id)
+        return removed
+
+    def save_retained_batch(self, retained: dict) -> bool:
+        super().save_retained_batch(retained)
+        self._enqueue("save_retained_batch", dict(retained))
+        return True
+
+    def clear_expired_retained(self, now: Optional[float] = None) -> int:
+        cleared = super().clear_expired_retained(now)
+        self._enqueue("clear_expired_retained", now)
+        return cleared
+
+    def save_will_batch(self, wills: dict) -> bool:
+        super().save_will_batch(wills)
+        self._enqueue("save_will_batch", dict(wills))
+        return True
+
+    def save_topic_history_batch(self, entries: List[Tuple[str, str, int, str]], depth: int) -> bool:
+        super().save_topic_history_batch(entries, depth)
+        self._enqueue("save_topic_history_batch", list(entries), depth)
+        return True
+
+    def prune_topic_history(self, max_age: float, batch_size: int = 500) -> List[str]:
+        idle = super().prune_topic_history(max_age, batch_size)
+        self._enqueue("prune_topic_history", max_age, batch_size)
+        return idle
+
+    def load_topic_history(self, depth: int) -> dict:
+        history = self.sqlite.load_topic_history(depth)
+        super().save_topic_history_batch(
+            [(topic, payload, qos, published_at) for topic, entries in history.items()
+             for payload, qos, published_at in entries],
+            depth
+        )
+        return history
+
+    # Message archive: written behind, read from SQLite
+    def save_message(self, message: Message) -> bool:
+        with self.lock:
+            self.topics.add(message.topic)
+        # Stamped now: the row may only be written a little later
+        self._enqueue("save_message", message, _timestamp())
+        return True
+
+    def retrieve_message_by_packet_id(self, packet_id) -> Optional[Message]:
+        return self.sqlite.retrieve_message_by_packet_id(packet_id)
+
+    def set_compression(self, compression) -> None:
+        super().set_compression(compression)
+        self.sqlite.set_compression(compression)
+
+    def save_compression_dictionary(self, prefix: str, dictionary: bytes) -> Optional[int]:
+        return self.sqlite.save_compression_dictionary(prefix, dictionary)
+
+    def sample_payloads(self, prefix: str, limit: int = 1000) -> list:
+        return self.sqlite.sample_payloads(prefix, limit)
+
+    def replay_messages(self, topic_filter: str, start: str, end: str, after=None, limit: int = 500) -> Optional[List[Message]]:
+        return self.sqlite.replay_messages(topic_filter, start, end, after, limit)
+
+    def prune_messages_older_than(self, max_age: float, batch_size: int = 500) -> int:
+        return self.sqlite.prune_messages_older_than(max_age, batch_size)
+
+    def topic_overflow(self, max_per_topic: int) -> dict:
+        return self.sqlite.topic_overflow(max_per_topic)
+
+    def prune_topic_overflow(self, overflow: dict, batch_size: int = 500) -> int:
+        return self.sqlite.prune_topic_overflow(overflow, batch_size)
+
+    def prune_oldest_messages(self, batch_size: int = 500) -> int:
+        return self.sqlite.prune_oldest_messages(batch_size)
+
+    def database_size(self) -> Tuple[int, int]:
+        return self.sqlite.database_size()
+
+    def incremental_vacuum(self, pages: int) -> int:
+        return self.sqlite.incremental_vacuum(pages)
+
+    def qos_message_page(self, direction: str, filters: dict, key, page_size: int) -> Optional[list]:
+        return self.sqlite.qos_message_page(direction, filters, key, page_size)
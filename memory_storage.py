@@ -0,0 +1,441 @@
+import threading
+from bisect import bisect_left, bisect_right
+from collections import deque
+from itertools import count, islice
+from time import time, gmtime, strftime
+from typing import Optional, List, Tuple
+from client import Client
+from message import Message
+from will_message import WillMessage
+from storage import StorageBase
+
+
+def _timestamp(epoch=None) -> str:
+    """Same format as SQLite's CURRENT_TIMESTAMP."""
+    return strftime("%Y-%m-%d %H:%M:%S", gmtime(epoch))
+
+
+class MemoryStorage(StorageBase):
+    """
+    Storage backend kept entirely in memory, with the same behaviour as SQLServer; nothing survives a
+    restart. Meant for benchmark and test runs. `max_messages` bounds the message archive, oldest
+    messages first (None keeps everything, subject to the retention policy).
+    """
+
+    def __init__(self, max_messages=None, **settings):
+        super().__init__(**settings)
+        self.lock = threading.RLock()
+        # {client_id: {"banned", "clean_session", "connected", "keep_alive", "session_expiry", "last_seen"}}
+        self.clients = {}
+        self.users = {}  # {username: password hash}
+        self.subscriptions = {}  # {client_id: {topic_filter: (qos, options)}}
+        self.topics = set()  # Known topic paths, like the SQLite `topics` table
+        self.retained = {}  # {topic: Message}
+        self.wills = {}  # {client_id: WillMessage}
+        # Archive records (id, published_at, topic, qos, payload, retain, packet_id, expires_at), oldest first.
+        # A list so replays can bisect it; the oldest records are dropped by moving `_head` past them,
+        # and the list is compacted once the dropped prefix outgrows the live records
+        self.messages = []
+        self._head = 0
+        self.max_messages = max_messages
+        self.archive_bytes = 0  # Payload and topic bytes held by the archive
+        self.history = {}  # {topic: deque of (payload, qos, published_at)}, oldest first
+        self._message_ids = count(1)
+        self._dictionary_ids = count(1)
+
+    # Sessions and clients
+    def _client(self, client_id: str) -> dict:
+        client = self.clients.get(client_id)
+        if client is None:
+            client = self.clients[client_id] = {
+                "banned": False, "clean_session": True, "connected": False, "keep_alive": 60,
+                "session_expiry": 0, "last_seen": time()
+            }
+        return client
+
+    def establish_session(self, decoded_packet: dict) -> Optional[Client]:
+        client_id = decoded_packet.get("client_id")
+        clean_start = decoded_packet.get("clean_session")
+        with self.lock:
+            session_present = client_id in self.clients and not clean_start
+            self._client(client_id).update(
+                clean_session=bool(clean_start),
+                connected=True,
+                keep_alive=decoded_packet.get("keep_alive", 60),
+                session_expiry=decoded_packet.get("properties", {}).get("session_expiry_interval", 0),
+                last_seen=time()
+            )
+            # Clean Start discards any existing session state
+            removed_filters = list(self.subscriptions.pop(client_id, {})) if clean_start else []
+        if removed_filters:
+            self._forget_subscriptions(removed_filters)
+            self.subscription_cache.invalidate_client(client_id)
+        return self._new_session(decoded_packet, session_present)
+
+    def update_disconnect_time(self, client_id: str) -> None:
+        with self.lock:
+            client = self.clients.get(client_id)
+            if client is not None:
+                client.update(connected=False, last_seen=time())
+
+    def reset_connected_flags(self) -> None:
+        with self.lock:
+            for client in self.clients.values():
+                client["connected"] = False
+
+    def expire_sessions(self, batch_size: int = 500) -> dict:
+        """Removes disconnected sessions whose Session Expiry Interval has elapsed (see SQLServer)."""
+        reclaimed = {"clients": 0, "subscriptions": 0, "will_messages": 0}
+        now = time()
+        with self.lock:
+            expired = [
+                client_id for client_id, client in self.clients.items()
+                if not client["connected"]
+                and client["session_expiry"] < 4294967295  # 0xFFFFFFFF means the session never expires
+                and now - client["last_seen"] >= client["session_expiry"]
+                and (not client["banned"] or client_id in self.subscriptions or client_id in self.wills)
+            ]
+            removed_filters = []
+            for client_id in expired:
+                filters = self.subscriptions.pop(client_id, {})
+                removed_filters.extend(filters)
+                reclaimed["subscriptions"] += len(filters)
+                reclaimed["will_messages"] += self.wills.pop(client_id, None) is not None
+                if not self.clients[client_id]["banned"]:
+                    del self.clients[client_id]
+                    reclaimed["clients"] += 1
+        self._forget_subscriptions(removed_filters)
+        for client_id in expired:
+            self.subscription_cache.invalidate_client(client_id)
+        return reclaimed
+
+    def load_banned_clients(self) -> List[str]:
+        with self.lock:
+            return [client_id for client_id, client in self.clients.items() if client["banned"]]
+
+    def set_client_banned(self, client_id: str, banned: bool) -> bool:
+        with self.lock:
+            self._client(client_id)["banned"] = bool(banned)
+        return True
+
+    # Users
+    def get_password_hash(self, username: str) -> Optional[str]:
+        with self.lock:
+            return self.users.get(username)
+
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        with self.lock:
+            self.users[username] = password_hash
+        return True
+
+    def remove_user(self, username: str) -> bool:
+        with self.lock:
+            return self.users.pop(username, None) is not None
+
+    # Subscriptions
+    def save_subscriptions(self, client_id: str, subscriptions: List[Tuple[str, int, int]]) -> Optional[List[bool]]:
+        if not subscriptions:
+            return []
+        with self.lock:
+            stored = self.subscriptions.setdefault(client_id, {})
+            existing = set(stored)
+            for topic, qos, options in subscriptions:
+                stored[topic] = (qos, options)
+                if '+' not in topic and '#' not in topic:
+                    self.topics.add(topic)
+        new_flags = [topic not in existing for topic, _, _ in subscriptions]
+        for (topic, _, _), is_new in zip(subscriptions, new_flags):
+            if is_new:
+                self.subscription_filter.add(self._subscription_key(topic))
+            self.subscription_cache.invalidate_filter(topic)
+        return new_flags
+
+    def remove_subscriptions(self, client_id: str, topics: List[str]) -> Optional[List[bool]]:
+        if not topics:
+            return []
+        with self.lock:
+            stored = self.subscriptions.get(client_id, {})
+            existing = set(stored)
+            for topic in topics:
+                stored.pop(topic, None)
+            if not stored:
+                self.subscriptions.pop(client_id, None)
+        removed_filters = [topic for topic in set(topics) if topic in existing]
+        self._forget_subscriptions(removed_filters)
+        for topic in removed_filters:
+            self.subscription_cache.invalidate_filter(topic)
+        return [topic in existing for topic in topics]
+
+    def remove_all_subscriptions_for_client(self, client_id: str) -> bool:
+        with self.lock:
+            removed_filters = list(self.subscriptions.pop(client_id, {}))
+        if not removed_filters:
+            print(f"No subscriptions found for client '{client_id}'.")
+            return False
+        self._forget_subscriptions(removed_filters)
+        self.subscription_cache.invalidate_client(client_id)
+        return True
+
+    def get_subscribers(self, topic_name: str) -> List[Tuple[str, int, int]]:
+        subscribers = self.subscription_cache.get(topic_name)
+        if subscribers is not None:
+            return subscribers
+        generation = self.subscription_cache.generation()
+        with self.lock:
+            subscribers = [
+                (client_id, qos, options or 0)
+                for client_id, filters in self.subscriptions.items()
+                for topic_filter, (qos, options) in filters.items()
+                if self.matches_wildcard(topic_filter, topic_name)
+            ]
+        self.subscription_cache.put(topic_name, subscribers, generation)
+        return subscribers
+
+    def list_topic_filters(self) -> List[str]:
+        with self.lock:
+            return [topic_filter for filters in self.subscriptions.values() for topic_filter in filters]
+
+    # Retained messages and wills
+    def load_retained_messages(self) -> List[Message]:
+        with self.lock:
+            return [message for message in self.retained.values() if not message.is_expired()]
+
+    def save_retained_batch(self, retained: dict) -> bool:
+        with self.lock:
+            for topic, message in retained.items():
+                if message is None:
+                    self.retained.pop(topic, None)
+                else:
+                    self.retained[topic] = message
+                    self.topics.add(topic)
+        return True
+
+    def clear_expired_retained(self, now: Optional[float] = None) -> int:
+        with self.lock:
+            expired = [topic for topic, message in self.retained.items() if message.is_expired(now)]
+            for topic in expired:
+                del self.retained[topic]
+        return len(expired)
+
+    def load_will_messages(self) -> List[WillMessage]:
+        with self.lock:
+            return list(self.wills.values())
+
+    def save_will_batch(self, wills: dict) -> bool:
+        with self.lock:
+            for client_id, will in wills.items():
+                if will is None:
+                    self.wills.pop(client_id, None)
+                else:
+                    self.wills[client_id] = will
+                    self.topics.add(will.topic)
+        return True
+
+    # Message archive, topic history and retention
+    def save_message(self, message: Message) -> bool:
+        record = (next(self._message_ids), _timestamp(), message.topic, message.qos, message.payload,
+                  message.retain, message.packet_id, message.expires_at)
+        with self.lock:
+            self.messages.append(record)
+            self.archive_bytes += _record_size(record)
+            self.topics.add(message.topic)
+            if self.max_messages is not None and len(self.messages) - self._head > self.max_messages:
+                self._drop_oldest(1)
+        return True
+
+    def _records(self):
+        """The archive's live records, oldest first. Call with the lock held."""
+        return islice(self.messages, self._head, None)
+
+    def _newest_records(self):
+        """The archive's live records, newest first. Call with the lock held."""
+        return islice(reversed(self.messages), len(self.messages) - self._head)
+
+    def _drop_oldest(self, limit: int) -> int:
+        removed = 0
+        while self._head < len(self.messages) and removed < limit:
+            self.archive_bytes -= _record_size(self.messages[self._head])
+            self.messages[self._head] = None  # Release the payload now, the slot goes at the next compaction
+            self._head += 1
+            removed += 1
+        if self._head > 1024 and self._head * 2 > len(self.messages):
+            del self.messages[:self._head]
+            self._head = 0
+        return removed
+
+    def retrieve_message_by_packet_id(self, packet_id) -> Optional[Message]:
+        with self.lock:
+            for _, _, topic, qos, payload, retain, record_packet_id, expires_at in self._newest_records():
+                if record_packet_id == packet_id:
+                    return Message(topic=topic, payload=payload, qos=qos, retain=retain, packet_id=packet_id,
+                                   expires_at=expires_at)
+        return None
+
+    def save_compression_dictionary(self, prefix: str, dictionary: bytes) -> Optional[int]:
+        dictionary_id = next(self._dictionary_ids)
+        if self.compression is not None:
+            self.compression.add_dictionary(dictionary_id, prefix, dictionary)
+        return dictionary_id
+
+    def sample_payloads(self, prefix: str, limit: int = 1000) -> list:
+        with self.lock:
+            samples = [record[4] for record in self._newest_records() if record[2].startswith(prefix)]
+        return samples[:limit]
+
+    def replay_messages(self, topic_filter: str, start: str, end: str, after=None, limit: int = 500) -> Optional[List[Message]]:
+        # Records are kept in id order, which is (published_at, id) order unless the clock stepped back:
+        # the first record is found by binary search over the list (a resumed page starts after the
+        # previous id) and the archive is read forward until the page is full or `end` is reached
+        records = []
+        with self.lock:
+            archive = self.messages
+            if after is None:
+                first = bisect_left(archive, start, self._head, key=lambda record: record[1])
+            else:
+                first = bisect_right(archive, after[1], self._head, key=lambda record: record[0])
+            for index in range(first, len(archive)):
+                record = archive[index]
+                if record[1] >= end or len(records) >= limit:
+                    break
+                if record[1] >= start and self.matches_wildcard(topic_filter, record[2]):
+                    records.append(record)
+        messages = []
+        for message_id, published_at, topic, qos, payload, retain, _, expires_at in records:
+            message = Message(topic=topic, payload=payload, qos=qos, retain=retain, published_at=published_at,
+                              expires_at=expires_at)
+            message.message_id = message_id
+            messages.append(message)
+        return messages
+
+    def load_topic_history(self, depth: int) -> dict:
+        with self.lock:
+            return {topic: list(ring)[-depth:] for topic, ring in self.history.items()}
+
+    def save_topic_history_batch(self, entries: List[Tuple[str, str, int, str]], depth: int) -> bool:
+        with self.lock:
+            for topic, payload, qos, published_at in entries:
+                ring = self.history.get(topic)
+                if ring is None or ring.maxlen != depth:
+                    ring = self.history[topic] = deque(ring or (), maxlen=depth)
+                ring.append((payload, qos, published_at))
+                self.topics.add(topic)
+        return True
+
+    def prune_topic_history(self, max_age: float, batch_size: int = 500) -> List[str]:
+        cutoff = _timestamp(time() - max_age)
+        with self.lock:
+            idle = [topic for topic, ring in self.history.items() if not ring or ring[-1][2] < cutoff][:batch_size]
+            for topic in idle:
+                del self.history[topic]
+        return idle
+
+    def prune_messages_older_than(self, max_age: float, batch_size: int = 500) -> int:
+        cutoff = _timestamp(time() - max_age)
+        removed = 0
+        with self.lock:
+            while (self._head < len(self.messages) and removed < batch_size
+                   and self.messages[self._head][1] < cutoff):
+                removed += self._drop_oldest(1)
+        return removed
+
+    def topic_overflow(self, max_per_topic: int) -> dict:
+        with self.lock:
+            counts = {}
+            for record in self._records():
+                counts[record[2]] = counts.get(record[2], 0) + 1
+        return {topic: number - max_per_topic for topic, number in counts.items() if number > max_per_topic}
+
+    def prune_topic_overflow(self, overflow: dict, batch_size: int = 500) -> int:
+        if not overflow:
+            return 0
+        with self.lock:
+            kept = []
+            removed = 0
+            for record in self._records():
+                topic = record[2]
+                if removed < batch_size and overflow.get(topic, 0) > 0:
+                    overflow[topic] -= 1
+                    removed += 1
+                    self.archive_bytes -= _record_size(record)
+                else:
+                    kept.append(record)
+            self.messages = kept
+            self._head = 0
+        for topic in [topic for topic, excess in overflow.items() if excess <= 0]:
+            del overflow[topic]
+        return removed
+
+    def prune_oldest_messages(self, batch_size: int = 500) -> int:
+        with self.lock:
+            return self._drop_oldest(batch_size)
+
+    def database_size(self) -> Tuple[int, int]:
+        """Bytes held by the archive; memory has no free pages."""
+        return self.archive_bytes, 0
+
+    def incremental_vacuum(self, pages: int) -> int:
+        return 0
+
+    # Dashboard reads
+    def list_topics(self) -> Optional[List[str]]:
+        with self.lock:
+            return sorted(self.topics)
+
+    def connected_client_subscriptions(self) -> Optional[List[Tuple[str, Optional[str], Optional[int]]]]:
+        with self.lock:
+            rows = []
+            for client_id in sorted(client_id for client_id, client in self.clients.items() if client["connected"]):
+                filters = sorted(self.subscriptions.get(client_id, {}).items())
+                rows.extend((client_id, topic_filter, qos) for topic_filter, (qos, _) in filters)
+                if not filters:
+                    rows.append((client_id, None, None))
+            return rows
+
+    def topic_subscribers(self) -> Optional[List[Tuple[str, Optional[str]]]]:
+        with self.lock:
+            subscribers = {}
+            for client_id, filters in self.subscriptions.items():
+                for topic_filter in filters:
+                    if '+' not in topic_filter and '#' not in topic_filter:
+                        subscribers.setdefault(topic_filter, []).append(client_id)
+            rows = []
+            for topic in sorted(self.topics):
+                clients = sorted(subscribers.get(topic, []))
+                rows.extend((topic, client_id) for client_id in clients)
+                if not clients:
+                    rows.append((topic, None))
+            return rows
+
+    def last_messages(self, topic: str, limit: int = 10) -> Optional[List[Tuple[str, str]]]:
+        with self.lock:
+            entries = list(self.history.get(topic, ()))
+        return [(payload, published_at) for payload, _, published_at in reversed(entries[-limit:])]
+
+    def qos_message_page(self, direction: str, filters: dict, key, page_size: int) -> Optional[list]:
+        """One page of QoS 1/2 messages, newest first; same keyset semantics as SQLServer.qos_message_page."""
+        with self.lock:
+            records = list(self._records())
+        page = []
+        # Ids follow publish order, so walking backwards yields (published_at, id) in descending order
+        for message_id, published_at, topic, qos, payload, _, _, _ in reversed(records):
+            if qos not in (1, 2):
+                continue
+            if key is not None:
+                position = (published_at, message_id)
+                if (direction == "older" and position >= tuple(key)) or (direction != "older" and position <= tuple(key)):
+                    continue
+            if filters.get("since") and published_at < filters["since"]:
+                continue
+            if filters.get("until") and published_at > filters["until"]:
+                continue
+            if filters.get("topic_filter") and not self.matches_wildcard(filters["topic_filter"], topic):
+                continue
+            page.append((message_id, published_at, topic, qos, payload))
+            if len(page) >= page_size:
+                break
+        return page
+
+
+def _record_size(record) -> int:
+    payload = record[4]
+    return len(record[2]) + (len(payload) if isinstance(payload, (str, bytes, bytearray)) else 0)
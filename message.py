@@ -1,5 +1,9 @@
+import math
+from time import time
+
+
 class Message:
-    def __init__(self, topic, payload, qos, packet_id: int = None, retain=False,  published_at=None):
+    def __init__(self, topic, payload, qos, packet_id: int = None, retain=False,  published_at=None, message_expiry_interval=None, expires_at=None, user_properties=None, priority=None):
         self.topic = topic
         self.payload = payload
         self.qos = qos
@@ -8,6 +12,27 @@ class Message:
         self.published_at = published_at  # Optional: Timestamp when the message was published
         self.message_id = None  # Optional: Unique identifier for the message
         self.delivered = False  # Optional: Delivery status for the message
+        self.message_expiry_interval = message_expiry_interval  # Optional: Message Expiry Interval in seconds
+        # Absolute expiry time (epoch seconds), None if the message never expires
+        if expires_at is None and message_expiry_interval is not None:
+            expires_at = time() + message_expiry_interval
+        self.expires_at = expires_at
+        self.user_properties = user_properties  # Optional: MQTT 5 user properties, forwarded to subscribers
+        self.priority = priority  # Optional: dispatch priority class assigned by the broker
+
+    def remaining_expiry(self, now=None):
+        """Returns the whole seconds left before the message expires, or None if it never expires."""
+        if self.expires_at is None:
+            return None
+        now = time() if now is None else now
+        return max(0, math.ceil(self.expires_at - now))
+
+    def is_expired(self, now=None):
+        """Checks whether the Message Expiry Interval has elapsed."""
+        if self.expires_at is None:
+            return False
+        now = time() if now is None else now
+        return now >= self.expires_at
 
     def __repr__(self):
         return f"<Message topic={self.topic} qos={self.qos} retain={self.retain}>"
@@ -1,144 +1,373 @@
 from concurrent.futures import ThreadPoolExecutor
-from queue import Queue, Empty
+from queue import Empty
 import threading
 import socket
+import weakref
+from time import monotonic, time
 from decoder import MQTTDecoder
-from packet_creator import create_publish_packet, create_pubrel_packet, create_disconnect_packet
+from delivery_lane import DeliveryLane
+from adaptive_pool import AdaptivePoolController
+from priority import WeightedFairQueue
+from packet_creator import create_publish_packet, create_pubrel_packet
 
 class MessageDispatcher:
-    def __init__(self, db, max_workers=5):
+    """
+    Routes published messages to their subscribers. A single router thread resolves the subscribers
+    of each queued message and appends one delivery per subscriber to that subscriber's lane.
+    Workers serve the lanes: a lane is handled by one worker at a time, so messages reach a
+    subscriber in publish order, and a slow subscriber only delays its own lane. The number of
+    workers follows the load between `min_workers` and `max_workers` (see `autoscale`).
+    Both the routing queue and the ready lanes are weighted fair queues over the messages'
+    priority classes, so urgent traffic is routed and sent ahead of bulk traffic under load.
+    """
+
+    def __init__(self, db, min_workers=2, max_workers=16, max_stream_window=10, lane_quantum=16, controller=None,
+                 priority_weights=None, stats=None, expiry=None):
         self.db = db
+        self.stats = stats  # Optional BrokerStats fed with sent messages and delivery latencies
+        # Optional ExpiryHeap: messages with an expiry are tracked only while a copy is queued here
+        self.expiry = expiry
+        self.expiring = {}  # {id(message): (message, {None (routing queue) or subscriber_id: copies})}
+        self.expiring_lock = threading.Lock()
+        self.max_stream_window = max_stream_window  # Upper bound on in-flight QoS 1/2 messages per stream
+        self.lane_quantum = lane_quantum  # Deliveries a worker sends from one lane before serving the next
+        # Acknowledgement handshakes (PUBACK, PUBREC/PUBREL/PUBCOMP) of lane and stream deliveries
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
-        self.message_queue = Queue()
+        self.message_queue = WeightedFairQueue(priority_weights)
+        self.priorities = tuple(self.message_queue.weights)  # Most urgent first
+        self.lanes = {}  # {subscriber_id: DeliveryLane} for subscribers with pending deliveries
+        self.lanes_lock = threading.Lock()
+        self.ready_lanes = WeightedFairQueue(priority_weights)  # Lanes waiting for a worker, by most urgent delivery
         self.packet_id_counter = 0
+        self.packet_id_lock = threading.Lock()
         self.pending_acks = {}
         self.pending_acks_lock = threading.Lock()
+        # One lock per connection: lanes, streams, acknowledgement flows and the connection thread share its socket
+        self.write_locks = weakref.WeakKeyDictionary()
+        self.write_locks_lock = threading.Lock()
         self.shutdown_event = threading.Event()
-        self.isKillSwitch = False
+        self.controller = controller or AdaptivePoolController(min_workers=min_workers, max_workers=max_workers)
+        self.workers = 0
+        self.workers_lock = threading.Lock()
 
-        # Start worker threads to process messages
-        for _ in range(max_workers):
-            threading.Thread(target=self._process_queue, daemon=True).start()
+        # One router keeps the routing order, the workers multiplex the lanes
+        threading.Thread(target=self._process_queue, daemon=True).start()
+        self._spawn_workers(self.controller.min_workers)
 
-    def dispatch_message(self, message, active_connections, isKillSwitch = False):
+    def dispatch_message(self, message, active_connections):
         """Enqueue a message for dispatching."""
-        print('Enqueuing message for dispatch')
-        self.isKillSwitch = isKillSwitch
-        self.message_queue.put((message, active_connections))
+        self._hold(message, None)
+        self.message_queue.put((message, active_connections), message.priority)
+
+    def send(self, conn, packet) -> None:
+        """Writes a whole packet to a connection, never interleaved with another writer's packet."""
+        with self.write_locks_lock:
+            lock = self.write_locks.get(conn)
+            if lock is None:
+                lock = self.write_locks[conn] = threading.Lock()
+        with lock:
+            conn.sendall(packet)
+
+    def stream_to_session(self, client, conn, deliveries):
+        """
+        Streams messages straight to one session, bypassing the shared queue and the subscriber lookup.
+        `deliveries` is an iterable of (message, granted_qos) pairs, consumed lazily so large result
+        sets start flowing immediately. PUBLISH packets are written by the stream's own thread, in
+        order; QoS 1/2 acknowledgements are awaited in the pool, paced by the session's flow-control window.
+        """
+        # Own thread: a stream blocked on its window must not hold a pool worker its sends need
+        threading.Thread(target=self._stream, args=(client, conn, deliveries), daemon=True).start()
+
+    def _stream(self, client, conn, deliveries):
+        window = threading.BoundedSemaphore(max(1, min(client.receive_maximum, self.max_stream_window)))
+        sent = 0
+        try:
+            for message, granted_qos in deliveries:
+                if self.shutdown_event.is_set():
+                    break
+                if conn.fileno() == -1:
+                    print(f"Stopped streaming to '{client.client_id}': connection closed")
+                    break
+                if min(granted_qos, message.qos) == 0:
+                    self._write_publish(client.client_id, conn, message, granted_qos)
+                else:
+                    # Wait for a free slot in both the stream window and the session's Receive Maximum
+                    window.acquire()
+                    client.send_window.acquire()
+                    delivery = self._write_publish(client.client_id, conn, message, granted_qos)
+                    if delivery is None:
+                        client.send_window.release()
+                        window.release()
+                    else:
+                        self.executor.submit(self._await_windowed, client, conn, delivery, window)
+                sent += 1
+        except Exception as e:
+            print(f"Error streaming messages to '{client.client_id}': {e}")
+        print(f"Streamed {sent} message(s) to '{client.client_id}'")
+
+    def _await_windowed(self, client, conn, delivery, window):
+        try:
+            self._await_ack(client.client_id, conn, *delivery)
+        finally:
+            client.send_window.release()
+            window.release()
+
+    def _hold(self, message, location):
+        """Counts a queued copy of an expiring message; the first copy registers it with the expiry heap."""
+        if self.expiry is None or message.expires_at is None:
+            return
+        with self.expiring_lock:
+            entry = self.expiring.get(id(message))
+            if entry is None:
+                entry = self.expiring[id(message)] = (message, {})
+                self.expiry.track(message, self._on_expired)
+            entry[1][location] = entry[1].get(location, 0) + 1
+
+    def _release(self, message, location):
+        """A queued copy was routed, sent or dropped; the last one unregisters the message."""
+        if self.expiry is None or message.expires_at is None:
+            return
+        with self.expiring_lock:
+            entry = self.expiring.get(id(message))
+            if entry is None or entry[0] is not message or location not in entry[1]:
+                return  # Already purged as expired
+            entry[1][location] -= 1
+            if entry[1][location] <= 0:
+                del entry[1][location]
+            if not entry[1]:
+                del self.expiring[id(message)]
+                self.expiry.untrack(message, self._on_expired)
+
+    def _on_expired(self, messages):
+        """Expiry heap callback: removes the queued copies of expired messages from where they wait."""
+        removed = 0
+        for message in messages:
+            with self.expiring_lock:
+                entry = self.expiring.pop(id(message), None)
+            if entry is None or entry[0] is not message:
+                continue
+            for location in entry[1]:
+                if location is None:
+                    removed += self.message_queue.discard(lambda item: item[0] is message, message.priority)
+                    continue
+                with self.lanes_lock:
+                    lane = self.lanes.get(location)
+                    if lane is None:
+                        continue
+                    removed += lane.discard(message)
+                    if not len(lane) and not lane.serving:
+                        # Its entry in the ready queue is skipped by the worker that picks it up
+                        lane.scheduled = False
+                        del self.lanes[location]
+        if removed:
+            print(f"Removed {removed} expired message(s) from the dispatch queue")
+        return removed
 
     def _process_queue(self):
-        """Continuously process the message queue and dispatch messages."""
+        """Router: resolves the subscribers of each queued message and fills their delivery lanes."""
         while not self.shutdown_event.is_set():
             try:
-                if self.isKillSwitch == False:
-                    message, active_connections = self.message_queue.get(timeout=1)
-                    print('Dispatching message from queue')
-
-                    # Retrieve the subscribers for the topic
-                    subscribers = self.db.get_subscribers(message.topic)
-                    if not subscribers:
-                        print(f"No subscribers found for topic '{message.topic}'")
-                    else:
-                        for subscriber_id, qos_for_subscriber in subscribers:
-                            subscriber_conn = active_connections.get(subscriber_id)
-
-                            # Submit the message-sending task
-                            if subscriber_conn:
-                                self.executor.submit(
-                                    self._send_message,
-                                    subscriber_id,
-                                    subscriber_conn,
-                                    message,
-                                    qos_for_subscriber
-                                )
-
-                    self.message_queue.task_done()
-                else:
-                    message, active_connections = self.message_queue.get(timeout=1)
-                    for conn_id, connection in active_connections:
-                        self.executor.submit(
-                            self._send_message,
-                            conn_id,
-                            connection,
-                            message,
-                            1
-                        )
-
+                message, active_connections = self.message_queue.get(timeout=1)
             except Empty:
                 continue  # Continue if the queue is empty
+            try:
+                if message.is_expired():
+                    print(f"Dropping expired message for topic '{message.topic}'")
+                    continue
+                print('Dispatching message from queue')
+
+                # Retrieve the subscribers for the topic
+                subscribers = self.db.get_subscribers(message.topic)
+                if not subscribers:
+                    print(f"No subscribers found for topic '{message.topic}'")
+                else:
+                    for subscriber_id, qos_for_subscriber, _ in subscribers:
+                        subscriber_conn = active_connections.get(subscriber_id)
+                        if subscriber_conn:
+                            self._enqueue_delivery(subscriber_id, subscriber_conn, message, qos_for_subscriber)
             except Exception as e:
                 print(f"Error processing message from queue: {e}")
+            finally:
+                self._release(message, None)
+
+    def _enqueue_delivery(self, subscriber_id, subscriber_conn, message, qos_for_subscriber):
+        """
+        Appends a delivery to the subscriber's lane and hands the lane to a worker if it was idle.
+        A waiting lane that receives a more urgent delivery is queued again under that class.
+        """
+        priority = message.priority if message.priority in self.priorities else None
+        with self.lanes_lock:
+            lane = self.lanes.get(subscriber_id)
+            if lane is None:
+                lane = self.lanes[subscriber_id] = DeliveryLane(subscriber_id, self.priorities)
+            lane.append(message, qos_for_subscriber, subscriber_conn, priority)
+            self._hold(message, subscriber_id)
+            priority = lane.top_priority()
+            if not lane.scheduled:
+                lane.scheduled = True
+                lane.scheduled_priority = priority
+                self.ready_lanes.put(lane, priority)
+            elif not lane.serving and self._more_urgent(priority, lane.scheduled_priority):
+                lane.scheduled_priority = priority
+                self.ready_lanes.put(lane, priority)
+
+    def _more_urgent(self, priority, other):
+        return self.priorities.index(priority) < self.priorities.index(other)
+
+    def _spawn_workers(self, count):
+        with self.workers_lock:
+            self.workers += count
+        for _ in range(count):
+            threading.Thread(target=self._serve_lanes, daemon=True).start()
+
+    def backlog(self) -> int:
+        """Messages waiting for routing plus deliveries waiting in lanes."""
+        with self.lanes_lock:
+            queued = sum(len(lane) for lane in self.lanes.values())
+        return self.message_queue.qsize() + queued
+
+    def autoscale(self) -> int:
+        """Periodic job: adds workers when the controller asks for it. Returns the number added."""
+        with self.workers_lock:
+            workers = self.workers
+        with self.lanes_lock:
+            lanes = len(self.lanes)
+        added = self.controller.decide(workers, self.backlog(), lanes)
+        if added:
+            self._spawn_workers(added)
+        return added
+
+    def pool_metrics(self) -> dict:
+        with self.workers_lock:
+            workers = self.workers
+        return self.controller.metrics(workers)
+
+    def _serve_lanes(self):
+        """Worker: sends a quantum of deliveries from one ready lane at a time, in lane order."""
+        while not self.shutdown_event.is_set():
+            try:
+                lane = self.ready_lanes.get(timeout=self.controller.idle_timeout)
+            except Empty:
+                # Idle for a whole timeout: leave if the pool is above its minimum size
+                with self.workers_lock:
+                    if self.controller.may_retire(self.workers):
+                        self.workers -= 1
+                        return
+                continue
+            with self.lanes_lock:
+                # Skip entries left behind by a re-queued lane that is already served or drained
+                if lane.serving or not len(lane):
+                    continue
+                lane.serving = True
+                batch = lane.take(self.lane_quantum)
+            for index, (message, qos_for_subscriber, subscriber_conn, enqueued_at) in enumerate(batch):
+                if self.shutdown_event.is_set():
+                    # Hand the unsent rest back to the lane, `take_pending` saves it
+                    with self.lanes_lock:
+                        lane.push_front(batch[index:])
+                    break
+                self._deliver(lane.subscriber_id, subscriber_conn, message, qos_for_subscriber)
+                self._release(message, lane.subscriber_id)
+                latency = monotonic() - enqueued_at
+                self.controller.record_latency(latency)
+                if self.stats is not None:
+                    self.stats.record_latency(latency)
+                lane.delivered += 1
+            with self.lanes_lock:
+                lane.serving = False
+                if len(lane):
+                    # Round robin: go back behind the other ready lanes of the same class
+                    lane.scheduled_priority = lane.top_priority()
+                    self.ready_lanes.put(lane, lane.scheduled_priority)
+                else:
+                    lane.scheduled = False
+                    if self.lanes.get(lane.subscriber_id) is lane:
+                        del self.lanes[lane.subscriber_id]
+
+    def _deliver(self, subscriber_id, subscriber_conn, message, qos_for_subscriber):
+        """
+        Writes the PUBLISH packet in lane order and leaves the acknowledgement to the executor,
+        so the lane's next message does not wait for this one's PUBACK or PUBCOMP.
+        """
+        sent = self._write_publish(subscriber_id, subscriber_conn, message, qos_for_subscriber)
+        if sent is not None and sent[1] in (1, 2):
+            self.executor.submit(self._await_ack, subscriber_id, subscriber_conn, *sent)
 
-    def _send_message(self, subscriber_id, subscriber_conn, message, qos_for_subscriber):
-        """Send a message to a subscriber."""
+    def _write_publish(self, subscriber_id, subscriber_conn, message, qos_for_subscriber):
+        """
+        Sends one PUBLISH packet. For QoS 1/2 the acknowledgement event is registered first.
+        Returns (packet_id, effective_qos, event), or None if nothing was sent.
+        """
+        effective_qos = 0
+        packet_id = None
         try:
-            if self.isKillSwitch == False:
-                print(f'Sending message to subscriber {subscriber_id}')
-                packet_id = self._generate_packet_id()
-                effective_qos = min(qos_for_subscriber, message.qos)
-
-                # Initialize waiting event before sending the message
-                if effective_qos in (1, 2):
-                    event = threading.Event()
-                    with self.pending_acks_lock:
-                        self.pending_acks[packet_id] = event
-                        print(f"Initialized event for packet ID {packet_id}")
-
-                publish_packet = create_publish_packet(
-                    message.topic, message.payload, effective_qos, message.retain, packet_id
-                )
-
-                # Ensure the pending_acks entry is in place before sending the packet
-                subscriber_conn.sendall(publish_packet)
-                print(f"Sent PUBLISH packet with ID {packet_id} to '{subscriber_id}'")
-
-                if effective_qos == 1:
-                    # Wait for PUBACK
-                    if not event.wait(timeout=5):
-                        print(f"No PUBACK received for packet ID {packet_id} from '{subscriber_id}'")
-                elif effective_qos == 2:
-                    self._handle_qos2(subscriber_id, subscriber_conn, packet_id)
-            else:
-                subscriber_conn.sendall(create_disconnect_packet())
+            if message.is_expired():
+                print(f"Message for topic '{message.topic}' expired before delivery to '{subscriber_id}'")
+                return None
+            print(f'Sending message to subscriber {subscriber_id}')
+            packet_id = self._generate_packet_id()
+            effective_qos = min(qos_for_subscriber, message.qos)
 
-        except (socket.error, Exception) as e:
-            print(f"Error sending PUBLISH to subscriber '{subscriber_id}': {e}")
-        finally:
-            # Clean up the event after handling
+            # Initialize waiting event before sending the message
+            event = None
             if effective_qos in (1, 2):
+                event = threading.Event()
                 with self.pending_acks_lock:
-                    self.pending_acks.pop(packet_id, None)
-                    print(f"Removed packet ID {packet_id} from pending_acks")
+                    self.pending_acks[packet_id] = event
+                    print(f"Initialized event for packet ID {packet_id}")
 
-    def _handle_qos1(self, subscriber_id, subscriber_conn, packet_id, publish_packet):
-        """Handle QoS level 1 packet acknowledgment (PUBACK)."""
-        puback_event = threading.Event()
-        with self.pending_acks_lock:
-            self.pending_acks[packet_id] = puback_event
-            subscriber_conn.sendall(publish_packet)
+            # Forward the remaining lifetime so the subscriber sees the time left, not the original interval
+            properties = {
+                "message_expiry_interval": message.remaining_expiry(),
+                "user_properties": message.user_properties
+            }
+            publish_packet = create_publish_packet(
+                message.topic, message.payload, effective_qos, message.retain, packet_id, properties
+            )
+
+            # Ensure the pending_acks entry is in place before sending the packet
+            self.send(subscriber_conn, publish_packet)
             print(f"Sent PUBLISH packet with ID {packet_id} to '{subscriber_id}'")
-            print(f"Added PUBACK event for packet ID {packet_id} to pending_acks")
+            if self.stats is not None:
+                self.stats.record_out(1, len(publish_packet))
+            return packet_id, effective_qos, event
 
-        if puback_event.wait(timeout=5):
-            print(f"Received PUBACK for packet ID {packet_id} from '{subscriber_id}'")
-        else:
-            print(f"No PUBACK received for packet ID {packet_id} from '{subscriber_id}'")
+        except (socket.error, Exception) as e:
+            print(f"Error sending PUBLISH to subscriber '{subscriber_id}': {e}")
+            if effective_qos in (1, 2):
+                with self.pending_acks_lock:
+                    self.pending_acks.pop(packet_id, None)
+        return None
 
-        with self.pending_acks_lock:
-            self.pending_acks.pop(packet_id, None)
-            print(f"Removed packet ID {packet_id} from pending_acks")
+    def _await_ack(self, subscriber_id, subscriber_conn, packet_id, effective_qos, event):
+        """Completes the acknowledgement flow of a sent QoS 1/2 PUBLISH."""
+        try:
+            if effective_qos == 1:
+                # Wait for PUBACK
+                if not event.wait(timeout=5):
+                    print(f"No PUBACK received for packet ID {packet_id} from '{subscriber_id}'")
+            elif effective_qos == 2:
+                self._handle_qos2(subscriber_id, subscriber_conn, packet_id, event)
+        except (socket.error, Exception) as e:
+            print(f"Error completing delivery to subscriber '{subscriber_id}': {e}")
+        finally:
+            # Clean up the event after handling
+            with self.pending_acks_lock:
+                self.pending_acks.pop(packet_id, None)
+                print(f"Removed packet ID {packet_id} from pending_acks")
 
-    def _handle_qos2(self, subscriber_id, subscriber_conn, packet_id):
+    def _handle_qos2(self, subscriber_id, subscriber_conn, packet_id, pubrec_event=None):
         """Handle QoS level 2 packet acknowledgment flow."""
-        pubrec_event = threading.Event()
-        with self.pending_acks_lock:
-            self.pending_acks[packet_id] = pubrec_event
-            print(f"Added PUBREC event for packet ID {packet_id} to pending_acks")
+        if pubrec_event is None:
+            pubrec_event = threading.Event()
+            with self.pending_acks_lock:
+                self.pending_acks[packet_id] = pubrec_event
+                print(f"Added PUBREC event for packet ID {packet_id} to pending_acks")
 
         if pubrec_event.wait(timeout=5):
             print(f"Received PUBREC for packet ID {packet_id} from '{subscriber_id}'")
             pubrel_packet = create_pubrel_packet(packet_id)
-            subscriber_conn.sendall(pubrel_packet)
+            self.send(subscriber_conn, pubrel_packet)
             print(f"Sent PUBREL for packet ID {packet_id} to '{subscriber_id}'")
 
             pubcomp_event = threading.Event()
@@ -159,16 +388,66 @@ class MessageDispatcher:
 
     def _generate_packet_id(self):
         """Generate a new packet ID, ensuring it stays within the valid range."""
-        self.packet_id_counter = (self.packet_id_counter + 1) % 65536
-        if self.packet_id_counter == 0:
-            self.packet_id_counter = 1
-        return self.packet_id_counter
+        with self.packet_id_lock:
+            self.packet_id_counter = (self.packet_id_counter + 1) % 65536
+            if self.packet_id_counter == 0:
+                self.packet_id_counter = 1
+            return self.packet_id_counter
+
 
 
 
+    def drain(self, timeout) -> bool:
+        """
+        Waits up to `timeout` seconds until every queued message is routed, every lane is sent and
+        no acknowledgement is outstanding. Returns True if the dispatcher went idle in time.
+        """
+        deadline = monotonic() + timeout
+        while True:
+            with self.pending_acks_lock:
+                awaiting = len(self.pending_acks)
+            with self.lanes_lock:
+                lanes = len(self.lanes)
+            if not awaiting and not lanes and not self.message_queue.qsize():
+                return True
+            if monotonic() >= deadline:
+                print(f"Dispatcher not drained: {self.backlog()} queued in {lanes} lane(s), {awaiting} awaiting acknowledgement")
+                return False
+            self.shutdown_event.wait(0.05)
+
+    def take_pending(self) -> dict:
+        """
+        Stops routing and removes every delivery that was not sent, for the shutdown snapshot.
+        Returns {subscriber_id: [(message, granted QoS)]}, lane deliveries first, in order.
+        """
+        self.shutdown_event.set()
+        # Let workers finish the send in progress and return the rest of their batch
+        deadline = monotonic() + 1
+        while monotonic() < deadline:
+            with self.lanes_lock:
+                if not any(lane.serving for lane in self.lanes.values()):
+                    break
+            self.shutdown_event.wait(0.01)  # Already set, used as a non-busy sleep
+        pending = {}
+        with self.lanes_lock:
+            for subscriber_id, lane in self.lanes.items():
+                for message, qos, _, _ in lane.take(len(lane)):
+                    pending.setdefault(subscriber_id, []).append((message, qos))
+        while True:
+            try:
+                message, _ = self.message_queue.get(timeout=0)
+            except Empty:
+                break
+            for subscriber_id, qos, _ in self.db.get_subscribers(message.topic):
+                pending.setdefault(subscriber_id, []).append((message, qos))
+        now = time()
+        return {
+            subscriber_id: [(message, qos) for message, qos in deliveries if not message.is_expired(now)]
+            for subscriber_id, deliveries in pending.items()
+        }
 
-    def shutdown(self):
+    def shutdown(self, wait=True):
         """Shut down the dispatcher gracefully."""
         self.shutdown_event.set()
-        self.executor.shutdown(wait=True)
+        self.executor.shutdown(wait=wait)
         print("MessageDispatcher shutdown complete.")
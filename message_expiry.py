@@ -0,0 +1,117 @@
+import heapq
+import itertools
+import threading
+from time import time
+
+
+class ExpiryHeap:
+    """
+    Min-heap of messages ordered by their absolute expiry time.
+    Expired entries are popped in order and handed to the callback registered with them,
+    so queues and retained storage can drop dead data without scanning everything.
+    Holders track a message only while they keep it and `untrack` it once it is delivered or
+    replaced; untracked heap entries are skipped when popped and compacted away in bulk.
+    """
+
+    def __init__(self, max_sleep=1.0, compact_threshold=1024):
+        self._heap = []  # (expires_at, sequence, key), may hold entries that were untracked since
+        self._live = {}  # {(id(message), on_expire): (expires_at, sequence, message, on_expire)}
+        self._counter = itertools.count()
+        self.compact_threshold = compact_threshold  # Untracked heap entries tolerated before a rebuild
+        self.lock = threading.Lock()
+        self.max_sleep = max_sleep
+        self.shutdown_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def track(self, message, on_expire=None) -> bool:
+        """
+        Registers a message for expiry. `on_expire` receives the list of expired messages
+        that were registered with it. Tracking the same message with the same callback twice
+        keeps one entry. Returns False if the message never expires.
+        """
+        if message.expires_at is None:
+            return False
+        key = (id(message), on_expire)
+        with self.lock:
+            if key in self._live:
+                return True
+            earliest = self._heap[0][0] if self._heap else None
+            entry = (message.expires_at, next(self._counter), message, on_expire)
+            self._live[key] = entry
+            heapq.heappush(self._heap, (entry[0], entry[1], key))
+        # Wake up the purge thread if this message expires before anything else
+        if earliest is None or message.expires_at < earliest:
+            self._wakeup.set()
+        return True
+
+    def untrack(self, message, on_expire=None) -> bool:
+        """Forgets a message registered with `on_expire`, e.g. once delivered. Returns True if it was tracked."""
+        if message.expires_at is None:
+            return False
+        with self.lock:
+            if self._live.pop((id(message), on_expire), None) is None:
+                return False
+            stale = len(self._heap) - len(self._live)
+            if stale > self.compact_threshold and stale > len(self._live):
+                self._heap = [(expires_at, sequence, (id(live), callback))
+                              for expires_at, sequence, live, callback in self._live.values()]
+                heapq.heapify(self._heap)
+        return True
+
+    def next_expiry(self):
+        """Returns the earliest expiry time in the heap, or None if it is empty."""
+        with self.lock:
+            return self._heap[0][0] if self._heap else None
+
+    def purge_expired(self, now=None) -> int:
+        """Pops every expired entry and notifies its callback once per batch. Returns the purge count."""
+        now = time() if now is None else now
+        expired_by_callback = {}
+        with self.lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, sequence, key = heapq.heappop(self._heap)
+                entry = self._live.get(key)
+                if entry is None or entry[1] != sequence:
+                    continue  # Untracked since it was pushed
+                del self._live[key]
+                _, _, message, on_expire = entry
+                expired_by_callback.setdefault(on_expire, []).append(message)
+
+        purged = 0
+        for on_expire, messages in expired_by_callback.items():
+            purged += len(messages)
+            if on_expire is None:
+                continue
+            try:
+                on_expire(messages)
+            except Exception as e:
+                print(f"Error purging expired messages: {e}")
+        return purged
+
+    def __len__(self):
+        with self.lock:
+            return len(self._live)
+
+    def start(self):
+        """Starts the background thread that purges entries as they expire."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.shutdown_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self.shutdown_event.is_set():
+            next_expiry = self.next_expiry()
+            timeout = self.max_sleep if next_expiry is None else min(self.max_sleep, max(0.0, next_expiry - time()))
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+            purged = self.purge_expired()
+            if purged:
+                print(f"Purged {purged} expired message(s)")
+
+    def shutdown(self):
+        """Stops the purge thread."""
+        self.shutdown_event.set()
+        self._wakeup.set()
@@ -112,23 +112,29 @@ def create_suback_packet(packet_id, return_codes):
     remaining_length = len(variable_header) + len(payload)
 
     # Construct the Fixed Header with the correct Remaining Length
-    fixed_header = struct.pack("!BB", packet_type, remaining_length)
+    fixed_header = bytes([packet_type]) + encode_remaining_length(remaining_length)
 
     # Combine all parts to form the SUBACK packet
     suback_packet = fixed_header + variable_header + payload
     return suback_packet
 
 
-def create_unsuback_packet(packet_id):
+def create_unsuback_packet(packet_id, reason_codes=None):
     # Packet Type
     packet_type = 0xB0  # UNSUBACK packet type
     variable_header = packet_id.to_bytes(2, 'big')  # Packet Identifier
 
+    # MQTT 5.0: empty properties followed by one reason code per topic filter
+    payload = b''
+    if reason_codes is not None:
+        variable_header += b'\x00'  # Properties Length is 0
+        payload = bytes(reason_codes)
+
     # Calculate Remaining Length
-    remaining_length = len(variable_header)
+    remaining_length = len(variable_header) + len(payload)
     fixed_header = bytearray([packet_type]) + encode_remaining_length(remaining_length)
 
-    return fixed_header + variable_header
+    return fixed_header + variable_header + payload
 
 def create_pingresp_packet():
     return bytearray([0xD0, 0x00])  # PINGRESP packet type with zero remaining length
@@ -234,6 +240,52 @@ def create_pubcomp_packet(packet_id, reason_code=0x00, properties=None):
     return fixed_header + variable_header + properties_section
 
 
+def encode_publish_properties(properties):
+    """
+    Encodes the MQTT 5.0 properties of a PUBLISH packet (without the property length prefix).
+
+    :param properties: Dictionary using the same keys as the decoder (e.g. `message_expiry_interval`).
+    :return: The encoded properties as a bytearray.
+    """
+    properties_bytes = bytearray()
+
+    if properties.get("payload_format_indicator") is not None:
+        properties_bytes.extend([0x01])  # Property identifier for payload format indicator
+        properties_bytes.append(properties["payload_format_indicator"])
+
+    if properties.get("message_expiry_interval") is not None:
+        properties_bytes.extend([0x02])  # Property identifier for message expiry interval
+        properties_bytes.extend(properties["message_expiry_interval"].to_bytes(4, 'big'))
+
+    if properties.get("content_type") is not None:
+        properties_bytes.extend([0x03])  # Property identifier for content type
+        content_type_bytes = properties["content_type"].encode('utf-8')
+        properties_bytes.extend(len(content_type_bytes).to_bytes(2, 'big'))
+        properties_bytes.extend(content_type_bytes)
+
+    if properties.get("response_topic") is not None:
+        properties_bytes.extend([0x08])  # Property identifier for response topic
+        response_topic_bytes = properties["response_topic"].encode('utf-8')
+        properties_bytes.extend(len(response_topic_bytes).to_bytes(2, 'big'))
+        properties_bytes.extend(response_topic_bytes)
+
+    if properties.get("correlation_data") is not None:
+        properties_bytes.extend([0x09])  # Property identifier for correlation data
+        properties_bytes.extend(len(properties["correlation_data"]).to_bytes(2, 'big'))
+        properties_bytes.extend(properties["correlation_data"])
+
+    for user_property in properties.get("user_properties") or []:
+        properties_bytes.extend([0x26])  # Property identifier for user property
+        key_bytes = user_property["key"].encode('utf-8')
+        value_bytes = user_property["value"].encode('utf-8')
+        properties_bytes.extend(len(key_bytes).to_bytes(2, 'big'))
+        properties_bytes.extend(key_bytes)
+        properties_bytes.extend(len(value_bytes).to_bytes(2, 'big'))
+        properties_bytes.extend(value_bytes)
+
+    return properties_bytes
+
+
 def create_publish_packet(topic, payload, qos=0, retain=False, packet_id=None, properties=None, mqtt_version=5):
     """
     Creates a PUBLISH packet according to the MQTT protocol version.
@@ -265,17 +317,14 @@ def create_publish_packet(topic, payload, qos=0, retain=False, packet_id=None, p
     # MQTT 5.0 Properties
     if mqtt_version == 5:
         # Properties
-        properties_bytes = bytearray()
-        if properties:
-            # Add properties handling if needed
-            pass
+        properties_bytes = encode_publish_properties(properties) if properties else bytearray()
 
         # Add property length to the variable header
         properties_length = encode_remaining_length(len(properties_bytes))
         variable_header += properties_length + properties_bytes
 
     # Payload
-    payload_encoded = payload.encode('utf-8')
+    payload_encoded = bytes(payload) if isinstance(payload, (bytes, bytearray)) else payload.encode('utf-8')
 
     # Calculate Remaining Length
     remaining_length = len(variable_header) + len(payload_encoded)
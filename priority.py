@@ -0,0 +1,130 @@
+import threading
+from collections import deque
+from queue import Empty
+from time import monotonic
+from topic import matches_topic_filter
+
+
+# Priority classes from most to least urgent, with their share of dispatch turns under load
+DEFAULT_PRIORITY_WEIGHTS = {"critical": 8, "high": 4, "normal": 2, "bulk": 1}
+
+
+class PriorityClassifier:
+    """
+    Assigns a priority class to a published message. A user property (by default `priority`)
+    set by the publisher wins if it names a known class; otherwise the first matching
+    topic-filter rule decides, and unmatched topics get `default`.
+    """
+
+    def __init__(self, rules=None, default="normal", property_name="priority", classes=None):
+        self.classes = tuple(classes or DEFAULT_PRIORITY_WEIGHTS)
+        self.rules = []  # [(topic filter, class name)], checked in order
+        for topic_filter, priority in rules or []:
+            self.add_rule(topic_filter, priority)
+        if default not in self.classes:
+            raise ValueError(f"Unknown priority class '{default}'")
+        self.default = default
+        self.property_name = property_name
+
+    def add_rule(self, topic_filter: str, priority: str) -> None:
+        if priority not in self.classes:
+            raise ValueError(f"Unknown priority class '{priority}'")
+        self.rules.append((topic_filter, priority))
+
+    def classify(self, topic: str, user_properties=None) -> str:
+        for user_property in user_properties or []:
+            if user_property.get("key") == self.property_name and user_property.get("value") in self.classes:
+                return user_property["value"]
+        for topic_filter, priority in self.rules:
+            if matches_topic_filter(topic_filter, topic):
+                return priority
+        return self.default
+
+
+class WeightedFairQueue:
+    """
+    Thread-safe queue with one FIFO per priority class. `get` picks among the non-empty classes
+    with smooth weighted round robin, so a class with weight 8 gets 8 turns for every turn of a
+    class with weight 1, and lower classes still progress while higher ones are busy.
+    Implements the subset of `queue.Queue` the dispatcher uses.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = dict(weights or DEFAULT_PRIORITY_WEIGHTS)
+        self.queues = {priority: deque() for priority in self.weights}
+        self._credit = {priority: 0 for priority in self.weights}
+        self.served = {priority: 0 for priority in self.weights}
+        self.mutex = threading.Lock()
+        self.not_empty = threading.Condition(self.mutex)
+        self.size = 0
+
+    def put(self, item, priority=None) -> None:
+        if priority not in self.queues:
+            priority = self._fallback_class()
+        with self.not_empty:
+            self.queues[priority].append(item)
+            self.size += 1
+            self.not_empty.notify()
+
+    def get(self, timeout=None):
+        """Removes and returns the next item. Raises `queue.Empty` if none arrives within `timeout`."""
+        with self.not_empty:
+            if timeout is None:
+                while not self.size:
+                    self.not_empty.wait()
+            else:
+                deadline = monotonic() + timeout
+                while not self.size:
+                    remaining = deadline - monotonic()
+                    if remaining <= 0:
+                        raise Empty
+                    self.not_empty.wait(remaining)
+            return self._pop_next()
+
+    def _pop_next(self):
+        ready = [priority for priority, queue in self.queues.items() if queue]
+        total = 0
+        for priority in ready:
+            self._credit[priority] += self.weights[priority]
+            total += self.weights[priority]
+        chosen = max(ready, key=lambda priority: self._credit[priority])
+        self._credit[chosen] -= total
+        self.size -= 1
+        self.served[chosen] += 1
+        return self.queues[chosen].popleft()
+
+    def discard(self, predicate, priority=None) -> int:
+        """
+        Removes every queued item for which `predicate(item)` is true, in the queue of `priority`
+        only if one is given (as routed by `put`). Returns the number removed.
+        """
+        removed = 0
+        with self.mutex:
+            if priority is None:
+                classes = list(self.queues)
+            else:
+                classes = [priority if priority in self.queues else self._fallback_class()]
+            for name in classes:
+                queue = self.queues[name]
+                kept = [item for item in queue if not predicate(item)]
+                if len(kept) != len(queue):
+                    removed += len(queue) - len(kept)
+                    self.queues[name] = deque(kept)
+            self.size -= removed
+        return removed
+
+    def depths(self) -> dict:
+        """Number of queued items per priority class."""
+        with self.mutex:
+            return {priority: len(queue) for priority, queue in self.queues.items()}
+
+    def qsize(self) -> int:
+        with self.mutex:
+            return self.size
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def _fallback_class(self):
+        # Unknown classes are served as "normal" when configured, else as the least urgent class
+        return "normal" if "normal" in self.queues else next(reversed(self.queues))
@@ -0,0 +1,95 @@
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+
+class QosMessageTableModel(QAbstractTableModel):
+    """
+    Table model over the stored QoS 1/2 messages, newest first. Rows are fetched in pages with
+    keyset pagination on (published_at, id), served by the partial index idx_messages_qos_published,
+    so opening the view or scrolling costs one page regardless of the table size.
+    Pages are loaded by the DashboardDataProvider thread: views call `fetchMore` as the user scrolls,
+    `refresh` asks for messages stored since the newest row, and results arrive in `on_page_loaded`.
+    """
+
+    COLUMNS = ("Published", "Topic", "QoS", "Message")
+
+    def __init__(self, provider, page_size=200, parent=None):
+        super().__init__(parent)
+        self.provider = provider
+        self.page_size = page_size
+        self.rows = []  # [(id, published_at, topic, qos, payload)], newest first
+        self.exhausted = False  # True once the oldest matching message is loaded
+        self.loading = False  # An older page has been requested and not received yet
+        self.generation = 0  # Bumped when the filters change, so late pages are dropped
+        self.filters = {"topic_filter": None, "since": None, "until": None}
+        provider.qos_page_loaded.connect(self.on_page_loaded)
+
+    # Qt model interface
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return None
+        _, published_at, topic, qos, payload = self.rows[index.row()]
+        return (published_at, topic, qos, payload)[index.column()]
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted and not self.loading
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or self.exhausted or self.loading:
+            return
+        self.loading = True
+        key = (self.rows[-1][1], self.rows[-1][0]) if self.rows else None
+        self.provider.request_qos_page(self.generation, "older", dict(self.filters), key, self.page_size)
+
+    # Filters and refresh
+    def set_filters(self, topic_filter=None, since=None, until=None):
+        """Applies new filters and reloads from the first page."""
+        self.beginResetModel()
+        self.generation += 1
+        self.filters = {"topic_filter": topic_filter or None, "since": since or None, "until": until or None}
+        self.rows = []
+        self.exhausted = False
+        self.loading = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def refresh(self):
+        """Asks for the messages stored since the newest loaded row."""
+        if not self.rows:
+            self.exhausted = False
+            self.fetchMore()
+            return
+        key = (self.rows[0][1], self.rows[0][0])
+        self.provider.request_qos_page(self.generation, "newer", dict(self.filters), key, self.page_size)
+
+    def on_page_loaded(self, generation, direction, rows):
+        if generation != self.generation:
+            return  # Requested before the filters changed
+        if direction == "older":
+            self.loading = False
+            self.exhausted = len(rows) < self.page_size
+            if rows:
+                self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+                self.rows.extend(rows)
+                self.endInsertRows()
+            return
+        if self.rows:
+            # Rows shown meanwhile by an older page request are not inserted twice
+            rows = [row for row in rows if (row[1], row[0]) > (self.rows[0][1], self.rows[0][0])]
+        if len(rows) >= self.page_size:
+            # Too far behind to patch in place, start over from the newest page
+            self.set_filters(**self.filters)
+        elif rows:
+            self.beginInsertRows(QModelIndex(), 0, len(rows) - 1)
+            self.rows[:0] = rows
+            self.endInsertRows()
@@ -0,0 +1,104 @@
+import math
+from datetime import datetime, timezone
+from time import time, gmtime, strftime
+from typing import Optional, Tuple
+from topic import matches_topic_filter
+
+# SUBSCRIBE user properties requesting a replay of the archive for the packet's topic filters
+REPLAY_FROM = "replay-from"
+REPLAY_TO = "replay-to"
+
+
+def parse_time(value) -> float:
+    """
+    Epoch seconds from a number (or numeric string) or an ISO 8601 date-time such as
+    "2024-05-01T08:00:00+02:00". Date-times without a UTC offset are taken as UTC, like the archive.
+    Raises ValueError if the value is neither.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    moment = datetime.fromisoformat(text[:-1] + "+00:00" if text.endswith("Z") else text)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.timestamp()
+
+
+def replay_range(user_properties) -> Optional[Tuple[float, Optional[float]]]:
+    """
+    (start, end) requested through the `replay-from` / `replay-to` user properties of a SUBSCRIBE,
+    or None if no replay was asked for. `end` is None when open. Raises ValueError on a bad value.
+    """
+    values = {prop.get("key"): prop.get("value") for prop in user_properties or ()}
+    if values.get(REPLAY_FROM) is None:
+        return None
+    start = parse_time(values[REPLAY_FROM])
+    end = parse_time(values[REPLAY_TO]) if values.get(REPLAY_TO) is not None else None
+    if end is not None and end <= start:
+        raise ValueError(f"'{REPLAY_TO}' must be later than '{REPLAY_FROM}'")
+    return start, end
+
+
+def _timestamp(epoch) -> str:
+    """Same format as the `published_at` column (SQLite's CURRENT_TIMESTAMP)."""
+    return strftime("%Y-%m-%d %H:%M:%S", gmtime(epoch))
+
+
+class ArchiveReplay:
+    """
+    Reads archived messages of a topic filter and time range back in publish order, page by page,
+    for streaming to a session. Reads the segment log when one is configured (its sparse time index
+    finds the start, topics are filtered while scanning forward), otherwise the storage backend
+    (indexed on topic and publish time). Pages are fetched lazily, so a replay holds at most one
+    page in memory and advances only as fast as the session's flow-control window lets it.
+    """
+
+    def __init__(self, db, archive_log=None, page_size=500, max_messages=100000):
+        self.db = db
+        self.archive_log = archive_log
+        self.page_size = page_size
+        self.max_messages = max_messages  # Cap on the messages one replay request streams
+
+    def messages(self, topic_filter, start, end=None):
+        """Yields the archived messages of `topic_filter` published in [start, end) epoch seconds, oldest first."""
+        end = time() if end is None else end
+        source = self._from_log if self.archive_log is not None else self._from_database
+        for sent, message in enumerate(source(topic_filter, start, end)):
+            if sent >= self.max_messages:
+                print(f"Replay of '{topic_filter}' stopped after {self.max_messages} message(s)")
+                return
+            yield message
+
+    def deliveries(self, filters, start, end=None):
+        """Yields (message, granted QoS) pairs for (topic filter, QoS) pairs, one filter after the other."""
+        end = time() if end is None else end  # Fixed up front: live messages cover what comes later
+        for topic_filter, qos in filters:
+            for message in self.messages(topic_filter, start, end):
+                yield message, qos
+
+    def _from_database(self, topic_filter, start, end):
+        # Whole seconds in the archive: round outwards, a duplicate beats a gap before the live stream
+        start, end = _timestamp(math.floor(start)), _timestamp(math.ceil(end))
+        after = None
+        while True:
+            page = self.db.replay_messages(topic_filter, start, end, after, self.page_size)
+            if not page:
+                return  # Done, or the read failed (already reported by the backend)
+            yield from page
+            if len(page) < self.page_size:
+                return
+            after = (page[-1].published_at, page[-1].message_id)
+
+    def _from_log(self, topic_filter, start, end):
+        page = self.archive_log.read_since(start, self.page_size)
+        while page:
+            for message in page:
+                if message.published_at >= end:
+                    return  # The log is in time order
+                if matches_topic_filter(topic_filter, message.topic):
+                    yield message
+            page = self.archive_log.read(page[-1].message_id + 1, self.page_size)
@@ -0,0 +1,216 @@
+import threading
+from time import time
+
+
+class _TrieNode:
+    __slots__ = ("children", "message")
+
+    def __init__(self):
+        self.children = {}  # {topic level: _TrieNode}
+        self.message = None  # Retained Message stored at this exact topic, if any
+
+
+class RetainedStore:
+    """
+    In-memory retained messages, indexed by a topic trie so wildcard filters are resolved level by level.
+    Changes are written behind to SQLite through `flush`, which is meant to run periodically.
+    With an ExpiryHeap, each stored message with an expiry is tracked until it expires, is replaced or removed.
+    """
+
+    def __init__(self, db=None, expiry=None):
+        self.db = db
+        self.expiry = expiry
+        self._root = _TrieNode()
+        self.lock = threading.RLock()
+        self._dirty = {}  # {topic: Message or None}, pending writes for the next snapshot
+        self.size = 0
+
+    def load(self, messages=None) -> int:
+        """
+        Loads retained messages, from `messages` (e.g. a shutdown snapshot) or from the database.
+        Returns the number loaded.
+        """
+        if messages is None:
+            if self.db is None:
+                return 0
+            messages = self.db.load_retained_messages()
+        loaded = 0
+        for message in messages:
+            self._set(message)
+            loaded += 1
+        return loaded
+
+    def update(self, message) -> None:
+        """Stores a retained message. An empty payload removes the retained message for its topic."""
+        if message.payload in ("", b"", None):
+            self.remove(message.topic)
+            return
+        with self.lock:
+            self._set(message)
+            self._dirty[message.topic] = message
+
+    def remove(self, topic: str) -> bool:
+        """Removes the retained message for a topic. Returns True if one existed."""
+        with self.lock:
+            path = [self._root]
+            for level in topic.split('/'):
+                node = path[-1].children.get(level)
+                if node is None:
+                    return False
+                path.append(node)
+            if path[-1].message is None:
+                return False
+            if self.expiry is not None:
+                self.expiry.untrack(path[-1].message, self._on_expired)
+            path[-1].message = None
+            self.size -= 1
+            self._dirty[topic] = None
+
+            # Prune nodes that no longer hold a message or children
+            levels = topic.split('/')
+            for depth in range(len(levels), 0, -1):
+                node = path[depth]
+                if node.message is not None or node.children:
+                    break
+                del path[depth - 1].children[levels[depth - 1]]
+            return True
+
+    def get(self, topic: str):
+        """Returns the retained message for an exact topic, or None."""
+        message = self.get_raw(topic)
+        if message is not None and message.is_expired():
+            return None
+        return message
+
+    def iter_matching(self, topic_filter: str):
+        """
+        Yields the retained messages whose topic matches the filter.
+        `+` matches exactly one level and `#` matches the parent level and everything below it.
+        Topics starting with `$` are not matched by a wildcard in the first level.
+        The lock is only held while a node is expanded, so large results are streamed.
+        """
+        filter_levels = topic_filter.split('/')
+        now = time()
+        stack = [(self._root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            if depth == len(filter_levels):
+                message = node.message
+                if message is not None and not message.is_expired(now):
+                    yield message
+                continue
+
+            level = filter_levels[depth]
+            with self.lock:
+                if level == '#':
+                    # '#' also matches the parent level itself
+                    if depth > 0 and node.message is not None and not node.message.is_expired(now):
+                        yield_parent = node.message
+                    else:
+                        yield_parent = None
+                    subtree = [
+                        child for name, child in node.children.items()
+                        if not (depth == 0 and name.startswith('$'))
+                    ]
+                elif level == '+':
+                    yield_parent = None
+                    subtree = None
+                    children = [
+                        child for name, child in node.children.items()
+                        if not (depth == 0 and name.startswith('$'))
+                    ]
+                else:
+                    yield_parent = None
+                    subtree = None
+                    child = node.children.get(level)
+                    children = [child] if child is not None else []
+
+            if subtree is not None:
+                if yield_parent is not None:
+                    yield yield_parent
+                yield from self._iter_subtree(subtree, now)
+            else:
+                stack.extend((child, depth + 1) for child in children)
+
+    def _iter_subtree(self, nodes, now):
+        """Yields every retained message stored at or below the given nodes."""
+        stack = list(nodes)
+        while stack:
+            node = stack.pop()
+            with self.lock:
+                message = node.message
+                stack.extend(node.children.values())
+            if message is not None and not message.is_expired(now):
+                yield message
+
+    def messages(self):
+        """Returns every retained message that has not expired."""
+        return list(self._iter_subtree([self._root], time()))
+
+    def purge_expired(self, messages=None, now=None) -> int:
+        """
+        Removes expired retained messages. With `messages` (e.g. from the expiry heap) only those
+        entries are checked, otherwise the whole trie is scanned. Returns the number removed.
+        """
+        now = time() if now is None else now
+        if messages is None:
+            messages = [message for message in self._iter_subtree([self._root], float('-inf'))
+                        if message.is_expired(now)]
+        removed = 0
+        for message in messages:
+            with self.lock:
+                # Only remove the entry if it has not been replaced by a newer retained message
+                if self.get_raw(message.topic) is message and message.is_expired(now):
+                    removed += self.remove(message.topic)
+        return removed
+
+    def _on_expired(self, messages):
+        """Expiry heap callback for the stored messages."""
+        cleared = self.purge_expired(messages)
+        if cleared:
+            print(f"Cleared {cleared} expired retained message(s)")
+
+    def get_raw(self, topic: str):
+        """Returns the stored message for a topic without checking its expiry."""
+        with self.lock:
+            node = self._root
+            for level in topic.split('/'):
+                node = node.children.get(level)
+                if node is None:
+                    return None
+            return node.message
+
+    def flush(self) -> int:
+        """Writes pending changes to the database in a single batch. Returns the number of topics written."""
+        if self.db is None:
+            return 0
+        with self.lock:
+            pending, self._dirty = self._dirty, {}
+        if not pending:
+            return 0
+        if not self.db.save_retained_batch(pending):
+            # Put the changes back unless a newer write for the same topic happened meanwhile
+            with self.lock:
+                for topic, message in pending.items():
+                    self._dirty.setdefault(topic, message)
+            return 0
+        return len(pending)
+
+    def _set(self, message) -> None:
+        with self.lock:
+            node = self._root
+            for level in message.topic.split('/'):
+                child = node.children.get(level)
+                if child is None:
+                    child = node.children[level] = _TrieNode()
+                node = child
+            if node.message is None:
+                self.size += 1
+            elif self.expiry is not None and node.message is not message:
+                self.expiry.untrack(node.message, self._on_expired)
+            node.message = message
+            if self.expiry is not None:
+                self.expiry.track(message, self._on_expired)
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1,85 @@
+from time import sleep
+
+
+class RetentionPolicy:
+    """
+    Limits on the archived `messages` table. Any limit left as None is not enforced:
+    - max_age: seconds a message is kept after it was published
+    - max_messages_per_topic: newest messages kept for each topic
+    - max_bytes: size of the database's used pages; the oldest messages go first when it is exceeded
+    Pruning is incremental: one run deletes at most `max_batches` batches of `batch_size` rows, each
+    in its own short transaction, then gives up to `vacuum_pages` free pages back to the file system.
+    With max_age, the `topic_history` of topics nobody published to for longer is dropped as well.
+    """
+
+    def __init__(self, max_age=None, max_messages_per_topic=None, max_bytes=None, batch_size=500,
+                 max_batches=20, vacuum_pages=1000):
+        if batch_size < 1 or max_batches < 1:
+            raise ValueError("batch_size and max_batches must be at least 1")
+        self.max_age = max_age
+        self.max_messages_per_topic = max_messages_per_topic
+        self.max_bytes = max_bytes
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.vacuum_pages = vacuum_pages
+
+    def enabled(self) -> bool:
+        return any(limit is not None for limit in (self.max_age, self.max_messages_per_topic, self.max_bytes))
+
+
+class MessagePruner:
+    """
+    Enforces a RetentionPolicy on the `messages` table, meant to run as a periodic job.
+    Between two batches the pruner sleeps `pause` seconds so publishers are not starved of the write lock.
+    Topics whose history is pruned are also dropped from `history` (a TopicHistory), if given.
+    """
+
+    def __init__(self, db, policy, pause=0.01, history=None):
+        self.db = db
+        self.policy = policy
+        self.pause = pause
+        self.history = history
+        self.total_removed = 0
+        self.total_reclaimed = 0
+
+    def run(self) -> dict:
+        """
+        One pruning pass. Returns the rows removed per limit, the idle topics whose history was
+        dropped, the bytes reclaimed and the database size.
+        """
+        policy = self.policy
+        budget = [policy.max_batches]
+        report = {"age": 0, "count": 0, "size": 0, "history_topics": 0}
+        if policy.max_age is not None:
+            report["age"] = self._batches(budget, lambda: self.db.prune_messages_older_than(
+                policy.max_age, policy.batch_size))
+            idle_topics = self.db.prune_topic_history(policy.max_age, policy.batch_size)
+            if self.history is not None:
+                self.history.forget(idle_topics, policy.max_age)
+            report["history_topics"] = len(idle_topics)
+        if policy.max_messages_per_topic is not None:
+            # Counted once per run; each batch lowers the counts and drops the topics that are done
+            overflow = self.db.topic_overflow(policy.max_messages_per_topic)
+            if overflow:
+                report["count"] = self._batches(budget, lambda: self.db.prune_topic_overflow(
+                    overflow, policy.batch_size))
+        if policy.max_bytes is not None:
+            report["size"] = self._batches(budget, lambda: self.db.prune_oldest_messages(policy.batch_size)
+                                           if self.db.database_size()[0] > policy.max_bytes else 0)
+        report["reclaimed_bytes"] = self.db.incremental_vacuum(policy.vacuum_pages) if policy.vacuum_pages else 0
+        report["database_bytes"], report["free_bytes"] = self.db.database_size()
+        self.total_removed += report["age"] + report["count"] + report["size"]
+        self.total_reclaimed += report["reclaimed_bytes"]
+        return report
+
+    def _batches(self, budget, prune_batch) -> int:
+        """Runs `prune_batch` until it deletes less than a full batch or the run's batch budget is spent."""
+        removed = 0
+        while budget[0] > 0:
+            budget[0] -= 1
+            deleted = prune_batch()
+            removed += deleted
+            if deleted < self.policy.batch_size:
+                break
+            sleep(self.pause)
+        return removed
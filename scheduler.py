@@ -0,0 +1,81 @@
+import threading
+from time import monotonic
+
+
+class ScheduledJob:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval  # Seconds between two runs
+        self.func = func
+        self.next_run = monotonic() + interval
+        self.last_result = None  # Value returned by the last run, kept for reporting
+        self.runs = 0
+
+    def __repr__(self):
+        return f"<ScheduledJob name={self.name} interval={self.interval} runs={self.runs}>"
+
+
+class BackgroundScheduler:
+    """Runs periodic maintenance jobs (cleanup, snapshots, flushes) on a single daemon thread."""
+
+    def __init__(self, tick=0.5):
+        self.tick = tick  # Upper bound for how long the thread sleeps between checks
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.shutdown_event = threading.Event()
+        self._thread = None
+
+    def add_job(self, name, interval, func):
+        """Registers `func` to be called every `interval` seconds. Replaces a job with the same name."""
+        with self.lock:
+            self.jobs[name] = ScheduledJob(name, interval, func)
+
+    def remove_job(self, name):
+        with self.lock:
+            self.jobs.pop(name, None)
+
+    def run_job(self, name):
+        """Runs a job immediately, outside of its schedule, and returns its result."""
+        with self.lock:
+            job = self.jobs.get(name)
+        if job is None:
+            return None
+        return self._run(job)
+
+    def _run(self, job):
+        try:
+            job.last_result = job.func()
+        except Exception as e:
+            print(f"Error running scheduled job '{job.name}': {e}")
+            job.last_result = None
+        job.runs += 1
+        job.next_run = monotonic() + job.interval
+        return job.last_result
+
+    def start(self):
+        """Starts the scheduler thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self.shutdown_event.clear()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self.shutdown_event.is_set():
+            now = monotonic()
+            with self.lock:
+                due = [job for job in self.jobs.values() if job.next_run <= now]
+            for job in due:
+                if self.shutdown_event.is_set():
+                    break
+                self._run(job)
+
+            with self.lock:
+                next_run = min((job.next_run for job in self.jobs.values()), default=now + self.tick)
+            self.shutdown_event.wait(min(self.tick, max(0.0, next_run - monotonic())))
+
+    def shutdown(self, wait=True):
+        """Stops the scheduler thread, letting a running job finish if `wait` is set."""
+        self.shutdown_event.set()
+        if wait and self._thread and self._thread is not threading.current_thread():
+            self._thread.join()
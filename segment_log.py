@@ -0,0 +1,305 @@
+import mmap
+import os
+import struct
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from time import time
+from message import Message
+
+# Record: body length and CRC32 of the body, then the body itself
+_RECORD_HEADER = struct.Struct(">II")
+# Body: offset, publish timestamp, QoS, flags and topic length, followed by the topic and the payload
+_BODY_HEADER = struct.Struct(">QdBBH")
+# Sparse index entry: offset relative to the segment base, file position and timestamp of a record
+_INDEX_ENTRY = struct.Struct(">IId")
+_FLAG_RETAIN = 0x01
+_FLAG_BINARY = 0x02  # Payload was bytes, not text
+
+
+class _Segment:
+    __slots__ = ("base_offset", "path", "index_path", "index", "size", "next_offset",
+                 "first_timestamp", "last_timestamp")
+
+    def __init__(self, directory, base_offset):
+        self.base_offset = base_offset
+        self.path = os.path.join(directory, f"{base_offset:020d}.log")
+        self.index_path = os.path.join(directory, f"{base_offset:020d}.index")
+        self.index = []  # [(relative offset, position, timestamp)], one entry per `index_interval` bytes
+        self.size = 0  # Bytes of valid records
+        self.next_offset = base_offset
+        self.first_timestamp = None
+        self.last_timestamp = None
+
+
+class SegmentLog:
+    """
+    Append-only message archive stored as a sequence of segment files. Every record is length-prefixed
+    and CRC-checked and gets a monotonically increasing offset. Each segment has a sparse index of
+    (offset, file position, timestamp) entries written every `index_interval` bytes, so reads by offset
+    or by time start near the target and scan forward through an `mmap` of the segment.
+    Appends go through buffered writers (`flush` makes them readable and durable) and a new segment is
+    started once the active one reaches `segment_bytes`. Retention deletes whole segments.
+    Implements `save_message` like SQLServer, so it can stand in as the server's archive.
+    """
+
+    def __init__(self, directory, segment_bytes=64 << 20, index_interval=4096, buffer_size=1 << 20):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.buffer_size = buffer_size
+        self.segments = []  # Oldest first, the last one is active
+        self.lock = threading.Lock()
+        self._writer = None
+        self._index_writer = None
+        self._last_indexed = None  # File position of the active segment's last index entry
+        os.makedirs(directory, exist_ok=True)
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".log"):
+                self.segments.append(self._load_segment(int(name[:-4])))
+        if not self.segments:
+            self.segments.append(_Segment(directory, 0))
+        self._open_writers(self.segments[-1])
+
+    # Opening and recovery
+    def _load_segment(self, base_offset):
+        segment = _Segment(self.directory, base_offset)
+        if os.path.exists(segment.index_path):
+            with open(segment.index_path, "rb") as index_file:
+                data = index_file.read()
+            usable = len(data) - len(data) % _INDEX_ENTRY.size  # Drop a torn trailing entry
+            segment.index = [entry for entry in _INDEX_ENTRY.iter_unpack(data[:usable])]
+        file_size = os.path.getsize(segment.path)
+        if segment.index and segment.index[-1][1] >= file_size:
+            segment.index = [entry for entry in segment.index if entry[1] < file_size]
+        # Scan past the last index entry to find the end of the valid records
+        while True:
+            position = segment.index[-1][1] if segment.index else 0
+            with open(segment.path, "rb") as log_file:
+                log_file.seek(position)
+                records = list(_iter_records(log_file.read(), 0))
+            if records or not segment.index:
+                break
+            segment.index.pop()  # Points at a torn record
+        last_indexed = position if segment.index else None
+        for record_position, offset, timestamp, end in records:
+            absolute = position + record_position
+            if last_indexed is None or absolute - last_indexed >= self.index_interval:
+                segment.index.append((offset - base_offset, absolute, timestamp))
+                last_indexed = absolute
+            segment.last_timestamp = timestamp
+            segment.next_offset = offset + 1
+            segment.size = position + end
+        if segment.index:
+            segment.first_timestamp = segment.index[0][2]
+        if segment.size < file_size:
+            print(f"Truncating {file_size - segment.size} byte(s) of torn records in '{segment.path}'")
+            with open(segment.path, "r+b") as log_file:
+                log_file.truncate(segment.size)
+        with open(segment.index_path, "wb") as index_file:
+            for entry in segment.index:
+                index_file.write(_INDEX_ENTRY.pack(*entry))
+        return segment
+
+    def _open_writers(self, segment):
+        self._writer = open(segment.path, "ab", buffering=self.buffer_size)
+        self._index_writer = open(segment.index_path, "ab")
+        self._last_indexed = segment.index[-1][1] if segment.index else None
+
+    # Writing
+    def append(self, message, timestamp=None) -> int:
+        """Appends a message and returns its offset. Readable once `flush` has run."""
+        payload = message.payload
+        flags = _FLAG_RETAIN if message.retain else 0
+        if isinstance(payload, (bytes, bytearray)):
+            flags |= _FLAG_BINARY
+            payload = bytes(payload)
+        else:
+            payload = ("" if payload is None else str(payload)).encode()
+        topic = message.topic.encode()
+        with self.lock:
+            segment = self.segments[-1]
+            if segment.size >= self.segment_bytes:
+                segment = self._roll()
+            # Time index order: never step back behind the previous record
+            timestamp = time() if timestamp is None else timestamp
+            if segment.last_timestamp is not None and timestamp < segment.last_timestamp:
+                timestamp = segment.last_timestamp
+            offset = segment.next_offset
+            body = _BODY_HEADER.pack(offset, timestamp, message.qos or 0, flags, len(topic)) + topic + payload
+            position = segment.size
+            if self._last_indexed is None or position - self._last_indexed >= self.index_interval:
+                entry = (offset - segment.base_offset, position, timestamp)
+                segment.index.append(entry)
+                self._index_writer.write(_INDEX_ENTRY.pack(*entry))
+                self._last_indexed = position
+            self._writer.write(_RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body)
+            segment.size += _RECORD_HEADER.size + len(body)
+            segment.next_offset = offset + 1
+            if segment.first_timestamp is None:
+                segment.first_timestamp = timestamp
+            segment.last_timestamp = timestamp
+            return offset
+
+    def save_message(self, message) -> bool:
+        """Archives a message (same contract as SQLServer.save_message)."""
+        try:
+            message.message_id = self.append(message)
+            return True
+        except (OSError, ValueError, struct.error) as e:
+            print(f"Error appending message to the segment log: {e}")
+            return False
+
+    def flush(self, sync=False) -> None:
+        """Writes buffered appends to the active segment (and to disk with `sync`)."""
+        with self.lock:
+            self._flush_locked(sync)
+
+    def _flush_locked(self, sync=False):
+        self._writer.flush()
+        self._index_writer.flush()
+        if sync:
+            os.fsync(self._writer.fileno())
+            os.fsync(self._index_writer.fileno())
+
+    def _roll(self):
+        """Closes the active segment and starts a new one at the next offset."""
+        self._flush_locked(sync=True)
+        self._writer.close()
+        self._index_writer.close()
+        segment = _Segment(self.directory, self.segments[-1].next_offset)
+        self.segments.append(segment)
+        self._open_writers(segment)
+        return segment
+
+    # Reading
+    def read(self, offset=0, max_records=1000) -> list:
+        """Returns up to `max_records` messages from `offset` on. `message_id` holds each record's offset."""
+        segments = self._flushed_segments()
+        start = max(0, bisect_right([segment.base_offset for segment, _ in segments], offset) - 1)
+        messages = []
+        for segment, size in segments[start:]:
+            entry = bisect_right([entry[0] for entry in segment.index], offset - segment.base_offset) - 1
+            position = segment.index[entry][1] if entry >= 0 else 0
+            messages.extend(self._scan(segment, size, position, max_records - len(messages), min_offset=offset))
+            if len(messages) >= max_records:
+                break
+        return messages
+
+    def read_since(self, timestamp, max_records=1000) -> list:
+        """Returns up to `max_records` messages appended at or after `timestamp`, oldest first."""
+        segments = [(segment, size) for segment, size in self._flushed_segments()
+                    if segment.last_timestamp is not None and segment.last_timestamp >= timestamp]
+        messages = []
+        for segment, size in segments:
+            entry = bisect_left([entry[2] for entry in segment.index], timestamp) - 1
+            position = segment.index[entry][1] if entry >= 0 else 0
+            messages.extend(self._scan(segment, size, position, max_records - len(messages), min_timestamp=timestamp))
+            if len(messages) >= max_records:
+                break
+        return messages
+
+    def _flushed_segments(self):
+        """
+        Flushes buffered appends and returns (segment, size) pairs, the size being what is on disk now.
+        Appends after the lock is released only grow `segment.size`, so scans must stop at this size.
+        """
+        with self.lock:
+            self._flush_locked()
+            return [(segment, segment.size) for segment in self.segments]
+
+    def _scan(self, segment, size, position, limit, min_offset=None, min_timestamp=None):
+        if limit <= 0 or position >= size:
+            return []
+        try:
+            with open(segment.path, "rb") as log_file, \
+                    mmap.mmap(log_file.fileno(), size, access=mmap.ACCESS_READ) as view:
+                messages = []
+                for record_position, offset, timestamp, end in _iter_records(view, position, size):
+                    if (min_offset is not None and offset < min_offset) or \
+                            (min_timestamp is not None and timestamp < min_timestamp):
+                        continue
+                    messages.append(_decode_record(view, record_position, offset, timestamp, end))
+                    if len(messages) >= limit:
+                        break
+                return messages
+        except (OSError, ValueError) as e:
+            # The segment was deleted by retention while it was being read
+            print(f"Error reading segment '{segment.path}': {e}")
+            return []
+
+    # Retention
+    def retain(self, max_age=None, max_bytes=None, now=None) -> int:
+        """
+        Deletes the oldest closed segments whose records are all older than `max_age` seconds, or while
+        the log is larger than `max_bytes`. The active segment is kept. Returns the number deleted.
+        """
+        now = time() if now is None else now
+        removed = []
+        with self.lock:
+            total = sum(segment.size for segment in self.segments)
+            while len(self.segments) > 1:
+                oldest = self.segments[0]
+                expired = max_age is not None and oldest.last_timestamp is not None \
+                    and oldest.last_timestamp < now - max_age
+                oversized = max_bytes is not None and total > max_bytes
+                if not (expired or oversized):
+                    break
+                removed.append(self.segments.pop(0))
+                total -= oldest.size
+        for segment in removed:
+            for path in (segment.path, segment.index_path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"Error deleting '{path}': {e}")
+        return len(removed)
+
+    def size_bytes(self) -> int:
+        with self.lock:
+            return sum(segment.size for segment in self.segments)
+
+    @property
+    def next_offset(self) -> int:
+        with self.lock:
+            return self.segments[-1].next_offset
+
+    def close(self) -> None:
+        with self.lock:
+            if self._writer is not None and not self._writer.closed:
+                self._flush_locked(sync=True)
+                self._writer.close()
+                self._index_writer.close()
+
+    def __repr__(self):
+        return f"<SegmentLog directory={self.directory} segments={len(self.segments)} next_offset={self.next_offset}>"
+
+
+def _iter_records(data, position, size=None):
+    """Yields (position, offset, timestamp, end) for the valid records of `data` from `position` on."""
+    size = len(data) if size is None else size
+    while position + _RECORD_HEADER.size <= size:
+        length, crc = _RECORD_HEADER.unpack_from(data, position)
+        start = position + _RECORD_HEADER.size
+        end = start + length
+        if length < _BODY_HEADER.size or end > size or zlib.crc32(data[start:end]) != crc:
+            return  # Torn or corrupt tail
+        offset, timestamp, _, _, _ = _BODY_HEADER.unpack_from(data, start)
+        yield position, offset, timestamp, end
+        position = end
+
+
+def _decode_record(data, position, offset, timestamp, end):
+    start = position + _RECORD_HEADER.size
+    _, _, qos, flags, topic_length = _BODY_HEADER.unpack_from(data, start)
+    topic_start = start + _BODY_HEADER.size
+    payload = bytes(data[topic_start + topic_length:end])
+    message = Message(
+        topic=bytes(data[topic_start:topic_start + topic_length]).decode(),
+        payload=payload if flags & _FLAG_BINARY else payload.decode(errors="replace"),
+        qos=qos,
+        retain=bool(flags & _FLAG_RETAIN),
+        published_at=timestamp
+    )
+    message.message_id = offset
+    return message
@@ -1,12 +1,27 @@
 import socket
 import threading
-from client import Client
+from itertools import chain
 from message import Message
 from sqlServer import SQLServer
 from decoder import MQTTDecoder
 from threading import Event
-from time import time
+from time import time, monotonic
 from message_dispatcher import MessageDispatcher
+from message_expiry import ExpiryHeap
+from scheduler import BackgroundScheduler
+from retained_store import RetainedStore
+from admission import AdmissionController
+from authenticator import Authenticator
+from will_registry import WillRegistry
+from archive_policy import ArchivePolicy
+from priority import PriorityClassifier
+from snapshot import BrokerSnapshot
+from broker_stats import BrokerStats
+from topic_history import TopicHistory
+from retention import RetentionPolicy, MessagePruner
+from segment_log import SegmentLog
+from replay import ArchiveReplay, replay_range
+from archive_compression import train_dictionary, MAX_DICTIONARY_SIZE
 from packet_creator import (
     create_connack_packet,
     create_pingresp_packet,
@@ -21,228 +36,404 @@ from packet_creator import (
 
 
 class MQTT5Server():
-    def __init__(self, IP_ADDR = '192.168.208.13', PORT = 5000, max_connections=50, db_file="mqtt_server.db"):
+    def __init__(self, IP_ADDR = '192.168.208.13', PORT = 5000, max_connections=50, db_file="mqtt_server.db",
+                 session_expiry_check_interval=30, retained_snapshot_interval=2, will_flush_interval=2,
+                 archive_policy=None, dispatcher_min_workers=2, dispatcher_max_workers=16, autoscale_interval=1,
+                 priority_classifier=None, priority_weights=None, snapshot_file="mqtt_server.snapshot",
+                 stats_interval=1, stats_window=120, topic_history_depth=10, topic_history_max_topics=10000,
+                 topic_history_flush_interval=2, retention_policy=None, retention_interval=60, archive_log_dir=None,
+                 archive_log_segment_bytes=64 << 20, archive_log_flush_interval=1, storage=None,
+                 replay_page_size=500, replay_max_messages=100000, archive_compression=None,
+                 allow_anonymous=True, authenticator=None):
         self.IP_ADDR = IP_ADDR
         self.PORT = PORT
         self.s_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.s_server.bind((IP_ADDR, PORT))
         self.s_server.listen(50)
-        active_connections = {}
-        self.db = SQLServer("mqtt_server.db")
+        # Storage backend: SQLite by default, or any StorageBackend (MemoryStorage, HybridStorage)
+        self.db = storage if storage is not None else SQLServer(db_file)
+        # Opt-in compression of archived payloads (ArchiveCompression), decompressed again on every read
+        if archive_compression is not None:
+            self.db.set_compression(archive_compression)
         self.decoder = MQTTDecoder()
-        self.dispatcher = MessageDispatcher(self.db)
+        # Live throughput and latency metrics, sampled in memory for the dashboard
+        self.stats = BrokerStats(window=stats_window)
+        # Message Expiry Interval tracking, for messages while they are queued or retained
+        self.expiry_heap = ExpiryHeap()
+        self.dispatcher = MessageDispatcher(self.db, min_workers=dispatcher_min_workers,
+                                            max_workers=dispatcher_max_workers, priority_weights=priority_weights,
+                                            stats=self.stats, expiry=self.expiry_heap)
+        # Dispatch priority class of each message, from topic-filter rules or a user property
+        self.priority_classifier = priority_classifier or PriorityClassifier(classes=self.dispatcher.priorities)
         self.active_connections = {}
-        self.shutdown_event = Event()
+        self.sessions = {}  # {client_id: Client} for the open connections
+        self.client_threads = set()
+        self.shutdown_event = Event()  # Stops accepting connections
+        self.draining = Event()  # Set by `shutdown`: new CONNECTs are refused and wills are kept for the snapshot
+        # State saved by the previous graceful shutdown, if any
+        self.snapshot_file = snapshot_file
+        snapshot = BrokerSnapshot.load(snapshot_file) if snapshot_file else None
+        if snapshot is not None:
+            print(f"Warm start from {snapshot}")
+        # Deliveries left over at the last shutdown, sent when their session resumes
+        self.pending_sessions = snapshot.sessions if snapshot is not None else {}
+        self.snapshot_created_at = snapshot.created_at if snapshot is not None else None
+        self.db.load_subscription_filter(snapshot.subscriptions if snapshot is not None else None)
+        # Archive of accepted messages: SQLite rows, or an append-only segment log in `archive_log_dir`
+        self.archive_log = SegmentLog(archive_log_dir, segment_bytes=archive_log_segment_bytes) if archive_log_dir else None
+        self.archive = self.archive_log or self.db
+        # Time-range replay of the archive to a session, on request of a SUBSCRIBE or of `replay`
+        self.replay_reader = ArchiveReplay(self.db, self.archive_log, page_size=replay_page_size,
+                                           max_messages=replay_max_messages)
+        # Which messages published to topics without subscribers are still written to the archive
+        self.archive_policy = archive_policy or ArchivePolicy()
+        # CONNECT admission (connection limit, bans, rate limits) served from memory
+        self.db.reset_connected_flags()
+        self.admission = AdmissionController(self.db, max_connections=max_connections,
+                                             min_connection_interval=self.db.MIN_CONNECTION_INTERVAL)
+        # CONNECT credentials: users are added with `add_user`; clients without a username are
+        # accepted unless `allow_anonymous` is False. A given `authenticator` brings its own settings.
+        self.authenticator = authenticator or Authenticator(self.db, allow_anonymous=allow_anonymous)
+        if self.authenticator.db is None:
+            self.authenticator.db = self.db
+        if snapshot is None:
+            self.db.clear_expired_retained()
+        self.expiry_heap.start()
+        # Retained messages live in memory and are written behind to SQLite
+        self.retained_store = RetainedStore(self.db, expiry=self.expiry_heap)
+        print(f"Loaded {self.retained_store.load(snapshot.retained if snapshot is not None else None)} retained message(s)")
+        # Will messages live in memory and are written behind to SQLite
+        self.will_registry = WillRegistry(self.db, self._publish_will)
+        print(f"Loaded {self.will_registry.load(snapshot.wills if snapshot is not None else None)} will message(s)")
+        # Last messages of every topic live in memory and are written behind to SQLite
+        self.topic_history = TopicHistory(self.db, depth=topic_history_depth, max_topics=topic_history_max_topics)
+        print(f"Loaded {self.topic_history.load()} topic history entry(ies)")
+        # Periodic maintenance jobs
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.add_job("session-expiry", session_expiry_check_interval, self._expire_sessions)
+        self.scheduler.add_job("retained-snapshot", retained_snapshot_interval, self.retained_store.flush)
+        self.scheduler.add_job("will-flush", will_flush_interval, self.will_registry.flush)
+        self.scheduler.add_job("topic-history-flush", topic_history_flush_interval, self.topic_history.flush)
+        self.scheduler.add_job("dispatcher-autoscale", autoscale_interval, self.dispatcher.autoscale)
+        self.scheduler.add_job("broker-stats", stats_interval, self._sample_stats)
+        # Age, per-topic count and size limits on the archived messages, pruned in small batches
+        self.retention_policy = retention_policy or RetentionPolicy()
+        self.message_pruner = MessagePruner(self.db, self.retention_policy, history=self.topic_history)
+        if self.retention_policy.enabled():
+            self.scheduler.add_job("message-retention", retention_interval, self._prune_messages)
+        if self.archive_log is not None:
+            self.scheduler.add_job("archive-log-flush", archive_log_flush_interval, self.archive_log.flush)
+        self.scheduler.start()
+
+    def _expire_sessions(self):
+        """Scheduled job: drops expired sessions and reports what was reclaimed."""
+        reclaimed = self.db.expire_sessions()
+        if any(reclaimed.values()):
+            print(f"Expired sessions reclaimed {reclaimed['clients']} client(s), "
+                  f"{reclaimed['subscriptions']} subscription(s), {reclaimed['will_messages']} will message(s)")
+        return reclaimed
+
+    def _prune_messages(self):
+        """Scheduled job: enforces the retention policy and reports what was removed and reclaimed."""
+        report = self.message_pruner.run()
+        if self.archive_log is not None:
+            # The log is pruned by whole segments; the per-topic count limit only applies to SQLite
+            segments = self.archive_log.retain(self.retention_policy.max_age, self.retention_policy.max_bytes)
+            if segments:
+                print(f"Retention deleted {segments} archive log segment(s)")
+        if report["history_topics"]:
+            print(f"Retention dropped the history of {report['history_topics']} idle topic(s)")
+        if report["age"] or report["count"] or report["size"] or report["reclaimed_bytes"]:
+            print(f"Retention pruned {report['age']} expired, {report['count']} over topic limit and "
+                  f"{report['size']} over size limit message(s), reclaimed {report['reclaimed_bytes']} byte(s); "
+                  f"database uses {report['database_bytes']} byte(s), {report['free_bytes']} free")
+        return report
+
+    def _sample_stats(self):
+        """Scheduled job: closes one stats interval with the current session count and queue depth."""
+        return self.stats.tick(sessions=len(self.active_connections), queue_depth=self.dispatcher.backlog())
+
+    def _iter_retained(self, filters):
+        """Lazily yields (retained message, granted QoS) pairs for the given (topic filter, QoS) pairs."""
+        for topic_filter, qos in filters:
+            for retained_message in self.retained_store.iter_matching(topic_filter):
+                yield retained_message, qos
+
+    def _has_audience(self, message) -> bool:
+        """False when a message is neither retained nor matched by any subscription, so routing can be skipped."""
+        return message.retain or self.db.might_have_subscribers(message.topic)
+
+    def _archive(self, message) -> bool:
+        """
+        Writes an accepted message to the `messages` table. Messages nobody subscribes to are only
+        written when the archive policy asks for it. Returns False if the write failed.
+        Archived messages also enter their topic's history.
+        """
+        if not self._has_audience(message) and not self.archive_policy.should_archive(message.topic):
+            return True
+        self.topic_history.record(message)
+        return self.archive.save_message(message)
+
+    def _publish(self, message):
+        """Routes an accepted message: retained storage and dispatch to subscribers (both track its expiry)."""
+        if not self._has_audience(message):
+            return  # Nobody subscribes to this topic, skip queueing and matching
+        if message.retain:
+            self.retained_store.update(message)
+        message.priority = self.priority_classifier.classify(message.topic, message.user_properties)
+        self.dispatcher.dispatch_message(message, self.active_connections)
+
+    def _publish_will(self, will):
+        """Publishes a will message through the normal routing path."""
+        will_message = Message(
+            topic=will.topic,
+            payload=will.message,
+            qos=will.qos,
+            retain=will.retain,
+            packet_id=None,  # No specific packet ID for LWT
+            message_expiry_interval=will.message_expiry_interval
+        )
+        if self._archive(will_message):
+            print(f"Saving message which was used as last will in the messages table")
+        self._publish(will_message)
 
     def handle_client(self,conn, addr):
-        # Create a new SQLServer instance for this thread
         print(f"Connection accepted from {addr}")
         connected_client = None
+        admitted = False
+        disconnect_reason = None  # Reason code of the client's DISCONNECT, None if the connection dropped
         try:
             while True:
                 try:
-                    if not self.shutdown_event.is_set():
-                        if connected_client and connected_client not in self.active_connections:
-                            conn.settimeout(connected_client.keep_alive * 1.5)
-                        data = conn.recv(512)
-
-                        if not data:
-                            print(f"Client at {addr} disconnected")
-                            break
-
-                        print(data)
-                        decoded_packet = self.decoder.decode_mqtt_packet(data)
-                        print(f"Decoded packet from {addr}: {decoded_packet}")
-
-                        # Handle CONNECT packet`
-                        if decoded_packet.get("packet_type") == "CONNECT":
-                            # Store client in the database and handle authentication
-                            ack_flags, reason_code = self.db.store_client(decoded_packet)
-                            connack_packet = create_connack_packet(connect_ack_flags=ack_flags, reason_code=reason_code)
-                            conn.sendall(connack_packet)  # Send the CONNACK response packet to the client
-
-                            # If connection is successful (reason code 0x00), add to active connections
+                    if connected_client and connected_client not in self.active_connections:
+                        conn.settimeout(connected_client.keep_alive * 1.5)
+                    data = conn.recv(512)
+
+                    if not data:
+                        print(f"Client at {addr} disconnected")
+                        break
+                    self.stats.record_in(nbytes=len(data))
+
+                    print(data)
+                    decoded_packet = self.decoder.decode_mqtt_packet(data)
+                    print(f"Decoded packet from {addr}: {decoded_packet}")
+
+                    # Handle CONNECT packet`
+                    if decoded_packet.get("packet_type") == "CONNECT":
+                        # Admission checks first (memory only), then validation and authentication
+                        ack_flags, reason_code = 0x00, 0x80  # Unspecified error, if a session is already open
+                        if self.draining.is_set():
+                            reason_code = 0x88  # Server unavailable
+                        elif not admitted:
+                            reason_code = self.admission.admit(decoded_packet.get("client_id"), addr[0])
+                            admitted = reason_code == 0x00
+                            if admitted:
+                                reason_code = self.db.validate_connect(decoded_packet)
                             if reason_code == 0x00:
-                                connected_client = Client(
-                                    decoded_packet.get("client_id"),
+                                reason_code = self.authenticator.authenticate(
                                     decoded_packet.get("username"),
-                                    decoded_packet.get("password"),
-                                    decoded_packet.get("clean_session"),
-                                    decoded_packet.get("keep_alive"),
-                                    0,
-                                    decoded_packet.get("will_flag")
+                                    decoded_packet.get("password")
                                 )
-
-                                self.active_connections[decoded_packet.get("client_id")] = conn
-                                print(f"Client '{decoded_packet.get('client_id')}' connected successfully.")
-                            else:
-                                print(f"Connection failed with reason code 0x{reason_code:02X}")
-                                break
-
-                        # Handle PINGREQ packet
-                        elif decoded_packet.get("packet_type") == "PINGREQ":
-                            print(f"Received PINGREQ from client {addr}")
-                            pingresp_packet = create_pingresp_packet()  # Create a PINGRESP packet
-                            conn.sendall(pingresp_packet)
-                            print(f"Sent PINGRESP to client {addr}")
-
-                        # Handle PUBLISH packet (QoS 0 and 1)
-                        elif decoded_packet.get("packet_type") == "PUBLISH" and decoded_packet.get("qos") != 2:
-                            print(f"Received PUBLISH from client {addr}")
-                            packet_id = decoded_packet.get("packet_identifier")
-                            if packet_id is None and decoded_packet.get("qos") > 0:
-                                print(f"Error: No packet identifier provided for QoS {decoded_packet.get('qos')}")
-                                break
-
-                            message = Message(
-                                topic=decoded_packet.get("topic_name"),
-                                payload=decoded_packet.get("payload"),
-                                qos=decoded_packet.get("qos"),
-                                retain=decoded_packet.get("retain"),
-                                packet_id=packet_id
-                            )
-
-                            # Save the message and respond with PUBACK for QoS 1
-                            if self.db.save_message(message):
-                                if message.qos == 1:
-                                    puback_packet = create_puback_packet(packet_id)
-                                    conn.sendall(puback_packet)
-                                    print(f"Sent PUBACK to client '{connected_client.client_id}' for packet ID '{packet_id}'")
-                                self.dispatcher.dispatch_message(message, self.active_connections)
-
-
-
-                        # Handle PUBLISH packet (QoS 2)
-                        elif decoded_packet.get("packet_type") == "PUBLISH" and decoded_packet.get("qos") == 2:
-                            packet_id = decoded_packet.get("packet_identifier")
-                            if packet_id is None:
-                                print("Error: Packet ID is required for QoS 2")
-                                break
-
-                            message = Message(
-                                topic=decoded_packet.get("topic_name"),
-                                payload=decoded_packet.get("payload"),
-                                qos=decoded_packet.get("qos"),
-                                retain=decoded_packet.get("retain"),
-                                packet_id=packet_id
-                            )
-
-                            if self.db.save_message(message):
-                                pubrec_packet = create_pubrec_packet(packet_id)
-                                conn.sendall(pubrec_packet)
-
-
-                        elif decoded_packet.get("packet_type") == "PUBREL":
-                            packet_id = decoded_packet.get("packet_identifier")
-                            if packet_id is not None:
-                                pubcomp_packet = create_pubcomp_packet(packet_id)
-                                conn.sendall(pubcomp_packet)
-                                print(f"Sent PUBCOMP to client for packet ID '{packet_id}'")
-                                message = self.db.retrieve_message_by_packet_id(packet_id)
-
-                                if message:
-                                    self.dispatcher.dispatch_message(message, self.active_connections)
-                                else:
-                                    print(f"No message found with packet ID '{packet_id}'")
-
-                        # For PUBREC and PUBCOMP
-                        elif decoded_packet.get("packet_type") == "PUBREC":
-                            packet_id = decoded_packet.get("packet_identifier")
-                            print(f"Processing PUBREC for packet ID {packet_id}")
-                            with self.dispatcher.pending_acks_lock:
-                                pubrec_event = self.dispatcher.pending_acks.get(packet_id)
-                                if pubrec_event:
-                                    pubrec_event.set()  # Trigger the event for PUBREC
-                                    print(f"Set PUBREC event for packet ID {packet_id}")
-                                else:
-                                    print(f"No matching PUBREC event found for packet ID {packet_id}")
-
-                        elif decoded_packet.get("packet_type") == "PUBCOMP":
-                            packet_id = decoded_packet.get("packet_identifier")
-                            print(f"Processing PUBCOMP for packet ID {packet_id}")
-                            with self.dispatcher.pending_acks_lock:
-                                pubcomp_event = self.dispatcher.pending_acks.get(packet_id)
-                                if pubcomp_event:
-                                    pubcomp_event.set()  # Trigger the event for PUBCOMP
-                                    print(f"Set PUBCOMP event for packet ID {packet_id}")
-                                else:
-                                    print(f"No matching PUBCOMP event found for packet ID {packet_id}")
-
-                        elif decoded_packet.get("packet_type") == "PUBACK":
-                            print(self.dispatcher.pending_acks)
-                            packet_id = decoded_packet.get("packet_identifier")
-                            print(f"Processing PUBACK for packet ID {packet_id}")
-                            with self.dispatcher.pending_acks_lock:
-                                puback_event = self.dispatcher.pending_acks.get(packet_id)
-                                if puback_event:
-                                    puback_event.set()  # Trigger the event for PUBACK
-                                    print(f"Set PUBACK event for packet ID {packet_id}")
+                            if reason_code == 0x00:
+                                session = self.db.establish_session(decoded_packet)
+                                if session is None:
+                                    reason_code = 0x87  # Not Authorized
                                 else:
-                                    print(f"No matching PUBACK event found for packet ID {packet_id}")
+                                    ack_flags = 0x01 if session.session_present else 0x00
+                        connack_packet = create_connack_packet(connect_ack_flags=ack_flags, reason_code=reason_code)
+                        self.dispatcher.send(conn, connack_packet)  # Send the CONNACK response packet to the client
+
+                        # If connection is successful (reason code 0x00), add to active connections
+                        if reason_code == 0x00:
+                            connected_client = session
+                            self.will_registry.register(connected_client.client_id, decoded_packet)
+                            self.active_connections[decoded_packet.get("client_id")] = conn
+                            self.sessions[connected_client.client_id] = connected_client
+                            print(f"Client '{decoded_packet.get('client_id')}' connected successfully.")
+                            self._resume_pending(connected_client, conn)
+                        else:
+                            print(f"Connection failed with reason code 0x{reason_code:02X}")
+                            break
+
+                    # Handle PINGREQ packet
+                    elif decoded_packet.get("packet_type") == "PINGREQ":
+                        print(f"Received PINGREQ from client {addr}")
+                        pingresp_packet = create_pingresp_packet()  # Create a PINGRESP packet
+                        self.dispatcher.send(conn, pingresp_packet)
+                        print(f"Sent PINGRESP to client {addr}")
+
+                    # Handle PUBLISH packet (QoS 0 and 1)
+                    elif decoded_packet.get("packet_type") == "PUBLISH" and decoded_packet.get("qos") != 2:
+                        print(f"Received PUBLISH from client {addr}")
+                        packet_id = decoded_packet.get("packet_identifier")
+                        if packet_id is None and decoded_packet.get("qos") > 0:
+                            print(f"Error: No packet identifier provided for QoS {decoded_packet.get('qos')}")
+                            break
 
+                        message = Message(
+                            topic=decoded_packet.get("topic_name"),
+                            payload=decoded_packet.get("payload"),
+                            qos=decoded_packet.get("qos"),
+                            retain=decoded_packet.get("retain"),
+                            packet_id=packet_id,
+                            message_expiry_interval=decoded_packet.get("properties", {}).get("message_expiry_interval"),
+                            user_properties=decoded_packet.get("properties", {}).get("user_properties")
+                        )
+                        self.stats.record_in(messages=1)
+
+                        # Save the message and respond with PUBACK for QoS 1
+                        if self._archive(message):
+                            if message.qos == 1:
+                                puback_packet = create_puback_packet(packet_id)
+                                self.dispatcher.send(conn, puback_packet)
+                                print(f"Sent PUBACK to client '{connected_client.client_id}' for packet ID '{packet_id}'")
+                            self._publish(message)
+
+
+
+                    # Handle PUBLISH packet (QoS 2)
+                    elif decoded_packet.get("packet_type") == "PUBLISH" and decoded_packet.get("qos") == 2:
+                        packet_id = decoded_packet.get("packet_identifier")
+                        if packet_id is None:
+                            print("Error: Packet ID is required for QoS 2")
+                            break
 
+                        message = Message(
+                            topic=decoded_packet.get("topic_name"),
+                            payload=decoded_packet.get("payload"),
+                            qos=decoded_packet.get("qos"),
+                            retain=decoded_packet.get("retain"),
+                            packet_id=packet_id,
+                            message_expiry_interval=decoded_packet.get("properties", {}).get("message_expiry_interval"),
+                            user_properties=decoded_packet.get("properties", {}).get("user_properties")
+                        )
+                        self.stats.record_in(messages=1)
+
+                        if self._archive(message):
+                            # Held until PUBREL, the archive may not contain it
+                            connected_client.inbound_qos2[packet_id] = message
+                            pubrec_packet = create_pubrec_packet(packet_id)
+                            self.dispatcher.send(conn, pubrec_packet)
+
+
+                    elif decoded_packet.get("packet_type") == "PUBREL":
+                        packet_id = decoded_packet.get("packet_identifier")
+                        if packet_id is not None:
+                            pubcomp_packet = create_pubcomp_packet(packet_id)
+                            self.dispatcher.send(conn, pubcomp_packet)
+                            print(f"Sent PUBCOMP to client for packet ID '{packet_id}'")
+                            message = connected_client.inbound_qos2.pop(packet_id, None)
+                            if message is None:
+                                message = self.db.retrieve_message_by_packet_id(packet_id)
 
-                        elif decoded_packet.get("packet_type") == "SUBSCRIBE":
-                            packet_id = decoded_packet.get("packet_identifier")
-                            topics = decoded_packet.get("topics")
-                            return_codes = []
-                            for topic in topics:
-                                topic_filter = topic["topic_filter"]
-                                qos = topic["subscription_options"] & 0x03
-                                if self.db.save_subscription(connected_client.client_id, topic_filter, qos):
-                                    return_codes.append(qos)
-                                else:
-                                    return_codes.append(0x80)
-                            suback_packet = create_suback_packet(packet_id, return_codes)
-                            conn.sendall(suback_packet)
-                            print(f"Sent SUBACK '{suback_packet}' to client '{connected_client.client_id}' for packet ID '{packet_id}'")
-
-                            # Fetch and dispatch retained messages for each subscribed topic
-                            for topic in topics:
-                                topic_filter = topic["topic_filter"]
-                                retained_messages = self.db.return_last_retained_messages(topic_filter)
-
-                                for retained_message in retained_messages:
-                                    self.dispatcher.dispatch_message(retained_message, {connected_client.client_id: conn})
-
-                        elif decoded_packet.get("packet_type") == "UNSUBSCRIBE":
-                            packet_id = decoded_packet.get("packet_identifier")
-                            topics = decoded_packet.get("topics")
-
-                            for topic_filter in topics:
-                                if self.db.remove_subscription(connected_client.client_id, topic_filter):
-                                    print(f"Unsubscribed client '{connected_client.client_id}' from topic '{topic_filter}'")
-                                else:
-                                    print(f"Failed to unsubscribe client '{connected_client.client_id}' from topic '{topic_filter}'")
-
-                            unsuback_packet = create_unsuback_packet(packet_id)
-                            conn.sendall(unsuback_packet)
-                            print(f"Sent UNSUBACK to client '{connected_client.client_id}' for packet ID '{packet_id}'")
-
-                        elif decoded_packet.get("packet_type") == "DISCONNECT":
-                            if connected_client.clean_session:
-                                self.db.remove_all_subscriptions_for_client(connected_client.client_id)
-                                print(f"Deleted all subscriptions for client '{connected_client.client_id}'")
-                            print(f"Disconnected from client {addr}")
-                            self.db.update_disconnect_time(connected_client.client_id)
-                            if connected_client and connected_client.client_id in self.active_connections:
-                                self.active_connections.pop(connected_client.client_id, None)
-                                print(f"Connection closed with {addr}")
-                    elif self.shutdown_event.is_set():
-                        print(f"We are disconecting clinent {connected_client.client_id}")
-                        conn.sendall(create_disconnect_packet())
+                            if message:
+                                self._publish(message)
+                            else:
+                                print(f"No message found with packet ID '{packet_id}'")
+
+                    # For PUBREC and PUBCOMP
+                    elif decoded_packet.get("packet_type") == "PUBREC":
+                        packet_id = decoded_packet.get("packet_identifier")
+                        print(f"Processing PUBREC for packet ID {packet_id}")
+                        with self.dispatcher.pending_acks_lock:
+                            pubrec_event = self.dispatcher.pending_acks.get(packet_id)
+                            if pubrec_event:
+                                pubrec_event.set()  # Trigger the event for PUBREC
+                                print(f"Set PUBREC event for packet ID {packet_id}")
+                            else:
+                                print(f"No matching PUBREC event found for packet ID {packet_id}")
+
+                    elif decoded_packet.get("packet_type") == "PUBCOMP":
+                        packet_id = decoded_packet.get("packet_identifier")
+                        print(f"Processing PUBCOMP for packet ID {packet_id}")
+                        with self.dispatcher.pending_acks_lock:
+                            pubcomp_event = self.dispatcher.pending_acks.get(packet_id)
+                            if pubcomp_event:
+                                pubcomp_event.set()  # Trigger the event for PUBCOMP
+                                print(f"Set PUBCOMP event for packet ID {packet_id}")
+                            else:
+                                print(f"No matching PUBCOMP event found for packet ID {packet_id}")
+
+                    elif decoded_packet.get("packet_type") == "PUBACK":
+                        print(self.dispatcher.pending_acks)
+                        packet_id = decoded_packet.get("packet_identifier")
+                        print(f"Processing PUBACK for packet ID {packet_id}")
+                        with self.dispatcher.pending_acks_lock:
+                            puback_event = self.dispatcher.pending_acks.get(packet_id)
+                            if puback_event:
+                                puback_event.set()  # Trigger the event for PUBACK
+                                print(f"Set PUBACK event for packet ID {packet_id}")
+                            else:
+                                print(f"No matching PUBACK event found for packet ID {packet_id}")
+
+
+
+                    elif decoded_packet.get("packet_type") == "SUBSCRIBE":
+                        packet_id = decoded_packet.get("packet_identifier")
+                        topics = decoded_packet.get("topics")
+                        try:
+                            requested_replay = replay_range(decoded_packet.get("properties", {}).get("user_properties"))
+                        except ValueError as e:
+                            print(f"Ignoring replay request of '{connected_client.client_id}': {e}")
+                            requested_replay = None
+                        subscriptions = [
+                            (topic["topic_filter"], topic["subscription_options"] & 0x03, topic["subscription_options"])
+                            for topic in topics
+                        ]
+                        # All filters of the packet are stored in one transaction
+                        new_flags = self.db.save_subscriptions(connected_client.client_id, subscriptions)
+                        return_codes = []
+                        retained_filters = []
+                        if new_flags is None:
+                            return_codes = [0x80] * len(subscriptions)  # Unspecified error
+                        else:
+                            for (topic_filter, qos, options), is_new in zip(subscriptions, new_flags):
+                                return_codes.append(qos)
+                                retain_handling = (options >> 4) & 0x03
+                                # 0 = always send retained, 1 = only for a new subscription, 2 = never
+                                if retain_handling == 0 or (retain_handling == 1 and is_new):
+                                    retained_filters.append((topic_filter, qos))
+                        suback_packet = create_suback_packet(packet_id, return_codes)
+                        self.dispatcher.send(conn, suback_packet)
+                        print(f"Sent SUBACK '{suback_packet}' to client '{connected_client.client_id}' for packet ID '{packet_id}'")
+
+                        # Matching retained messages, then the archive backfill of the new subscriptions up
+                        # to now, go to this session as one stream so they arrive in that order
+                        deliveries = []
+                        if retained_filters:
+                            deliveries.append(self._iter_retained(retained_filters))
+                        if requested_replay and new_flags is not None:
+                            start, end = requested_replay
+                            deliveries.append(self.replay_reader.deliveries(
+                                [(topic_filter, qos) for topic_filter, qos, _ in subscriptions],
+                                start, time() if end is None else end
+                            ))
+                        if deliveries:
+                            self.dispatcher.stream_to_session(connected_client, conn, chain(*deliveries))
+
+                    elif decoded_packet.get("packet_type") == "UNSUBSCRIBE":
+                        packet_id = decoded_packet.get("packet_identifier")
+                        topics = decoded_packet.get("topics")
+
+                        removed = self.db.remove_subscriptions(connected_client.client_id, topics)
+                        if removed is None:
+                            reason_codes = [0x80] * len(topics)  # Unspecified error
+                        else:
+                            # 0x00 = Success, 0x11 = No subscription existed
+                            reason_codes = [0x00 if existed else 0x11 for existed in removed]
+                            print(f"Unsubscribed client '{connected_client.client_id}' from {sum(removed)} of {len(topics)} topic(s)")
+
+                        unsuback_packet = create_unsuback_packet(packet_id, reason_codes)
+                        self.dispatcher.send(conn, unsuback_packet)
+                        print(f"Sent UNSUBACK to client '{connected_client.client_id}' for packet ID '{packet_id}'")
+
+                    elif decoded_packet.get("packet_type") == "DISCONNECT":
+                        disconnect_reason = decoded_packet.get("reason_code", 0x00)
                         if connected_client.clean_session:
                             self.db.remove_all_subscriptions_for_client(connected_client.client_id)
                             print(f"Deleted all subscriptions for client '{connected_client.client_id}'")
                         print(f"Disconnected from client {addr}")
-                        self.db.update_disconnect_time(connected_client.client_id)
-                        if connected_client and connected_client.client_id in self.active_connections:
-                            self.active_connections.pop(connected_client.client_id, None)
-                            print(f"Connection closed with {addr}")
-                        conn.close()
-                        if not self.active_connections:
-                            print(f'Server is shut down')
-
+                        break
                 except socket.timeout:
                     print(f"Connection to {addr} timed out")
                     break
@@ -255,48 +446,179 @@ class MQTT5Server():
                     break
 
         finally:
+            if admitted:
+                self.admission.release()
             if connected_client and connected_client.client_id in self.active_connections:
                 self.active_connections.pop(connected_client.client_id, None)
                 print(f"Connection closed with {addr}")
+            if connected_client and self.sessions.get(connected_client.client_id) is connected_client:
+                del self.sessions[connected_client.client_id]
 
             if connected_client and connected_client.client_id:
                 self.db.update_disconnect_time(connected_client.client_id)
-                if connected_client.isLastWill:
-                    last_will = self.db.retrieve_last_will(connected_client.client_id)
-                    will_message = Message(
-                        topic=last_will["topic"],
-                        payload=last_will["message"],
-                        qos=last_will["qos"],
-                        retain=last_will["retain"],
-                        packet_id=None  # No specific packet ID for LWT
-                    )
-                    if self.db.save_message(will_message):
-                        print(f"Saving message which was used as last will in the messages table")
-                    self.dispatcher.dispatch_message(will_message, self.active_connections)
-                    print(f"Dispatched Last Will for client '{connected_client.client_id}'")
-                    if self.db.remove_last_will(connected_client.client_id):
-                        print(f"Removed Last Will for client '{connected_client.client_id}'")
-                    print(f"Updated disconnect time for client '{connected_client.client_id}'")
-
-                    if connected_client.clean_session:
-                        if self.db.remove_all_subscriptions_for_client(connected_client.client_id):
-                            print(f"Removed all subscriptions for client '{connected_client.client_id}', as per clean session")
+                print(f"Updated disconnect time for client '{connected_client.client_id}'")
+                if disconnect_reason == 0x00:
+                    # Normal disconnection: the will is not published
+                    self.will_registry.discard(connected_client.client_id)
+                elif self.draining.is_set():
+                    # Broker shutdown: the will is kept in the snapshot and scheduled on the next start
+                    pass
+                else:
+                    # Dropped connection or DISCONNECT with Will Message (0x04)
+                    self.will_registry.trigger(connected_client.client_id, connected_client.session_expiry)
             conn.close()
 
+    def _run_client(self, conn, addr):
+        try:
+            self.handle_client(conn, addr)
+        finally:
+            self.client_threads.discard(threading.current_thread())
+
     def server_start(self):
         print(f"Server listening on {self.IP_ADDR}:{self.PORT}")
         while not self.shutdown_event.is_set():  # Loop until the shutdown event is set
             try:
                 self.s_server.settimeout(1.0)  # Use a timeout to periodically check the event
                 s_conn, client_addr = self.s_server.accept()
-                client_thread = threading.Thread(target=self.handle_client, args=(s_conn, client_addr))
+                client_thread = threading.Thread(target=self._run_client, args=(s_conn, client_addr))
                 client_thread.daemon = True
+                self.client_threads.add(client_thread)
                 client_thread.start()
             except socket.timeout:
                 continue  # Ignore timeout and re-check the event
             except Exception as e:
-                print(f"Error in server loop: {e}")
+                if not self.shutdown_event.is_set():
+                    print(f"Error in server loop: {e}")
                 break
+        print("Server stopped accepting connections")
+
+    def add_user(self, username, password) -> bool:
+        """Admin call: creates a user or changes its password."""
+        return self.authenticator.add_user(username, password)
+
+    def remove_user(self, username) -> bool:
+        """Admin call: deletes a user; its open connections stay up until they reconnect."""
+        return self.authenticator.remove_user(username)
+
+    def replay(self, client_id, topic_filter, start, end=None, qos=1) -> bool:
+        """
+        Admin call: streams the archived messages of `topic_filter` published between `start` and `end`
+        (epoch seconds, `end` defaults to now) to a connected session at up to `qos`, paced by its
+        flow-control window. Returns False if the client is not connected.
+        """
+        client = self.sessions.get(client_id)
+        conn = self.active_connections.get(client_id)
+        if client is None or conn is None:
+            print(f"Cannot replay to '{client_id}': not connected")
+            return False
+        self.dispatcher.stream_to_session(client, conn, self.replay_reader.deliveries([(topic_filter, qos)], start, end))
+        return True
+
+    def train_archive_dictionary(self, topic_prefix, samples=1000, size=MAX_DICTIONARY_SIZE):
+        """
+        Admin call: trains a zlib dictionary on the latest archived payloads under `topic_prefix` and
+        uses it for that prefix's new payloads. Returns the dictionary id, or None if nothing was trained.
+        """
+        dictionary = train_dictionary(self.db.sample_payloads(topic_prefix, samples), size)
+        if not dictionary:
+            print(f"No archived payloads under '{topic_prefix}' to train a dictionary on")
+            return None
+        dictionary_id = self.db.save_compression_dictionary(topic_prefix, dictionary)
+        if dictionary_id is not None:
+            print(f"Trained a {len(dictionary)} byte compression dictionary for '{topic_prefix}'")
+        return dictionary_id
+
+    def _resume_pending(self, client, conn):
+        """Sends the deliveries a resumed session was owed when the broker last shut down."""
+        pending = self.pending_sessions.pop(client.client_id, None)
+        if not pending or not pending["pending"]:
+            return
+        if not client.session_present:
+            print(f"Dropped {len(pending['pending'])} snapshot delivery(ies) for '{client.client_id}': session not resumed")
+            return
+        self.dispatcher.stream_to_session(client, conn, iter(pending["pending"]))
+
+    def shutdown(self, deadline=10):
+        """
+        Graceful shutdown, bounded by `deadline` seconds:
+        1. stop accepting connections and refuse CONNECTs still in progress
+        2. wait for queued deliveries and in-flight QoS 1/2 handshakes to complete
+        3. send DISCONNECT 0x8B (Server shutting down) to every session in one pass
+        4. stop background work, flush write-behind state and write the snapshot loaded by the next start
+        Returns True if everything was delivered before the deadline.
+        """
+        if self.draining.is_set():
+            return False
+        started = monotonic()
+        remaining = lambda: max(0.0, deadline - (monotonic() - started))
+        print("Shutting down server...")
+        self.draining.set()
+        self.shutdown_event.set()
+        try:
+            self.s_server.shutdown(socket.SHUT_RDWR)  # Wakes up a blocked accept
+        except OSError:
+            pass
+        self.s_server.close()
+
+        # Let queued messages and QoS handshakes (both directions) finish
+        drained = self.dispatcher.drain(remaining())
+        while any(client.inbound_qos2 for client in list(self.sessions.values())) and remaining() > 0:
+            self.shutdown_event.wait(0.05)
+        drained = drained and not any(client.inbound_qos2 for client in list(self.sessions.values()))
+
+        # Stop routing before the sockets close, so unsent deliveries are kept instead of failing
+        sessions = {
+            client_id: {"session_expiry": client.session_expiry, "pending": []}
+            for client_id, client in list(self.sessions.items())
+        }
+        pending = self.dispatcher.take_pending()
+
+        # Notify every session at once, then wait for their threads to record the disconnect
+        disconnect_packet = create_disconnect_packet(0x8B)  # Server shutting down
+        for client_id, conn in list(self.active_connections.items()):
+            try:
+                self.dispatcher.send(conn, disconnect_packet)
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError as e:
+                print(f"Could not notify client '{client_id}' of the shutdown: {e}")
+        for client_thread in list(self.client_threads):
+            client_thread.join(remaining())
+
+        # Stop background work and persist what is left in memory
+        self.scheduler.shutdown()
+        self.expiry_heap.shutdown()
+        self.will_registry.shutdown()
+        # Messages published by the last packets read before the sockets closed
+        for client_id, deliveries in self.dispatcher.take_pending().items():
+            pending.setdefault(client_id, []).extend(deliveries)
+        for client_id, deliveries in pending.items():
+            if client_id in sessions:
+                sessions[client_id]["pending"].extend(deliveries)
+        self.dispatcher.shutdown(wait=False)
+        self.authenticator.shutdown()
+        self.retained_store.flush()
+        self.will_registry.flush()
+        self.topic_history.flush()
+        if self.archive_log is not None:
+            self.archive_log.close()
+        # Sessions restored from the previous snapshot that never reconnected are carried over
+        for client_id, session in self.pending_sessions.items():
+            if client_id not in sessions and time() - self.snapshot_created_at < session["session_expiry"]:
+                sessions[client_id] = session
+
+        if self.snapshot_file:
+            snapshot = BrokerSnapshot(
+                sessions=sessions,
+                subscriptions=self.db.list_topic_filters(),
+                retained=self.retained_store.messages(),
+                wills=self.will_registry.pending_wills()
+            )
+            if snapshot.save(self.snapshot_file):
+                print(f"Wrote {snapshot} to '{self.snapshot_file}'")
+        self.db.close()
+        print(f"Server is shut down after {monotonic() - started:.2f} second(s)"
+              + ("" if drained else " (deadline reached before all deliveries completed)"))
+        return drained
 
 
 
@@ -0,0 +1,160 @@
+import base64
+import json
+import os
+import zlib
+from time import time
+from message import Message
+from will_message import WillMessage
+
+
+class BrokerSnapshot:
+    """
+    Compact image of the broker's in-memory state, written on graceful shutdown and read back on
+    the next start so the broker does not rebuild it from SQLite. Contents:
+    - sessions: {client_id: {"session_expiry", "pending": [(message, granted QoS)]}} for the sessions
+      open at shutdown, with the deliveries that could not be sent before the deadline
+    - subscriptions: every stored topic filter (one entry per subscription)
+    - retained: retained messages
+    - wills: will messages that were not published
+    The file is zlib-compressed JSON, replaced atomically, and removed once loaded so a snapshot
+    is never applied twice or after an unclean stop.
+    """
+
+    VERSION = 1
+
+    def __init__(self, sessions=None, subscriptions=None, retained=None, wills=None, created_at=None):
+        self.sessions = sessions or {}
+        self.subscriptions = subscriptions or []
+        self.retained = retained or []
+        self.wills = wills or []
+        self.created_at = time() if created_at is None else created_at
+
+    def save(self, path: str) -> bool:
+        """Writes the snapshot to `path`. Returns False if it could not be written."""
+        document = {
+            "version": self.VERSION,
+            "created_at": self.created_at,
+            "sessions": {
+                client_id: {
+                    "session_expiry": session.get("session_expiry", 0),
+                    "pending": [[_encode_message(message), qos] for message, qos in session.get("pending", [])],
+                }
+                for client_id, session in self.sessions.items()
+            },
+            "subscriptions": self.subscriptions,
+            "retained": [_encode_message(message) for message in self.retained],
+            "wills": [_encode_will(will) for will in self.wills],
+        }
+        temporary_path = path + ".tmp"
+        try:
+            with open(temporary_path, "wb") as snapshot_file:
+                snapshot_file.write(zlib.compress(json.dumps(document, separators=(",", ":")).encode()))
+            os.replace(temporary_path, path)
+            return True
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Error writing snapshot '{path}': {e}")
+            return False
+
+    @classmethod
+    def load(cls, path: str, consume=True):
+        """Reads a snapshot written by `save`. Returns None if there is none or it cannot be used."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as snapshot_file:
+                document = json.loads(zlib.decompress(snapshot_file.read()).decode())
+            if document.get("version") != cls.VERSION:
+                print(f"Ignoring snapshot '{path}' with unsupported version {document.get('version')}")
+                return None
+            return cls(
+                sessions={
+                    client_id: {
+                        "session_expiry": session["session_expiry"],
+                        "pending": [(_decode_message(message), qos) for message, qos in session["pending"]],
+                    }
+                    for client_id, session in document["sessions"].items()
+                },
+                subscriptions=document["subscriptions"],
+                retained=[_decode_message(message) for message in document["retained"]],
+                wills=[_decode_will(will) for will in document["wills"]],
+                created_at=document["created_at"],
+            )
+        except (OSError, zlib.error, ValueError, KeyError, TypeError) as e:
+            print(f"Ignoring unreadable snapshot '{path}': {e}")
+            return None
+        finally:
+            if consume:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def __repr__(self):
+        return (f"<BrokerSnapshot sessions={len(self.sessions)} subscriptions={len(self.subscriptions)} "
+                f"retained={len(self.retained)} wills={len(self.wills)}>")
+
+
+def _encode_payload(payload):
+    if isinstance(payload, (bytes, bytearray)):
+        return {"b64": base64.b64encode(bytes(payload)).decode()}
+    return payload
+
+
+def _decode_payload(payload):
+    if isinstance(payload, dict):
+        return base64.b64decode(payload["b64"])
+    return payload
+
+
+def _encode_message(message):
+    return {
+        "topic": message.topic,
+        "payload": _encode_payload(message.payload),
+        "qos": message.qos,
+        "retain": bool(message.retain),
+        "published_at": message.published_at if isinstance(message.published_at, (str, int, float)) else None,
+        "message_expiry_interval": message.message_expiry_interval,
+        "expires_at": message.expires_at,
+        "user_properties": message.user_properties,
+        "priority": message.priority,
+    }
+
+
+def _decode_message(document):
+    return Message(
+        topic=document["topic"],
+        payload=_decode_payload(document["payload"]),
+        qos=document["qos"],
+        retain=document["retain"],
+        published_at=document["published_at"],
+        message_expiry_interval=document["message_expiry_interval"],
+        expires_at=document["expires_at"],
+        user_properties=document["user_properties"],
+        priority=document["priority"],
+    )
+
+
+def _encode_will(will):
+    return {
+        "client_id": will.client_id,
+        "topic": will.topic,
+        "message": _encode_payload(will.message),
+        "qos": will.qos,
+        "retain": bool(will.retain),
+        "registered_at": will.registered_at if isinstance(will.registered_at, (str, int, float)) else None,
+        "delay_interval": will.delay_interval,
+        "message_expiry_interval": will.message_expiry_interval,
+    }
+
+
+def _decode_will(document):
+    return WillMessage(
+        client_id=document["client_id"],
+        topic=document["topic"],
+        message=_decode_payload(document["message"]),
+        qos=document["qos"],
+        retain=document["retain"],
+        registered_at=document["registered_at"],
+        delay_interval=document["delay_interval"],
+        message_expiry_interval=document["message_expiry_interval"],
+    )
@@ -2,27 +2,62 @@ import sqlite3
 from typing import Optional, List, Tuple
 from client import Client
 from message import Message
-import hashlib
+from will_message import WillMessage
+from storage import StorageBase
+from archive_compression import ArchiveCompression
+from topic import matches_topic_filter
 import threading
-from datetime import datetime
+import heapq
+from itertools import islice
+from time import time
 
-class SQLServer:
-    """Initializes and configures the MQTT SQL server with essential parameters and database setup."""
+class SQLServer(StorageBase):
+    """
+    SQLite storage backend: initializes and configures the MQTT SQL server with essential parameters
+    and database setup.
+    """
 
-    def __init__(self, db_name="mqtt_server.db", SUPPORTED_MQTT_VERSION=5.0, MAX_CONNECTIONS=50, MIN_CONNECTION_INTERVAL=1, MAX_CLIENT_ID_LENGTH=23):
+    def __init__(self, db_name="mqtt_server.db", SUPPORTED_MQTT_VERSION=5.0, MAX_CONNECTIONS=50, MIN_CONNECTION_INTERVAL=1, MAX_CLIENT_ID_LENGTH=23, SUBSCRIPTION_CACHE_SIZE=4096):
         # Initialize server parameters and set up database tables
+        super().__init__(SUPPORTED_MQTT_VERSION, MAX_CONNECTIONS, MIN_CONNECTION_INTERVAL, MAX_CLIENT_ID_LENGTH,
+                         SUBSCRIPTION_CACHE_SIZE)
         self.db_name = db_name
-        self.SUPPORTED_MQTT_VERSION = SUPPORTED_MQTT_VERSION
-        self.MAX_CONNECTIONS = MAX_CONNECTIONS
-        self.MIN_CONNECTION_INTERVAL = MIN_CONNECTION_INTERVAL
-        self.MAX_CLIENT_ID_LENGTH = MAX_CLIENT_ID_LENGTH
         self.lock = threading.Lock()  # Ensures thread-safe operations
+        self._local = threading.local()  # Holds one reusable connection per thread
+        self._decoder = None  # ArchiveCompression reading compressed rows while `compression` is None
         self.setup_tables()  # Create database tables if they don’t exist
 
     def _get_connection(self):
         """Creates and returns a new SQLite connection for the current thread."""
         return sqlite3.connect(self.db_name, check_same_thread=False)
 
+    def _get_thread_connection(self):
+        """Returns the connection reserved for the current thread, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._get_connection()
+        return conn
+
+    def list_topic_filters(self) -> List[str]:
+        """Returns the topic filter of every stored subscription (one entry per subscription)."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT topic_filter FROM subscriptions WHERE topic_filter IS NOT NULL")
+                return [topic_filter for (topic_filter,) in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error listing subscriptions: {e}")
+            return []
+
+    def _get_or_create_topic_id(self, cursor, topic: str) -> int:
+        """Returns the id of a topic, inserting it first if needed. Runs inside the caller's transaction."""
+        cursor.execute("SELECT id FROM topics WHERE full_path = ?", (topic,))
+        topic_result = cursor.fetchone()
+        if topic_result:
+            return topic_result[0]
+        cursor.execute("INSERT INTO topics (topic_name, full_path) VALUES (?, ?)", (topic.split('/')[-1], topic))
+        return cursor.lastrowid
+
     def setup_tables(self):
         """
         Creates all necessary database tables for managing MQTT server clients, topics, subscriptions, messages, and related data.
@@ -30,6 +65,9 @@ class SQLServer:
 
         with self._get_connection() as conn:
             cursor = conn.cursor()
+            # Lets the retention pruner return freed pages with incremental_vacuum. Only takes effect
+            # when the file is created; an existing file keeps its mode until it is VACUUMed once.
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
             # Create tables if they don't exist
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS clients (
@@ -88,13 +126,27 @@ class SQLServer:
                     FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
                 );
             """)
+            # The first layout only pointed into `messages` and was never written: replace it
+            cursor.execute("PRAGMA table_info(topic_history)")
+            if "message_id" in (row[1] for row in cursor.fetchall()):
+                cursor.execute("DROP TABLE topic_history")
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS topic_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     topic_id INTEGER NOT NULL,  -- Links to the `topics` table
-                    message_id INTEGER NOT NULL,  -- Links to the `messages` table
-                    FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE,
-                    FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
+                    payload TEXT NOT NULL,  -- Copy of the message, kept when `messages` is pruned
+                    qos INTEGER DEFAULT 0,
+                    published_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
+                );
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_topic_history_topic ON topic_history (topic_id, id)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS compression_dictionaries (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    prefix TEXT NOT NULL,  -- Topic prefix the dictionary was trained on
+                    dictionary BLOB NOT NULL,  -- zlib preset dictionary, kept while rows may refer to it
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 );
             """)
             cursor.execute("""
@@ -110,219 +162,212 @@ class SQLServer:
                     FOREIGN KEY (topic_id) REFERENCES topics (id) ON DELETE CASCADE
                 );
             """)
+            # Columns added after the initial schema
+            self._ensure_column(cursor, "topics", "retained_expires_at", "REAL")  # Epoch seconds, NULL if the retained message never expires
+            self._ensure_column(cursor, "messages", "expires_at", "REAL")  # Epoch seconds, NULL if the message never expires
+            self._ensure_column(cursor, "messages", "payload_encoding", "TEXT")  # ArchiveCompression encoding, NULL if verbatim
+            self._ensure_column(cursor, "will_messages", "delay_interval", "INTEGER DEFAULT 0")  # Will Delay Interval in seconds
+            self._ensure_column(cursor, "will_messages", "message_expiry_interval", "INTEGER")
+            self._ensure_column(cursor, "subscriptions", "options", "INTEGER DEFAULT 0")  # Raw SUBSCRIBE options byte
+
+            # Every subscription row carries its topic filter (also for exact topics), unique per client
+            cursor.execute("""
+                UPDATE subscriptions SET topic_filter = (SELECT full_path FROM topics WHERE topics.id = subscriptions.topic_id)
+                WHERE topic_filter IS NULL AND topic_id IS NOT NULL
+            """)
+            cursor.execute("""
+                DELETE FROM subscriptions WHERE id NOT IN (
+                    SELECT MAX(id) FROM subscriptions GROUP BY client_id, topic_filter
+                )
+            """)
+            cursor.execute("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_subscriptions_client_filter
+                ON subscriptions (client_id, topic_filter)
+            """)
+            # Per-topic retention counts and trimming
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_topic ON messages (topic_id, id)")
+            # Time-range replay of a topic's archive
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_topic_published ON messages (topic_id, published_at)")
+            # Keyset pagination of the dashboard's QoS 1/2 message view, newest first
+            cursor.execute("""
+                CREATE INDEX IF NOT EXISTS idx_messages_qos_published
+                ON messages (published_at, id) WHERE qos IN (1, 2)
+            """)
             conn.commit()
 
-    def store_client(self, decoded_packet: dict) -> Tuple[int, int]:
+    def _ensure_column(self, cursor, table: str, column: str, definition: str) -> None:
+        """Adds a column to an existing table if it is missing (used for schema upgrades)."""
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in (row[1] for row in cursor.fetchall()):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def establish_session(self, decoded_packet: dict) -> Optional[Client]:
         """
-        Tries to store and authenticate the client. Returns a tuple of (connect_ack_flags, reason_code).
+        Sets up the session of an authenticated client in a single transaction on the thread's connection:
+        client row upsert and Clean Start handling.
+        Returns the ready Client, or None if the session could not be stored.
         """
         client_id = decoded_packet.get("client_id")
-        username = decoded_packet.get("username")
-        password = decoded_packet.get("password")
-        protocol_level = decoded_packet.get("protocol_level")
-        packet_size = decoded_packet.get("length")
-
-        # Reject if packet size exceeds maximum allowed limit
-        if packet_size > 268435456:
-            return (0x00, 0x95)  # Packet too large
-
-        # Reject if MQTT protocol version is unsupported
-        if protocol_level != self.SUPPORTED_MQTT_VERSION:
-            return (0x00, 0x84)  # Unsupported Protocol Version
-
-        # Check server availability and reject if unavailable
-        if not self.is_server_available():
-            return (0x00, 0x88)  # Server Unavailable
-
-        # Reject if server is too busy to handle more connections
-        if self.is_server_busy():
-            return (0x00, 0x89)  # Server Busy
-
-        # Reject if client is banned
-        if self.is_client_banned(client_id):
-            return (0x00, 0x8A)  # Client Banned
-
-        # Reject if client is connecting too frequently
-        if self.is_connection_rate_exceeded(client_id):
-            return (0x00, 0x9F)  # Connection Rate Exceeded
-
-        # Reject if client ID is invalid or too long
-        if not client_id or len(client_id) > self.MAX_CLIENT_ID_LENGTH:
-            return (0x00, 0x85)  # Client Identifier Not Valid
-
-        # Store or authenticate client in the database
+        properties = decoded_packet.get("properties", {})
+        session_expiry = properties.get("session_expiry_interval", 0)
+        clean_start = decoded_packet.get("clean_session")
+        conn = self._get_thread_connection()
         try:
-            with self._get_connection() as conn:
+            with conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT password, username FROM users WHERE username = ?", (username,))
-                existing_record = cursor.fetchone()
-
-                # Validate username and password if client already exists
-                if existing_record:
-                    stored_password_hash = existing_record[0]
-                    stored_username = existing_record[1]
-                    provided_password_hash = hashlib.sha256(password.encode()).hexdigest() if password else None
-                    if provided_password_hash != stored_password_hash or stored_username != username:
-                        return (0x00, 0x86)  # Bad Username or Password
-
-                # Hash password if provided
-                password_hash = hashlib.sha256(password.encode()).hexdigest() if password else None
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT 1 FROM clients WHERE client_id = ?", (client_id,))
+                session_present = cursor.fetchone() is not None and not clean_start
 
                 # Insert or update client record in the database
-                query = """
-                INSERT INTO clients (client_id, session_expiry, keep_alive, connected)
-                VALUES (?, ?, ?, 1)
+                cursor.execute("""
+                INSERT INTO clients (client_id, clean_session, session_expiry, keep_alive, connected)
+                VALUES (?, ?, ?, ?, 1)
                 ON CONFLICT(client_id) DO UPDATE SET
                     connected=1,
+                    clean_session=excluded.clean_session,
                     session_expiry=excluded.session_expiry,
                     keep_alive=excluded.keep_alive,
                     last_seen=CURRENT_TIMESTAMP
-                """
-                cursor.execute(query, (client_id, decoded_packet.get("session_expiry", 0),
-                                       decoded_packet.get("keep_alive", 60)))
-                conn.commit()  # Save changes to the database
+                """, (client_id, clean_start, session_expiry, decoded_packet.get("keep_alive", 60)))
 
-                query = """
-                INSERT INTO users (username, password)
-                VALUES (?, ?)
-                ON CONFLICT(username) DO UPDATE SET
-                    username=excluded.username,
-                    password=excluded.password
-                """
-                cursor.execute(query, (username, password_hash))
-                conn.commit()  # Save changes to the database
-
-            # Handle Last Will if provided
-            if decoded_packet.get("will_flag"):
-                self.save_will_message(
-                    client_id=client_id,
-                    topic=decoded_packet.get("will_topic"),
-                    message=decoded_packet.get("will_message"),
-                    qos=decoded_packet.get("will_properties", {}).get("will_qos", 0),
-                    retain=decoded_packet.get("will_properties", {}).get("will_retain", False),
-                )
+                # Clean Start discards any existing session state
+                removed_filters = []
+                if clean_start:
+                    cursor.execute("SELECT topic_filter FROM subscriptions WHERE client_id = ?", (client_id,))
+                    removed_filters = [row[0] for row in cursor.fetchall() if row[0]]
+                    cursor.execute("DELETE FROM subscriptions WHERE client_id = ?", (client_id,))
+                # Wills are not written here: WillRegistry keeps them and writes them back with save_will_batch
+            if removed_filters:
+                self._forget_subscriptions(removed_filters)
+                self.subscription_cache.invalidate_client(client_id)
 
-            return (0x00, 0x00)  # Connection Success
+            return self._new_session(decoded_packet, session_present)
 
-        except sqlite3.IntegrityError as e:
+        except sqlite3.Error as e:
             print(f"Error storing client '{client_id}': {e}")
-            return (0x00, 0x87)  # Connection Refused, Not Authorized
-
-    def is_server_available(self) -> bool:
-        """Checks if server is available for new connections."""
-        return True  # Placeholder for actual server status check
+            return None
 
-    def is_server_busy(self) -> bool:
-        """Checks if server is busy, e.g., using a limit on active connections."""
+    def get_password_hash(self, username: str) -> Optional[str]:
+        """Returns the stored password hash of a user, or None if the user does not exist."""
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                # Query count of currently connected clients
-                cursor.execute("SELECT COUNT(*) FROM clients WHERE connected = 1")
-                active_connections = cursor.fetchone()[0]
-                # Return True if active connections exceed max allowed connections
-                return active_connections >= self.MAX_CONNECTIONS
+                cursor.execute("SELECT password FROM users WHERE username = ?", (username,))
+                result = cursor.fetchone()
+                return result[0] if result else None
         except sqlite3.Error as e:
-            print(f"Error checking server busy status: {e}")
-            return True
+            print(f"Error reading credentials for user '{username}': {e}")
+            return None
 
-    def is_client_banned(self, client_id: str) -> bool:
-        """Checks if a client is banned by querying the banned status from the clients table."""
+    def set_password_hash(self, username: str, password_hash: str) -> bool:
+        """Creates a user or replaces its password hash."""
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                # Query the banned status for the given client_id
-                cursor.execute("SELECT banned FROM clients WHERE client_id = ?", (client_id,))
-                result = cursor.fetchone()
-
-                # Return True if the client is found and banned, otherwise False
-                return result is not None and result[0] == 1
-
+                cursor.execute("""
+                    INSERT INTO users (username, password) VALUES (?, ?)
+                    ON CONFLICT(username) DO UPDATE SET password = excluded.password
+                """, (username, password_hash))
+                conn.commit()
+                return True
         except sqlite3.Error as e:
-            print(f"Error checking banned status for client '{client_id}': {e}")
-            # In case of an error, assume the client is not banned to avoid disruptions
+            print(f"Error saving credentials for user '{username}': {e}")
             return False
 
-    def is_connection_rate_exceeded(self, client_id: str) -> bool:
-        """Checks if a client is connecting too frequently."""
+    def remove_user(self, username: str) -> bool:
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT last_seen FROM clients WHERE client_id = ?", (client_id,))
-                last_seen_row = cursor.fetchone()
-
-                # Allow connection if no last seen record exists
-                if not last_seen_row or not last_seen_row[0]:
-                    return False
-
-                # Calculate time since last connection attempt
-                last_seen_time = datetime.strptime(last_seen_row[0], "%Y-%m-%d %H:%M:%S")
-                time_since_last_seen = (datetime.now() - last_seen_time).total_seconds()
-
-                # Reject if connection interval is too short
-                if time_since_last_seen < self.MIN_CONNECTION_INTERVAL:
-                    print(f"Client '{client_id}' exceeded connection rate limit.")
-                    return True
-
-                # Update last seen time in the database
-                cursor.execute("UPDATE clients SET last_seen = ? WHERE client_id = ?",
-                               (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), client_id))
-                conn.commit()  # Save changes to the database
-
-                return False
-
+                cursor.execute("DELETE FROM users WHERE username = ?", (username,))
+                conn.commit()
+                return cursor.rowcount > 0
         except sqlite3.Error as e:
-            print(f"Error checking connection rate for client '{client_id}': {e}")
-            return True
-
+            print(f"Error removing user '{username}': {e}")
             return False
 
-    def save_subscription(self, client_id: str, topic: str, qos: int) -> bool:
-        """
-        Saves a subscription for a client to a specific topic with the specified QoS level.
-        """
+    def load_banned_clients(self) -> List[str]:
+        """Returns the IDs of all banned clients, used to fill the in-memory ban set at startup."""
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
+                cursor.execute("SELECT client_id FROM clients WHERE banned = 1")
+                return [row[0] for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error loading banned clients: {e}")
+            return []
 
-                # Check if the topic contains wildcards
-                if '+' in topic or '#' in topic:
-                    topic_id = None  # No topic ID since wildcards are not actual topics
-                    topic_filter = topic  # Store the topic filter directly
-                else:
-                    # Check if the topic exists in the topics table
-                    cursor.execute("SELECT id FROM topics WHERE full_path = ?", (topic,))
-                    topic_result = cursor.fetchone()
-
-                    # Insert topic into the topics table if it doesn't exist
-                    if not topic_result:
-                        cursor.execute(
-                            "INSERT INTO topics (topic_name, full_path) VALUES (?, ?)",
-                            (topic.split('/')[-1], topic)
-                        )
-                        conn.commit()
-                        topic_id = cursor.lastrowid
-                    else:
-                        topic_id = topic_result[0]
-                    topic_filter = None  # No need to store topic filter for exact topics
-
-                # Insert subscription into the subscriptions table
+    def set_client_banned(self, client_id: str, banned: bool) -> bool:
+        """Sets the banned status of a client, creating the client row if needed."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
                 cursor.execute("""
-                    INSERT INTO subscriptions (client_id, topic_id, topic_filter, qos)
-                    VALUES ((SELECT client_id FROM clients WHERE client_id = ?), ?, ?, ?)
-                """, (client_id, topic_id, topic_filter, qos))
-
+                    INSERT INTO clients (client_id, banned) VALUES (?, ?)
+                    ON CONFLICT(client_id) DO UPDATE SET banned = excluded.banned
+                """, (client_id, 1 if banned else 0))
                 conn.commit()
                 return True
         except sqlite3.Error as e:
-            print(f"Error saving subscription for client '{client_id}' on topic '{topic}': {e}")
+            print(f"Error updating banned status for client '{client_id}': {e}")
             return False
 
+    def reset_connected_flags(self) -> None:
+        """Marks every client as disconnected; used at startup since no session survives a restart."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE clients SET connected = 0 WHERE connected = 1")
+                conn.commit()
+        except sqlite3.Error as e:
+            print(f"Error resetting connected flags: {e}")
+
+    def save_subscriptions(self, client_id: str, subscriptions: List[Tuple[str, int, int]]) -> Optional[List[bool]]:
+        """
+        Saves all (topic_filter, qos, options) subscriptions of a SUBSCRIBE packet in a single transaction.
+        Resubscribing to a filter replaces its QoS and options instead of adding a row.
+        Returns, for each subscription, whether it is new, or None if nothing could be saved.
+        """
+        if not subscriptions:
+            return []
+        conn = self._get_thread_connection()
+        try:
+            with conn:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT topic_filter FROM subscriptions WHERE client_id = ?", (client_id,))
+                existing = {row[0] for row in cursor.fetchall()}
+
+                # Exact topics are linked to the topics table, wildcard filters are not actual topics
+                exact_topics = [topic for topic, _, _ in subscriptions if '+' not in topic and '#' not in topic]
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO topics (topic_name, full_path) VALUES (?, ?)",
+                    [(topic.split('/')[-1], topic) for topic in exact_topics]
+                )
+                cursor.executemany("""
+                    INSERT INTO subscriptions (client_id, topic_id, topic_filter, qos, options)
+                    VALUES (?, (SELECT id FROM topics WHERE full_path = ?), ?, ?, ?)
+                    ON CONFLICT(client_id, topic_filter) DO UPDATE SET
+                        qos = excluded.qos,
+                        options = excluded.options
+                """, [
+                    (client_id, None if '+' in topic or '#' in topic else topic, topic, qos, options)
+                    for topic, qos, options in subscriptions
+                ])
+            new_flags = [topic not in existing for topic, _, _ in subscriptions]
+            for (topic, _, _), is_new in zip(subscriptions, new_flags):
+                if is_new:
+                    self.subscription_filter.add(self._subscription_key(topic))
+                self.subscription_cache.invalidate_filter(topic)
+            return new_flags
+        except sqlite3.Error as e:
+            print(f"Error saving subscriptions for client '{client_id}': {e}")
+            return None
+
     def save_message(self, message: Message) -> bool:
         """
         Saves a message to the database, associating it with a topic.
         If the topic does not exist, it will be created.
-        Handles retained messages by updating the topic's retained message details.
         """
         try:
             with self._get_connection() as conn:
@@ -339,57 +384,21 @@ class SQLServer:
                     topic_id = topic_result[0]
 
                 # Save the message
+                payload, encoding = self._encode_payload(message)
                 query = """
-                INSERT INTO messages (topic_id, payload, qos, retain, packet_id, published_at)
-                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                INSERT INTO messages (topic_id, payload, qos, retain, packet_id, published_at, expires_at, payload_encoding)
+                VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
                 """
-                cursor.execute(query, (topic_id, message.payload, message.qos, message.retain, message.packet_id))
+                cursor.execute(query, (topic_id, payload, message.qos, message.retain, message.packet_id,
+                                       message.expires_at, encoding))
                 conn.commit()
 
-                # If the message is retained, update the topics table
-                if message.retain:
-                    update_query = """
-                    UPDATE topics
-                    SET retained_message = ?, retained_qos = ?, retained_timestamp = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                    """
-                    cursor.execute(update_query, (message.payload, message.qos, topic_id))
-                    conn.commit()
-
+                # Retained messages are kept by RetainedStore and written back with save_retained_batch
                 return True
         except sqlite3.Error as e:
             print(f"Error saving message: {e}")
             return False
 
-    def save_will_message(self, client_id: str, topic: str, message: str, qos: int = 0, retain: bool = False) -> bool:
-        """
-        Saves a Last Will and Testament (LWT) message for a client.
-        Associates the will message with a topic, creating the topic if it does not exist.
-        """
-        try:
-            with self._get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute("SELECT id FROM topics WHERE full_path = ?", (topic,))
-                topic_result = cursor.fetchone()
-                if not topic_result:
-                    cursor.execute("INSERT INTO topics (topic_name, full_path) VALUES (?, ?)", (topic.split('/')[-1], topic))
-                    conn.commit()
-                    topic_id = cursor.lastrowid
-                else:
-                    topic_id = topic_result[0]
-
-                query = """
-                INSERT INTO will_messages (client_id, topic_id, message, qos, retain, registered_at)
-                VALUES ((SELECT client_id FROM clients WHERE client_id = ?), ?, ?, ?, ?, CURRENT_TIMESTAMP)
-                """
-                cursor.execute(query, (client_id, topic_id, message, qos, retain))
-                conn.commit()
-                return True
-        except sqlite3.Error as e:
-            print(f"Error saving will message for client '{client_id}' on topic '{topic}': {e}")
-            return False
-
-
     def update_disconnect_time(self, client_id: str) -> None:
         """
         Updates the last seen timestamp and marks the client as disconnected in the database.
@@ -405,90 +414,64 @@ class SQLServer:
         except sqlite3.Error as e:
             print(f"Error updating disconnect time for client '{client_id}': {e}")
 
-    def get_subscribers(self, topic_name: str) -> List[Tuple[str, int]]:
+    def get_subscribers(self, topic_name: str) -> List[Tuple[str, int, int]]:
         """
-        Retrieves a list of subscribers to a given topic, including both exact and wildcard matches.
-        Returns a list of tuples containing client IDs and QoS levels.
+        Retrieves the subscribers of a given topic, including both exact and wildcard matches.
+        Returns a list of (client_id, qos, options) tuples, served from the subscription cache when possible.
+        Connection state is not checked here; the dispatcher only delivers to active connections.
         """
+        subscribers = self.subscription_cache.get(topic_name)
+        if subscribers is not None:
+            return subscribers
+
+        generation = self.subscription_cache.generation()
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
 
                 # Fetch all subscriptions
-                cursor.execute("""
-                    SELECT DISTINCT subscriptions.client_id, subscriptions.qos, subscriptions.topic_id, topics.full_path
-                    FROM subscriptions
-                    LEFT JOIN topics ON subscriptions.topic_id = topics.id
-                    JOIN clients ON subscriptions.client_id = clients.client_id
-                    WHERE clients.connected = 1
-                """)
-                all_subscriptions = cursor.fetchall()
+                cursor.execute("SELECT client_id, qos, options, topic_filter FROM subscriptions")
 
                 # Filter matches based on wildcards and exact matches
-                matched_subscribers = []
-                for client_id, qos, topic_id, subscription_topic in all_subscriptions:
-                    if subscription_topic:
-                        # Exact topic subscription
-                        if self.matches_wildcard(subscription_topic, topic_name):
-                            matched_subscribers.append((client_id, qos))
-                    else:
-                        # Wildcard subscription (topic_id is None)
-                        # The topic filter is stored elsewhere; you need to adjust your subscriptions table
-                        # to store the topic filter as a string for wildcard subscriptions
-                        cursor.execute("""
-                            SELECT topic_filter FROM subscriptions
-                            WHERE client_id = ? AND topic_id IS NULL
-                        """, (client_id,))
-                        wildcard_subscription = cursor.fetchone()
-                        if wildcard_subscription and self.matches_wildcard(wildcard_subscription[0], topic_name):
-                            matched_subscribers.append((client_id, qos))
-
-                return matched_subscribers
+                subscribers = [
+                    (client_id, qos, options or 0)
+                    for client_id, qos, options, topic_filter in cursor.fetchall()
+                    if topic_filter and self.matches_wildcard(topic_filter, topic_name)
+                ]
 
         except sqlite3.Error as e:
             print(f"Error getting subscribers for topic '{topic_name}': {e}")
             return []
 
-    def remove_subscription(self, client_id: str, topic: str) -> bool:
+        self.subscription_cache.put(topic_name, subscribers, generation)
+        return subscribers
+
+    def remove_subscriptions(self, client_id: str, topics: List[str]) -> Optional[List[bool]]:
         """
-        Removes a subscription for the given client and topic.
-        Handles both direct topic subscriptions and wildcard topic filters.
+        Removes the subscriptions of an UNSUBSCRIBE packet in a single transaction.
+        Returns, for each topic filter, whether a subscription existed, or None on error.
         """
+        if not topics:
+            return []
+        conn = self._get_thread_connection()
         try:
-            with self._get_connection() as conn:
+            with conn:
                 cursor = conn.cursor()
-
-                # Check for wildcard topic filter
-                cursor.execute("""
-                    DELETE FROM subscriptions
-                    WHERE client_id = ? AND topic_filter = ?
-                """, (client_id, topic))
-                wildcard_deleted = cursor.rowcount > 0
-
-                # Check for direct topic subscription
-                cursor.execute("SELECT id FROM topics WHERE full_path = ?", (topic,))
-                topic_result = cursor.fetchone()
-                if topic_result:
-                    topic_id = topic_result[0]
-                    cursor.execute("""
-                        DELETE FROM subscriptions
-                        WHERE client_id = ? AND topic_id = ?
-                    """, (client_id, topic_id))
-                    direct_deleted = cursor.rowcount > 0
-                else:
-                    direct_deleted = False
-
-                if wildcard_deleted or direct_deleted:
-                    conn.commit()
-                    print(f"Subscription for client '{client_id}' to topic '{topic}' removed successfully.")
-                    return True
-                else:
-                    print(f"No subscription found for client '{client_id}' on topic '{topic}'.")
-                    return False
-
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute("SELECT topic_filter FROM subscriptions WHERE client_id = ?", (client_id,))
+                existing = {row[0] for row in cursor.fetchall()}
+                cursor.executemany(
+                    "DELETE FROM subscriptions WHERE client_id = ? AND topic_filter = ?",
+                    [(client_id, topic) for topic in topics]
+                )
+            removed_filters = [topic for topic in set(topics) if topic in existing]
+            self._forget_subscriptions(removed_filters)
+            for topic in removed_filters:
+                self.subscription_cache.invalidate_filter(topic)
+            return [topic in existing for topic in topics]
         except sqlite3.Error as e:
-            print(f"Error removing subscription for client '{client_id}' on topic '{topic}': {e}")
-            return False
+            print(f"Error removing subscriptions for client '{client_id}': {e}")
+            return None
 
     def retrieve_message_by_packet_id(self, packet_id):
         """
@@ -499,94 +482,71 @@ class SQLServer:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
                 query = """
-                SELECT topics.full_path, messages.payload, messages.qos, messages.retain, messages.packet_id
+                SELECT topics.full_path, messages.payload, messages.qos, messages.retain, messages.packet_id,
+                       messages.expires_at, messages.payload_encoding
                 FROM messages
                 JOIN topics ON messages.topic_id = topics.id
                 WHERE messages.packet_id = ?
+                ORDER BY messages.id DESC
                 """
                 cursor.execute(query, (packet_id,))
                 result = cursor.fetchone()
 
                 if result:
-                    topic, payload, qos, retain, packet_id = result
-                    return Message(topic=topic, payload=payload, qos=qos, retain=retain, packet_id=packet_id)
+                    topic, payload, qos, retain, packet_id, expires_at, encoding = result
+                    return Message(topic=topic, payload=self._decode_payload(payload, encoding), qos=qos, retain=retain,
+                                   packet_id=packet_id, expires_at=expires_at)
                 else:
                     return None
         except sqlite3.Error as e:
             print(f"Error retrieving message by packet ID '{packet_id}': {e}")
             return None
 
-    def matches_wildcard(self, subscription: str, topic: str) -> bool:
-        """
-        Checks if a topic matches a wildcard subscription.
-        Supports:
-        - Single-level wildcard `+`
-        - Multi-level wildcard `#`
-        """
-        subscription_levels = subscription.split('/')
-        topic_levels = topic.split('/')
-
-        for sub_level, topic_level in zip(subscription_levels, topic_levels):
-            if sub_level == '+':
-                continue  # Single-level wildcard matches anything at this level
-            if sub_level == '#':
-                return True  # Multi-level wildcard matches everything after
-            if sub_level != topic_level:
-                return False
-
-        # If all levels match, check for trailing wildcards
-        if len(subscription_levels) > len(topic_levels):
-            return subscription_levels[len(topic_levels)] == '#'
-
-        return len(subscription_levels) == len(topic_levels)
-
-    def retrieve_last_will(self, client_id: str) -> Optional[dict]:
-        """
-        Retrieve the Last Will message for the specified client.
-        """
+    def load_will_messages(self) -> List[WillMessage]:
+        """Returns every persisted will message, used to fill the in-memory WillRegistry at startup."""
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                query = """
-                SELECT topics.full_path, will_messages.message, will_messages.qos, will_messages.retain
-                FROM will_messages
-                JOIN topics ON will_messages.topic_id = topics.id
-                WHERE will_messages.client_id = ?
-                """
-                cursor.execute(query, (client_id,))
-                result = cursor.fetchone()
-                if result:
-                    topic, message, qos, retain = result
-                    return {
-                        "topic": topic,
-                        "message": message,
-                        "qos": qos,
-                        "retain": retain
-                    }
-                return None
+                cursor.execute("""
+                    SELECT will_messages.client_id, topics.full_path, will_messages.message, will_messages.qos,
+                           will_messages.retain, will_messages.registered_at, will_messages.delay_interval,
+                           will_messages.message_expiry_interval
+                    FROM will_messages
+                    JOIN topics ON will_messages.topic_id = topics.id
+                """)
+                return [
+                    WillMessage(client_id, topic, message, qos, bool(retain), registered_at,
+                                delay_interval or 0, message_expiry_interval)
+                    for client_id, topic, message, qos, retain, registered_at, delay_interval, message_expiry_interval
+                    in cursor.fetchall()
+                ]
         except sqlite3.Error as e:
-            print(f"Error retrieving Last Will for client '{client_id}': {e}")
-            return None
+            print(f"Error loading will messages: {e}")
+            return []
 
-    def remove_last_will(self, client_id: str) -> bool:
+    def save_will_batch(self, wills: dict) -> bool:
         """
-        Removes the Last Will message for the specified client.
-        Returns True if the operation was successful, False otherwise.
+        Writes a batch of will changes in a single transaction.
+        `wills` maps a client ID to its current WillMessage, or to None if the will was removed.
         """
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-                query = "DELETE FROM will_messages WHERE client_id = ?"
-                cursor.execute(query, (client_id,))
-                if cursor.rowcount > 0:
-                    conn.commit()
-                    print(f"Last Will message for client '{client_id}' successfully removed.")
-                    return True
-                else:
-                    print(f"No Last Will message found for client '{client_id}'.")
-                    return False
+                cursor.executemany("DELETE FROM will_messages WHERE client_id = ?", [(client_id,) for client_id in wills])
+                for client_id, will in wills.items():
+                    if will is None:
+                        continue
+                    topic_id = self._get_or_create_topic_id(cursor, will.topic)
+                    cursor.execute("""
+                        INSERT INTO will_messages (client_id, topic_id, message, qos, retain, registered_at,
+                                                   delay_interval, message_expiry_interval)
+                        VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?)
+                    """, (client_id, topic_id, will.message, will.qos, will.retain, will.delay_interval,
+                          will.message_expiry_interval))
+                conn.commit()
+                return True
         except sqlite3.Error as e:
-            print(f"Error removing Last Will for client '{client_id}': {e}")
+            print(f"Error saving will messages: {e}")
             return False
 
     def remove_all_subscriptions_for_client(self, client_id: str) -> bool:
@@ -599,6 +559,9 @@ class SQLServer:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
 
+                cursor.execute("SELECT topic_filter FROM subscriptions WHERE client_id = ?", (client_id,))
+                removed_filters = [row[0] for row in cursor.fetchall() if row[0]]
+
                 # Delete all subscriptions for the given client ID
                 query = """
                 DELETE FROM subscriptions WHERE client_id = ?
@@ -608,6 +571,8 @@ class SQLServer:
                 # Check if any rows were affected
                 if cursor.rowcount > 0:
                     conn.commit()
+                    self._forget_subscriptions(removed_filters)
+                    self.subscription_cache.invalidate_client(client_id)
                     return True
                 else:
                     print(f"No subscriptions found for client '{client_id}'.")
@@ -617,62 +582,594 @@ class SQLServer:
             print(f"Error removing subscriptions for client '{client_id}': {e}")
             return False
 
-    from typing import List
-
-    def return_last_retained_messages(self, topic_filter: str) -> List[Message]:
+    def load_retained_messages(self) -> List[Message]:
         """
-        Retrieves the last retained messages matching a specific topic filter.
-        Supports wildcards ('+' for single level, '#' for multi-level).
-        Returns a list of Message objects if retained messages exist, otherwise an empty list.
+        Returns every retained message stored in the topics table that has not expired yet.
+        Used to fill the in-memory RetainedStore at startup.
         """
         try:
             with self._get_connection() as conn:
                 cursor = conn.cursor()
-
-                if "+" in topic_filter or "#" in topic_filter:
-                    # Convert MQTT wildcards to SQL LIKE pattern
-                    like_pattern = topic_filter.replace("+", "_").replace("#", "%")
-                    query = """
-                    SELECT full_path, retained_message, retained_qos, retained_timestamp
-                    FROM topics
-                    WHERE full_path LIKE ?
-                    """
-                    cursor.execute(query, (like_pattern,))
-                else:
-                    # Exact match for non-wildcard topics
-                    query = """
-                    SELECT full_path, retained_message, retained_qos, retained_timestamp
+                cursor.execute("""
+                    SELECT full_path, retained_message, retained_qos, retained_timestamp, retained_expires_at
                     FROM topics
+                    WHERE retained_message IS NOT NULL AND (retained_expires_at IS NULL OR retained_expires_at > ?)
+                """, (time(),))
+                return [
+                    Message(
+                        topic=full_path,
+                        payload=retained_message,
+                        qos=retained_qos,
+                        retain=True,
+                        packet_id=None,  # Retained messages do not have a packet ID
+                        published_at=retained_timestamp,
+                        expires_at=retained_expires_at
+                    )
+                    for full_path, retained_message, retained_qos, retained_timestamp, retained_expires_at in cursor.fetchall()
+                ]
+        except sqlite3.Error as e:
+            print(f"Error loading retained messages: {e}")
+            return []
+
+    def save_retained_batch(self, retained: dict) -> bool:
+        """
+        Writes a batch of retained message changes in a single transaction.
+        `retained` maps a topic to its new retained Message, or to None if the retained message was removed.
+        """
+        updates = [(topic, message) for topic, message in retained.items() if message is not None]
+        removals = [(topic,) for topic, message in retained.items() if message is None]
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO topics (topic_name, full_path) VALUES (?, ?)",
+                    [(topic.split('/')[-1], topic) for topic, _ in updates]
+                )
+                cursor.executemany("""
+                    UPDATE topics
+                    SET retained_message = ?, retained_qos = ?, retained_timestamp = CURRENT_TIMESTAMP, retained_expires_at = ?
                     WHERE full_path = ?
-                    """
-                    cursor.execute(query, (topic_filter,))
-
-                # Fetch all matching rows
-                results = cursor.fetchall()
-
-                # Construct a list of Message objects for topics with retained messages
-                retained_messages = []
-                for full_path, retained_message, retained_qos, retained_timestamp in results:
-                    if retained_message is not None:
-                        retained_messages.append(
-                            Message(
-                                topic=full_path,
-                                payload=retained_message,
-                                qos=retained_qos,
-                                retain=True,
-                                packet_id=None,  # Retained messages do not have a packet ID
-                                published_at=retained_timestamp
-                            )
+                """, [(message.payload, message.qos, message.expires_at, topic) for topic, message in updates])
+                cursor.executemany("""
+                    UPDATE topics
+                    SET retained_message = NULL, retained_qos = 0, retained_timestamp = NULL, retained_expires_at = NULL
+                    WHERE full_path = ?
+                """, removals)
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error saving retained messages: {e}")
+            return False
+
+    def prune_messages_older_than(self, max_age: float, batch_size: int = 500) -> int:
+        """
+        Deletes up to `batch_size` messages published more than `max_age` seconds ago, oldest first.
+        Only the oldest `batch_size` rows are examined (ids follow publish order), so a run over a
+        table with nothing to prune stays cheap. Returns the number deleted.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM messages WHERE id IN (
+                        SELECT id FROM (SELECT id, published_at FROM messages ORDER BY id LIMIT ?)
+                        WHERE published_at < datetime('now', ?)
+                    )
+                """, (batch_size, f"-{int(max_age)} seconds"))
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error pruning old messages: {e}")
+            return 0
+
+    def topic_overflow(self, max_per_topic: int) -> dict:
+        """
+        {topic_id: messages over the limit} of the topics holding more than `max_per_topic` messages.
+        Counted once per retention run (idx_messages_topic covers the scan), then pruned batch by batch.
+        """
+        rows = self._read("""
+            SELECT topic_id, COUNT(*) - ? FROM messages GROUP BY topic_id HAVING COUNT(*) > ?
+        """, (max_per_topic, max_per_topic))
+        return dict(rows or [])
+
+    def prune_topic_overflow(self, overflow: dict, batch_size: int = 500) -> int:
+        """
+        Deletes up to `batch_size` of the oldest messages of the topics in `overflow` (from
+        `topic_overflow`), lowering their counts and dropping the topics that are done.
+        Returns the number deleted.
+        """
+        removed = 0
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                for topic_id, excess in list(overflow.items()):
+                    if removed >= batch_size:
+                        break
+                    cursor.execute("""
+                        DELETE FROM messages WHERE id IN (
+                            SELECT id FROM messages WHERE topic_id = ? ORDER BY id LIMIT ?
                         )
+                    """, (topic_id, min(excess, batch_size - removed)))
+                    removed += cursor.rowcount
+                    if cursor.rowcount >= excess or cursor.rowcount == 0:
+                        del overflow[topic_id]
+                    else:
+                        overflow[topic_id] = excess - cursor.rowcount
+                conn.commit()
+                return removed
+        except sqlite3.Error as e:
+            print(f"Error pruning topic overflow: {e}")
+            return removed
+
+    def prune_oldest_messages(self, batch_size: int = 500) -> int:
+        """Deletes the `batch_size` oldest messages. Returns the number deleted."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY id LIMIT ?)
+                """, (batch_size,))
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error pruning oldest messages: {e}")
+            return 0
+
+    def database_size(self) -> Tuple[int, int]:
+        """Returns (bytes in used pages, bytes in free pages) of the database file."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+                free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+                return (page_count - free_pages) * page_size, free_pages * page_size
+        except sqlite3.Error as e:
+            print(f"Error reading database size: {e}")
+            return 0, 0
+
+    def incremental_vacuum(self, pages: int) -> int:
+        """
+        Returns up to `pages` free pages to the file system. Returns the bytes reclaimed, 0 when the
+        database is not in incremental auto-vacuum mode.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                    return 0
+                page_size = cursor.execute("PRAGMA page_size").fetchone()[0]
+                before = cursor.execute("PRAGMA page_count").fetchone()[0]
+                # executescript steps the pragma to completion, execute would free a single page
+                cursor.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+                after = cursor.execute("PRAGMA page_count").fetchone()[0]
+                return (before - after) * page_size
+        except sqlite3.Error as e:
+            print(f"Error running incremental vacuum: {e}")
+            return 0
+
+    def load_topic_history(self, depth: int) -> dict:
+        """
+        Returns the last `depth` history entries of every topic, as {topic: [(payload, qos, published_at)]}
+        oldest first. Used to fill the in-memory TopicHistory at startup.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT topics.full_path, history.payload, history.qos, history.published_at
+                    FROM (
+                        SELECT topic_id, payload, qos, published_at, id,
+                               ROW_NUMBER() OVER (PARTITION BY topic_id ORDER BY id DESC) AS position
+                        FROM topic_history
+                    ) AS history
+                    JOIN topics ON topics.id = history.topic_id
+                    WHERE history.position <= ?
+                    ORDER BY history.topic_id, history.id
+                """, (depth,))
+                history = {}
+                for full_path, payload, qos, published_at in cursor.fetchall():
+                    history.setdefault(full_path, []).append((payload, qos, published_at))
+                return history
+        except sqlite3.Error as e:
+            print(f"Error loading topic history: {e}")
+            return {}
+
+    def save_topic_history_batch(self, entries: List[Tuple[str, str, int, str]], depth: int) -> bool:
+        """
+        Appends (topic, payload, qos, published_at) entries to `topic_history` in a single transaction,
+        then trims every touched topic to its newest `depth` rows.
+        """
+        topics = {topic for topic, _, _, _ in entries}
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO topics (topic_name, full_path) VALUES (?, ?)",
+                    [(topic.split('/')[-1], topic) for topic in topics]
+                )
+                cursor.executemany("""
+                    INSERT INTO topic_history (topic_id, payload, qos, published_at)
+                    SELECT id, ?, ?, ? FROM topics WHERE full_path = ?
+                """, [(payload, qos, published_at, topic) for topic, payload, qos, published_at in entries])
+                cursor.executemany("""
+                    DELETE FROM topic_history
+                    WHERE topic_id = (SELECT id FROM topics WHERE full_path = ?)
+                      AND id <= (
+                          SELECT id FROM topic_history
+                          WHERE topic_id = (SELECT id FROM topics WHERE full_path = ?)
+                          ORDER BY id DESC LIMIT 1 OFFSET ?
+                      )
+                """, [(topic, topic, depth) for topic in topics])
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error saving topic history: {e}")
+            return False
+
+    def prune_topic_history(self, max_age: float, batch_size: int = 500) -> List[str]:
+        """
+        Deletes the history of up to `batch_size` topics with no entry newer than `max_age` seconds.
+        Returns the paths of those topics.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT topics.id, topics.full_path FROM topic_history
+                    JOIN topics ON topics.id = topic_history.topic_id
+                    GROUP BY topic_history.topic_id
+                    HAVING MAX(topic_history.published_at) < datetime('now', ?)
+                    LIMIT ?
+                """, (f"-{int(max_age)} seconds", batch_size))
+                idle = cursor.fetchall()
+                cursor.executemany("DELETE FROM topic_history WHERE topic_id = ?",
+                                   [(topic_id,) for topic_id, _ in idle])
+                conn.commit()
+                return [full_path for _, full_path in idle]
+        except sqlite3.Error as e:
+            print(f"Error pruning topic history: {e}")
+            return []
+
+    def clear_expired_retained(self, now: Optional[float] = None) -> int:
+        """
+        Clears retained messages whose Message Expiry Interval has elapsed.
+        Returns the number of topics whose retained message was removed.
+        """
+        now = time() if now is None else now
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE topics
+                    SET retained_message = NULL, retained_qos = 0, retained_timestamp = NULL, retained_expires_at = NULL
+                    WHERE retained_expires_at IS NOT NULL AND retained_expires_at <= ?
+                """, (now,))
+                conn.commit()
+                return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Error clearing expired retained messages: {e}")
+            return 0
+
+    def expire_sessions(self, batch_size: int = 500) -> dict:
+        """
+        Removes disconnected sessions whose Session Expiry Interval has elapsed, together with
+        their subscriptions and will messages. Works in batches, one transaction per batch,
+        so the write lock is never held for long. Returns the number of reclaimed rows per table.
+        Banned clients keep their row so the ban survives the session.
+        """
+        reclaimed = {"clients": 0, "subscriptions": 0, "will_messages": 0}
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                while True:
+                    # 0xFFFFFFFF means the session never expires
+                    cursor.execute("""
+                        SELECT client_id FROM clients
+                        WHERE connected = 0
+                          AND session_expiry < 4294967295
+                          AND CAST(strftime('%s', 'now') AS INTEGER) - CAST(strftime('%s', last_seen) AS INTEGER) >= session_expiry
+                          AND (banned = 0 OR client_id IN (SELECT client_id FROM subscriptions)
+                                          OR client_id IN (SELECT client_id FROM will_messages))
+                        LIMIT ?
+                    """, (batch_size,))
+                    expired = [(row[0],) for row in cursor.fetchall()]
+                    if not expired:
+                        break
+
+                    removed_filters = []
+                    for (client_id,) in expired:
+                        cursor.execute("SELECT topic_filter FROM subscriptions WHERE client_id = ?", (client_id,))
+                        removed_filters.extend(row[0] for row in cursor.fetchall() if row[0])
+                    cursor.executemany("DELETE FROM subscriptions WHERE client_id = ?", expired)
+                    reclaimed["subscriptions"] += cursor.rowcount
+                    cursor.executemany("DELETE FROM will_messages WHERE client_id = ?", expired)
+                    reclaimed["will_messages"] += cursor.rowcount
+                    cursor.executemany("DELETE FROM clients WHERE client_id = ? AND banned = 0", expired)
+                    reclaimed["clients"] += cursor.rowcount
+                    conn.commit()
+                    self._forget_subscriptions(removed_filters)
+                    for (client_id,) in expired:
+                        self.subscription_cache.invalidate_client(client_id)
 
-                if not retained_messages:
-                    print(f"No retained messages found for topic filter '{topic_filter}'.")
-                return retained_messages
+                    if len(expired) < batch_size:
+                        break
+            return reclaimed
+        except sqlite3.Error as e:
+            print(f"Error expiring sessions: {e}")
+            return reclaimed
 
+    def load_clients(self) -> List[Tuple[str, bool, bool, int, int, Optional[float]]]:
+        """
+        Returns every client row as (client_id, banned, clean_session, keep_alive, session_expiry, last_seen
+        as epoch seconds). Used by HybridStorage to fill its in-memory sessions at startup.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT client_id, banned, clean_session, keep_alive, session_expiry,
+                           CAST(strftime('%s', last_seen) AS INTEGER)
+                    FROM clients
+                """)
+                return [(client_id, bool(banned), bool(clean_session), keep_alive, session_expiry, last_seen)
+                        for client_id, banned, clean_session, keep_alive, session_expiry, last_seen in cursor.fetchall()]
         except sqlite3.Error as e:
-            print(f"Error retrieving retained messages for topic filter '{topic_filter}': {e}")
+            print(f"Error loading clients: {e}")
             return []
 
+    def load_subscriptions(self) -> List[Tuple[str, str, int, int]]:
+        """Returns every subscription as (client_id, topic_filter, qos, options)."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT client_id, topic_filter, qos, options FROM subscriptions WHERE topic_filter IS NOT NULL
+                """)
+                return [(client_id, topic_filter, qos, options or 0)
+                        for client_id, topic_filter, qos, options in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error loading subscriptions: {e}")
+            return []
+
+    def load_users(self) -> dict:
+        """Returns {username: password hash} for every user."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT username, password FROM users")
+                return dict(cursor.fetchall())
+        except sqlite3.Error as e:
+            print(f"Error loading users: {e}")
+            return {}
+
+    def save_message_batch(self, messages: List[Tuple[Message, Optional[str]]]) -> bool:
+        """
+        Archives (message, published_at) pairs in a single transaction (used by HybridStorage's writer).
+        A published_at of None means now.
+        """
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO topics (topic_name, full_path) VALUES (?, ?)",
+                    [(topic.split('/')[-1], topic) for topic in {message.topic for message, _ in messages}]
+                )
+                rows = []
+                for message, published_at in messages:
+                    payload, encoding = self._encode_payload(message)
+                    rows.append((payload, message.qos, message.retain, message.packet_id, published_at,
+                                 message.expires_at, encoding, message.topic))
+                cursor.executemany("""
+                    INSERT INTO messages (topic_id, payload, qos, retain, packet_id, published_at, expires_at, payload_encoding)
+                    SELECT id, ?, ?, ?, ?, COALESCE(?, CURRENT_TIMESTAMP), ?, ? FROM topics WHERE full_path = ?
+                """, rows)
+                conn.commit()
+                return True
+        except sqlite3.Error as e:
+            print(f"Error saving message batch: {e}")
+            return False
+
+    # Archive compression
+    def set_compression(self, compression) -> None:
+        """Compresses archived payloads with `compression` and registers the stored dictionaries with it."""
+        super().set_compression(compression)
+        if compression is not None:
+            self._load_dictionaries(compression)
+
+    def _load_dictionaries(self, compression) -> None:
+        """Registers every stored dictionary with `compression`."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT id, prefix, dictionary FROM compression_dictionaries ORDER BY id")
+                for dictionary_id, prefix, dictionary in cursor.fetchall():
+                    compression.add_dictionary(dictionary_id, prefix, dictionary)
+        except sqlite3.Error as e:
+            print(f"Error loading compression dictionaries: {e}")
+
+    def save_compression_dictionary(self, prefix: str, dictionary: bytes) -> Optional[int]:
+        """Stores a trained dictionary and makes it the active one of `prefix`. Returns its id."""
+        try:
+            with self._get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("INSERT INTO compression_dictionaries (prefix, dictionary) VALUES (?, ?)",
+                               (prefix, dictionary))
+                conn.commit()
+                dictionary_id = cursor.lastrowid
+        except sqlite3.Error as e:
+            print(f"Error saving compression dictionary for '{prefix}': {e}")
+            return None
+        for compression in (self.compression, self._decoder):
+            if compression is not None:
+                compression.add_dictionary(dictionary_id, prefix, dictionary)
+        return dictionary_id
+
+    def sample_payloads(self, prefix: str, limit: int = 1000) -> list:
+        """The `limit` most recent archived payloads of topics starting with `prefix`, decompressed."""
+        rows = self._read("""
+            SELECT messages.payload, messages.payload_encoding FROM messages
+            WHERE messages.topic_id IN (SELECT id FROM topics WHERE substr(full_path, 1, length(?)) = ?)
+            ORDER BY messages.id DESC
+            LIMIT ?
+        """, (prefix, prefix, limit))
+        return [self._decode_payload(payload, encoding) for payload, encoding in rows or []]
+
+    def _encode_payload(self, message: Message):
+        """(stored payload, payload_encoding) of an archived message."""
+        if self.compression is None:
+            return message.payload, None
+        return self.compression.compress(message.topic, message.payload)
+
+    def _decode_payload(self, payload, encoding):
+        if not encoding:
+            return payload
+        decoder = self.compression
+        if decoder is None:
+            # Written while compression was on: decode with a private policy, new rows stay verbatim
+            decoder = self._decoder
+            if decoder is None:
+                decoder = ArchiveCompression()
+                self._load_dictionaries(decoder)
+                self._decoder = decoder
+        try:
+            return decoder.decompress(payload, encoding)
+        except ValueError as e:
+            print(f"Error decoding archived payload: {e}")
+            return payload
+
+    def replay_messages(self, topic_filter: str, start: str, end: str, after=None, limit: int = 500) -> Optional[List[Message]]:
+        """
+        Up to `limit` archived messages of the topics matching `topic_filter`, published in [start, end)
+        and ordered by (published_at, id), resuming after the `after` key of the previous page.
+        Each topic is read in order from idx_messages_topic_published and the runs are merged, so a
+        page never sorts the archive. Runs on the read-only connection; None if the read failed.
+        """
+        topics = self._read("SELECT id, full_path FROM topics WHERE mqtt_match(?, full_path)", (topic_filter,))
+        if topics is None:
+            return None
+        key = after or (start, 0)
+        runs = []
+        for topic_id, full_path in topics:
+            rows = self._read("""
+                SELECT published_at, id, payload, qos, retain, expires_at, payload_encoding FROM messages
+                WHERE topic_id = ? AND published_at >= ? AND published_at < ? AND (published_at, id) > (?, ?)
+                ORDER BY published_at, id
+                LIMIT ?
+            """, (topic_id, start, end, key[0], key[1], limit))
+            if rows is None:
+                return None
+            runs.append([(published_at, message_id, full_path, payload, qos, retain, expires_at, encoding)
+                         for published_at, message_id, payload, qos, retain, expires_at, encoding in rows])
+        messages = []
+        # Only the rows of the page are decompressed
+        for published_at, message_id, topic, payload, qos, retain, expires_at, encoding in \
+                islice(heapq.merge(*runs), limit):
+            message = Message(topic=topic, payload=self._decode_payload(payload, encoding), qos=qos,
+                              retain=bool(retain), published_at=published_at, expires_at=expires_at)
+            message.message_id = message_id
+            messages.append(message)
+        return messages
+
+    # Dashboard reads
+    def _get_read_connection(self):
+        """Read-only connection of the current thread: dashboard reads can never take the write lock."""
+        conn = getattr(self._local, "read_conn", None)
+        if conn is None:
+            conn = sqlite3.connect(f"file:{self.db_name}?mode=ro", uri=True, timeout=2, check_same_thread=False)
+            conn.create_function("mqtt_match", 2, matches_topic_filter, deterministic=True)
+            self._local.read_conn = conn
+        return conn
+
+    def _read(self, query: str, parameters=()) -> Optional[list]:
+        """Runs a dashboard query. Returns None if it failed; the connection is reopened on the next read."""
+        try:
+            return self._get_read_connection().execute(query, parameters).fetchall()
+        except sqlite3.Error as e:
+            print(f"Dashboard query failed: {e}")
+            conn = getattr(self._local, "read_conn", None)  # Unset if the connection could not be opened
+            if conn is not None:
+                conn.close()
+            self._local.read_conn = None
+            return None
+
+    def list_topics(self) -> Optional[List[str]]:
+        """Every known topic path, sorted."""
+        rows = self._read("SELECT full_path FROM topics ORDER BY full_path")
+        return None if rows is None else [full_path for (full_path,) in rows]
+
+    def connected_client_subscriptions(self) -> Optional[List[Tuple[str, Optional[str], Optional[int]]]]:
+        """
+        (client_id, topic_filter, qos) for every subscription of the connected clients, sorted by client
+        and filter. Clients without subscriptions appear once with topic_filter and qos set to None.
+        """
+        return self._read("""
+            SELECT clients.client_id, subscriptions.topic_filter, subscriptions.qos
+            FROM clients
+            LEFT JOIN subscriptions ON subscriptions.client_id = clients.client_id
+                AND subscriptions.topic_filter IS NOT NULL
+            WHERE clients.connected = 1
+            ORDER BY clients.client_id, subscriptions.topic_filter
+        """)
+
+    def topic_subscribers(self) -> Optional[List[Tuple[str, Optional[str]]]]:
+        """(topic path, client_id) for every topic and the clients subscribed to it exactly, None if it has none."""
+        return self._read("""
+            SELECT topics.full_path, subscribers.client_id
+            FROM topics
+            LEFT JOIN (
+                SELECT subscriptions.topic_id, clients.client_id
+                FROM subscriptions
+                JOIN clients ON subscriptions.client_id = clients.client_id
+            ) AS subscribers ON subscribers.topic_id = topics.id
+            ORDER BY topics.full_path, subscribers.client_id
+        """)
+
+    def last_messages(self, topic: str, limit: int = 10) -> Optional[List[Tuple[str, str]]]:
+        """(payload, published_at) of a topic's most recent history entries, newest first."""
+        # Bounded per topic and indexed on (topic_id, id), unlike the messages table
+        return self._read("""
+            SELECT payload, published_at FROM topic_history
+            JOIN topics ON topic_history.topic_id = topics.id
+            WHERE topics.full_path = ?
+            ORDER BY topic_history.id DESC
+            LIMIT ?
+        """, (topic, limit))
+
+    def qos_message_page(self, direction: str, filters: dict, key, page_size: int) -> Optional[list]:
+        """
+        One page of QoS 1/2 messages as (id, published_at, topic, qos, payload), newest first,
+        keyset-paginated on (published_at, id): rows older than `key` ("older") or newer ("newer").
+        """
+        conditions = ["messages.qos IN (1, 2)"]  # Same predicate as the partial index
+        parameters = []
+        if key is not None:
+            conditions.append("(messages.published_at, messages.id) " + ("<" if direction == "older" else ">") + " (?, ?)")
+            parameters.extend(key)
+        if filters.get("since"):
+            conditions.append("messages.published_at >= ?")
+            parameters.append(filters["since"])
+        if filters.get("until"):
+            conditions.append("messages.published_at <= ?")
+            parameters.append(filters["until"])
+        if filters.get("topic_filter"):
+            # The topics table is small next to messages, so it is filtered first
+            conditions.append("messages.topic_id IN (SELECT id FROM topics WHERE mqtt_match(?, full_path))")
+            parameters.append(filters["topic_filter"])
+        rows = self._read(f"""
+            SELECT messages.id, messages.published_at, topics.full_path, messages.qos, messages.payload,
+                   messages.payload_encoding
+            FROM messages
+            JOIN topics ON messages.topic_id = topics.id
+            WHERE {" AND ".join(conditions)}
+            ORDER BY messages.published_at DESC, messages.id DESC
+            LIMIT ?
+        """, parameters + [page_size])
+        if rows is None:
+            return None
+        return [(message_id, published_at, topic, qos, self._decode_payload(payload, encoding))
+                for message_id, published_at, topic, qos, payload, encoding in rows]
+
     def close(self):
         # Connections are managed per-thread, so no need to close here
         pass
\ No newline at end of file
@@ -0,0 +1,104 @@
+from collections import deque
+from PyQt5.QtWidgets import QWidget, QGridLayout
+from PyQt5.QtCore import Qt, QPointF, pyqtSignal
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF
+
+
+class Sparkline(QWidget):
+    """Small line chart of the last samples of one or more series, scaled to the largest visible value."""
+
+    COLORS = ("#2e7d32", "#f9a825", "#c62828")
+
+    def __init__(self, title, series, unit="", scale=1.0, window=120, parent=None):
+        super().__init__(parent)
+        self.title = title
+        self.series = series  # Sample keys drawn by this chart, one line each
+        self.unit = unit
+        self.scale = scale  # Multiplier applied to the sample values before display
+        self.values = {key: deque(maxlen=window) for key in series}
+        self.setMinimumSize(240, 90)
+
+    def add(self, sample):
+        for key, values in self.values.items():
+            values.append(sample.get(key, 0) * self.scale)
+        self.update()
+
+    def clear(self):
+        for values in self.values.values():
+            values.clear()
+        self.update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.fillRect(self.rect(), QColor("#fafafa"))
+        painter.setPen(QColor("#9e9e9e"))
+        painter.drawRect(self.rect().adjusted(0, 0, -1, -1))
+
+        latest = ", ".join(f"{values[-1]:.1f}" if values else "-" for values in self.values.values())
+        painter.setPen(QColor("#212121"))
+        painter.drawText(6, 15, f"{self.title}: {latest} {self.unit}".rstrip())
+
+        top, bottom, left, right = 22, self.height() - 4, 4, self.width() - 4
+        peak = max((max(values) for values in self.values.values() if values), default=0) or 1.0
+        for color, values in zip(self.COLORS, self.values.values()):
+            if len(values) < 2:
+                continue
+            step = (right - left) / (values.maxlen - 1)
+            start = right - step * (len(values) - 1)  # Newest sample on the right edge
+            line = QPolygonF([
+                QPointF(start + step * position, bottom - (bottom - top) * value / peak)
+                for position, value in enumerate(values)
+            ])
+            painter.setPen(QPen(QColor(color), 1.5))
+            painter.drawPolyline(line)
+        painter.end()
+
+
+class StatsTab(QWidget):
+    """
+    Live broker metrics charted from the server's in-process BrokerStats feed. Samples are produced
+    on the broker's scheduler thread; `sample_received` is emitted from there and delivered to the
+    charts on the GUI thread, so the tab never polls the database.
+    """
+
+    sample_received = pyqtSignal(object)
+
+    def __init__(self, window=120, parent=None):
+        super().__init__(parent)
+        self.charts = [
+            Sparkline("Messages in", ("messages_in",), "msg/s", window=window),
+            Sparkline("Messages out", ("messages_out",), "msg/s", window=window),
+            Sparkline("Bytes in", ("bytes_in",), "KiB/s", scale=1 / 1024, window=window),
+            Sparkline("Bytes out", ("bytes_out",), "KiB/s", scale=1 / 1024, window=window),
+            Sparkline("Connected sessions", ("sessions",), window=window),
+            Sparkline("Queue depth", ("queue_depth",), window=window),
+            Sparkline("Delivery latency p50/p95/p99", ("latency_p50", "latency_p95", "latency_p99"), "ms",
+                      scale=1000, window=window),
+        ]
+        layout = QGridLayout()
+        for position, chart in enumerate(self.charts):
+            layout.addWidget(chart, position // 2, position % 2)
+        self.setLayout(layout)
+        self.stats = None
+        self._listener = self.sample_received.emit  # Kept so the same callable can be unsubscribed
+        self.sample_received.connect(self.add_sample, Qt.QueuedConnection)
+
+    def attach(self, stats):
+        """Shows the history kept by `stats` and follows its new samples."""
+        self.detach()
+        self.stats = stats
+        for chart in self.charts:
+            chart.clear()
+        for sample in stats.history():
+            self.add_sample(sample)
+        stats.subscribe(self._listener)
+
+    def detach(self):
+        if self.stats is not None:
+            self.stats.unsubscribe(self._listener)
+            self.stats = None
+
+    def add_sample(self, sample):
+        for chart in self.charts:
+            chart.add(sample)
@@ -0,0 +1,225 @@
+from typing import Optional, List, Tuple, Protocol
+from client import Client
+from message import Message
+from will_message import WillMessage
+from subscription_cache import SubscriptionCache
+from topic import matches_topic_filter
+from bloom_filter import CountingBloomFilter
+
+
+class StorageBackend(Protocol):
+    """
+    Persistence interface used by the broker, its write-behind stores and the dashboard.
+    Backends: SQLServer (SQLite), MemoryStorage (in-memory only) and HybridStorage (in-memory with
+    asynchronous SQLite durability). Write methods return False/None on failure instead of raising.
+    """
+
+    MIN_CONNECTION_INTERVAL: float
+
+    # Sessions and clients
+    def validate_connect(self, decoded_packet: dict) -> int: ...
+    def establish_session(self, decoded_packet: dict) -> Optional[Client]: ...
+    def update_disconnect_time(self, client_id: str) -> None: ...
+    def reset_connected_flags(self) -> None: ...
+    def expire_sessions(self, batch_size: int = 500) -> dict: ...
+    def load_banned_clients(self) -> List[str]: ...
+    def set_client_banned(self, client_id: str, banned: bool) -> bool: ...
+
+    # Users
+    def get_password_hash(self, username: str) -> Optional[str]: ...
+    def set_password_hash(self, username: str, password_hash: str) -> bool: ...
+    def remove_user(self, username: str) -> bool: ...
+
+    # Subscriptions
+    def save_subscriptions(self, client_id: str, subscriptions: List[Tuple[str, int, int]]) -> Optional[List[bool]]: ...
+    def remove_subscriptions(self, client_id: str, topics: List[str]) -> Optional[List[bool]]: ...
+    def remove_all_subscriptions_for_client(self, client_id: str) -> bool: ...
+    def get_subscribers(self, topic_name: str) -> List[Tuple[str, int, int]]: ...
+    def list_topic_filters(self) -> List[str]: ...
+    def load_subscription_filter(self, topic_filters: Optional[List[str]] = None) -> int: ...
+    def might_have_subscribers(self, topic_name: str) -> bool: ...
+
+    # Retained messages and wills, written behind by RetainedStore and WillRegistry
+    def load_retained_messages(self) -> List[Message]: ...
+    def save_retained_batch(self, retained: dict) -> bool: ...
+    def clear_expired_retained(self, now: Optional[float] = None) -> int: ...
+    def load_will_messages(self) -> List[WillMessage]: ...
+    def save_will_batch(self, wills: dict) -> bool: ...
+
+    # Message archive, topic history and retention
+    def save_message(self, message: Message) -> bool: ...
+    def retrieve_message_by_packet_id(self, packet_id) -> Optional[Message]: ...
+    def replay_messages(self, topic_filter: str, start: str, end: str, after=None, limit: int = 500) -> Optional[List[Message]]: ...
+    def load_topic_history(self, depth: int) -> dict: ...
+    def save_topic_history_batch(self, entries: List[Tuple[str, str, int, str]], depth: int) -> bool: ...
+    def prune_topic_history(self, max_age: float, batch_size: int = 500) -> List[str]: ...
+    def prune_messages_older_than(self, max_age: float, batch_size: int = 500) -> int: ...
+    def topic_overflow(self, max_per_topic: int) -> dict: ...
+    def prune_topic_overflow(self, overflow: dict, batch_size: int = 500) -> int: ...
+    def prune_oldest_messages(self, batch_size: int = 500) -> int: ...
+    def database_size(self) -> Tuple[int, int]: ...
+    def incremental_vacuum(self, pages: int) -> int: ...
+
+    # Archive compression (ArchiveCompression); dictionaries are kept with the archive
+    def set_compression(self, compression) -> None: ...
+    def save_compression_dictionary(self, prefix: str, dictionary: bytes) -> Optional[int]: ...
+    def sample_payloads(self, prefix: str, limit: int = 1000) -> list: ...
+
+    # Dashboard reads, called from the dashboard's provider thread. None means the read failed.
+    def list_topics(self) -> Optional[List[str]]: ...
+    def connected_client_subscriptions(self) -> Optional[List[Tuple[str, Optional[str], Optional[int]]]]: ...
+    def topic_subscribers(self) -> Optional[List[Tuple[str, Optional[str]]]]: ...
+    def last_messages(self, topic: str, limit: int = 10) -> Optional[List[Tuple[str, str]]]: ...
+    def qos_message_page(self, direction: str, filters: dict, key, page_size: int) -> Optional[list]: ...
+
+    def close(self) -> None: ...
+
+
+class StorageBase:
+    """
+    Behaviour shared by every backend: CONNECT validation, the subscription Bloom filter and the
+    subscriber lookup cache. Backends call `_forget_subscriptions` and invalidate `subscription_cache`
+    whenever they delete subscriptions.
+    """
+
+    def __init__(self, SUPPORTED_MQTT_VERSION=5.0, MAX_CONNECTIONS=50, MIN_CONNECTION_INTERVAL=1, MAX_CLIENT_ID_LENGTH=23,
+                 SUBSCRIPTION_CACHE_SIZE=4096):
+        self.SUPPORTED_MQTT_VERSION = SUPPORTED_MQTT_VERSION
+        self.MAX_CONNECTIONS = MAX_CONNECTIONS
+        self.MIN_CONNECTION_INTERVAL = MIN_CONNECTION_INTERVAL
+        self.MAX_CLIENT_ID_LENGTH = MAX_CLIENT_ID_LENGTH
+        # Topic name -> resolved subscribers, invalidated on every subscription change
+        self.subscription_cache = SubscriptionCache(self.matches_wildcard, SUBSCRIPTION_CACHE_SIZE)
+        # Negative check for topics nobody subscribes to (exact topics and wildcard filter prefixes)
+        self.subscription_filter = CountingBloomFilter()
+        self.compression = None  # ArchiveCompression of archived payloads, None stores them verbatim
+
+    def _subscription_key(self, topic_filter: str) -> str:
+        """Bloom filter key of a subscription: the exact topic, or the levels before the first wildcard."""
+        levels = topic_filter.split('/')
+        for depth, level in enumerate(levels):
+            if level in ('+', '#'):
+                return '^' + '/'.join(levels[:depth])
+        return '=' + topic_filter
+
+    def load_subscription_filter(self, topic_filters: Optional[List[str]] = None) -> int:
+        """
+        Fills the subscription Bloom filter, from `topic_filters` (e.g. a shutdown snapshot)
+        or from the stored subscriptions. Returns the number of subscriptions added.
+        """
+        if topic_filters is None:
+            topic_filters = self.list_topic_filters()
+        self.subscription_filter.clear()
+        for topic_filter in topic_filters:
+            self.subscription_filter.add(self._subscription_key(topic_filter))
+        return len(topic_filters)
+
+    def _forget_subscriptions(self, topic_filters: List[str]) -> None:
+        """Removes deleted subscriptions from the Bloom filter."""
+        for topic_filter in topic_filters:
+            self.subscription_filter.remove(self._subscription_key(topic_filter))
+
+    def might_have_subscribers(self, topic_name: str) -> bool:
+        """
+        Fast negative check: False means no subscription can match the topic.
+        True may be a false positive, so the subscribers still have to be resolved.
+        """
+        if self.subscription_filter.might_contain('=' + topic_name):
+            return True
+        levels = topic_name.split('/')
+        return any(
+            self.subscription_filter.might_contain('^' + '/'.join(levels[:depth]))
+            for depth in range(len(levels) + 1)
+        )
+
+    def validate_connect(self, decoded_packet: dict) -> int:
+        """
+        Validates a CONNECT packet without touching the storage. Returns 0x00 or the CONNACK reason code.
+        """
+        client_id = decoded_packet.get("client_id")
+        protocol_level = decoded_packet.get("protocol_level")
+        packet_size = decoded_packet.get("length")
+
+        # Reject if packet size exceeds maximum allowed limit
+        if packet_size > 268435456:
+            return 0x95  # Packet too large
+
+        # Reject if MQTT protocol version is unsupported
+        if protocol_level != self.SUPPORTED_MQTT_VERSION:
+            return 0x84  # Unsupported Protocol Version
+
+        # Check server availability and reject if unavailable
+        if not self.is_server_available():
+            return 0x88  # Server Unavailable
+
+        # Connection limits, bans and connection rate are enforced in memory by AdmissionController
+
+        # Reject if client ID is invalid or too long
+        if not client_id or len(client_id) > self.MAX_CLIENT_ID_LENGTH:
+            return 0x85  # Client Identifier Not Valid
+
+        return 0x00
+
+    def store_client(self, decoded_packet: dict) -> Tuple[int, int]:
+        """
+        Validates and stores an authenticated client. Returns a tuple of (connect_ack_flags, reason_code).
+        Credentials are checked beforehand by the Authenticator.
+        """
+        reason_code = self.validate_connect(decoded_packet)
+        if reason_code != 0x00:
+            return (0x00, reason_code)
+        session = self.establish_session(decoded_packet)
+        if session is None:
+            return (0x00, 0x87)  # Connection Refused, Not Authorized
+        return (0x01 if session.session_present else 0x00, 0x00)
+
+    def is_server_available(self) -> bool:
+        """Checks if server is available for new connections."""
+        return True  # Placeholder for actual server status check
+
+    def save_subscription(self, client_id: str, topic: str, qos: int, options: int = None) -> bool:
+        """
+        Saves a subscription for a client to a specific topic with the specified QoS level.
+        """
+        return self.save_subscriptions(client_id, [(topic, qos, qos if options is None else options)]) is not None
+
+    def remove_subscription(self, client_id: str, topic: str) -> bool:
+        """
+        Removes a subscription for the given client and topic.
+        Handles both direct topic subscriptions and wildcard topic filters.
+        """
+        removed = self.remove_subscriptions(client_id, [topic])
+        return bool(removed and removed[0])
+
+    def matches_wildcard(self, subscription: str, topic: str) -> bool:
+        """
+        Checks if a topic matches a wildcard subscription.
+        Supports:
+        - Single-level wildcard `+`
+        - Multi-level wildcard `#`
+        """
+        return matches_topic_filter(subscription, topic)
+
+    def _new_session(self, decoded_packet: dict, session_present: bool) -> Client:
+        """Builds the Client of an established session from its CONNECT packet."""
+        properties = decoded_packet.get("properties", {})
+        session = Client(
+            decoded_packet.get("client_id"),
+            decoded_packet.get("username"),
+            decoded_packet.get("password"),
+            decoded_packet.get("clean_session"),
+            decoded_packet.get("keep_alive"),
+            properties.get("session_expiry_interval", 0),
+            decoded_packet.get("will_flag"),
+            properties.get("receive_maximum", 65535)
+        )
+        session.session_present = session_present
+        session.connected = True
+        return session
+
+    def set_compression(self, compression) -> None:
+        """Archive payload compression; backends keeping the archive in memory store payloads verbatim."""
+        self.compression = compression
+
+    def close(self) -> None:
+        pass
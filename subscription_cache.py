@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+
+class SubscriptionCache:
+    """
+    Bounded LRU cache from a concrete topic name to its resolved subscribers
+    (client_id, granted QoS, subscription options). A subscription change only evicts the
+    cached topics its filter can match, so hot topics keep resolving without a database scan.
+    """
+
+    def __init__(self, matches, capacity=4096):
+        self.matches = matches  # Callable(topic_filter, topic) -> bool
+        self.capacity = capacity
+        self._entries = OrderedDict()  # {topic: [(client_id, qos, options)]}, least recently used first
+        self._by_client = {}  # {client_id: set of cached topics listing that client}
+        self._generation = 0  # Bumped on every invalidation, so stale lookups are not cached
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, topic):
+        """Returns the cached subscribers of a topic, or None on a miss."""
+        with self.lock:
+            subscribers = self._entries.get(topic)
+            if subscribers is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(topic)
+            self.hits += 1
+            return subscribers
+
+    def generation(self) -> int:
+        """Token to pass to `put`, taken before reading the subscriptions from the database."""
+        with self.lock:
+            return self._generation
+
+    def put(self, topic, subscribers, generation) -> bool:
+        """Caches a lookup result unless a subscription changed since `generation` was taken."""
+        with self.lock:
+            if generation != self._generation:
+                return False
+            self._remove(topic)
+            self._entries[topic] = subscribers
+            for client_id, _, _ in subscribers:
+                self._by_client.setdefault(client_id, set()).add(topic)
+            while len(self._entries) > self.capacity:
+                self._remove(next(iter(self._entries)))
+            return True
+
+    def invalidate_filter(self, topic_filter) -> int:
+        """Evicts the cached topics a subscription filter matches. Returns the number evicted."""
+        with self.lock:
+            self._generation += 1
+            if '+' not in topic_filter and '#' not in topic_filter:
+                return 1 if self._remove(topic_filter) else 0
+            stale = [topic for topic in self._entries if self.matches(topic_filter, topic)]
+            for topic in stale:
+                self._remove(topic)
+            return len(stale)
+
+    def invalidate_client(self, client_id) -> int:
+        """Evicts every cached topic that lists a client, e.g. when its session is dropped."""
+        with self.lock:
+            self._generation += 1
+            stale = self._by_client.pop(client_id, set())
+            for topic in stale:
+                self._remove(topic)
+            return len(stale)
+
+    def clear(self):
+        with self.lock:
+            self._generation += 1
+            self._entries.clear()
+            self._by_client.clear()
+
+    def _remove(self, topic) -> bool:
+        subscribers = self._entries.pop(topic, None)
+        if subscribers is None:
+            return False
+        for client_id, _, _ in subscribers:
+            topics = self._by_client.get(client_id)
+            if topics is not None:
+                topics.discard(topic)
+                if not topics:
+                    del self._by_client[client_id]
+        return True
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,65 @@
+import time
+import pytest
+from adaptive_pool import AdaptivePoolController
+from memory_storage import MemoryStorage
+from message_dispatcher import MessageDispatcher
+
+
+def test_worker_bounds_are_validated():
+    with pytest.raises(ValueError):
+        AdaptivePoolController(min_workers=0)
+    with pytest.raises(ValueError):
+        AdaptivePoolController(min_workers=4, max_workers=2)
+
+
+def test_grows_only_above_the_backlog_threshold():
+    controller = AdaptivePoolController(min_workers=2, max_workers=16, backlog_per_worker=8)
+    assert controller.decide(2, 16) == 0  # Exactly 8 per worker is still absorbed
+    assert controller.decide(2, 17) == 1  # ceil(17 / 8) = 3 workers wanted
+    assert controller.decide(2, 80) == 8  # Sized for the whole backlog at once
+    assert controller.decide(4, 1000) == 12  # Capped at max_workers
+    assert controller.decide(16, 1000) == 0
+    assert controller.scale_ups == 3
+    assert [decision["reason"] for decision in controller.decisions] == ["backlog"] * 3
+
+
+def test_lanes_cap_growth():
+    controller = AdaptivePoolController(min_workers=2, max_workers=16)
+    assert controller.decide(2, 1000, lanes=5) == 3  # One worker per lane is enough
+    assert controller.decide(5, 1000, lanes=5) == 0
+    assert controller.decide(1, 1000, lanes=1) == 1  # Never capped below min_workers
+
+
+def test_latency_above_target_grows_a_pending_pool():
+    controller = AdaptivePoolController(min_workers=2, max_workers=16, target_latency=0.05,
+                                        latency_smoothing=0.5)
+    controller.record_latency(0.02)
+    controller.record_latency(0.2)
+    assert controller.latency == pytest.approx(0.11)
+    assert controller.decide(8, 0) == 0  # Nothing pending: latency alone does not grow the pool
+    assert controller.decide(8, 1) == 4  # Half again, so bursts are absorbed geometrically
+    assert controller.decisions[-1]["reason"] == "latency"
+
+
+def test_idle_workers_retire_down_to_the_minimum():
+    controller = AdaptivePoolController(min_workers=2, max_workers=4)
+    assert controller.may_retire(4) and controller.may_retire(3)
+    assert not controller.may_retire(2)
+    metrics = controller.metrics(2)
+    assert metrics["scale_downs"] == 2 and metrics["workers"] == 2
+    assert [decision["workers_after"] for decision in metrics["decisions"]] == [3, 2]
+
+
+def test_dispatcher_workers_retire_when_idle():
+    controller = AdaptivePoolController(min_workers=1, max_workers=3, idle_timeout=0.05)
+    dispatcher = MessageDispatcher(MemoryStorage(), controller=controller)
+    try:
+        dispatcher._spawn_workers(2)  # As after a burst
+        assert dispatcher.pool_metrics()["workers"] == 3
+        deadline = time.monotonic() + 2
+        while dispatcher.pool_metrics()["workers"] > 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert dispatcher.pool_metrics()["workers"] == 1
+        assert controller.scale_downs == 2
+    finally:
+        dispatcher.shutdown(wait=False)
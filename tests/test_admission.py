@@ -0,0 +1,61 @@
+import pytest
+import admission
+from admission import AdmissionController, TokenBucket
+from memory_storage import MemoryStorage
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission, "monotonic", lambda: now[0])
+    return now
+
+
+def test_token_bucket_refills_up_to_its_capacity():
+    bucket = TokenBucket(2, 1.0, now=0)
+    assert bucket.consume(0) and bucket.consume(0)
+    assert not bucket.consume(0.5)
+    assert bucket.consume(1.0)
+    assert bucket.available(100) and bucket.tokens == 2  # Never above the capacity
+
+
+def test_connection_slots_are_counted_and_released(clock):
+    controller = AdmissionController(MemoryStorage(), max_connections=2, min_connection_interval=0)
+    assert controller.admit("a", "10.0.0.1") == 0x00
+    assert controller.admit("b", "10.0.0.1") == 0x00
+    assert controller.admit("c", "10.0.0.1") == 0x89  # Server Busy
+    controller.release()
+    assert controller.active_connections == 1
+    assert controller.admit("c", "10.0.0.1") == 0x00
+
+
+def test_banned_clients_are_rejected_until_unbanned(clock):
+    db = MemoryStorage()
+    controller = AdmissionController(db, min_connection_interval=0)
+    assert controller.ban_client("bad")
+    assert controller.admit("bad", "10.0.0.1") == 0x8A  # Client Banned
+    assert AdmissionController(db).admit("bad", "10.0.0.1") == 0x8A  # Loaded back from storage
+    assert controller.unban_client("bad")
+    assert controller.admit("bad", "10.0.0.1") == 0x00
+
+
+def test_address_burst_is_limited_and_refilled(clock):
+    controller = AdmissionController(MemoryStorage(), max_connections=100, min_connection_interval=0,
+                                     ip_rate=2.0, ip_burst=3)
+    assert [controller.admit(f"c{index}", "10.0.0.1") for index in range(4)] == [0x00, 0x00, 0x00, 0x9F]
+    assert controller.admit("other", "10.0.0.2") == 0x00
+    clock[0] += 0.5
+    assert controller.admit("c4", "10.0.0.1") == 0x00
+    assert controller.admit("c5", "10.0.0.1") == 0x9F
+
+
+def test_client_rejection_does_not_charge_the_address(clock):
+    controller = AdmissionController(MemoryStorage(), max_connections=100, min_connection_interval=10,
+                                     ip_rate=0.001, ip_burst=2)
+    assert controller.admit("storm", "10.0.0.1") == 0x00
+    for _ in range(5):
+        assert controller.admit("storm", "10.0.0.1") == 0x9F  # Too soon for this client ID
+    assert controller.admit("other", "10.0.0.1") == 0x00  # The address still had its second token
+    assert controller.admit("third", "10.0.0.1") == 0x9F
+    clock[0] += 10
+    assert controller.admit("storm", "10.0.0.2") == 0x00
@@ -0,0 +1,50 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from authenticator import Authenticator
+from memory_storage import MemoryStorage
+
+
+def test_anonymous_clients_follow_the_switch():
+    assert Authenticator(MemoryStorage(), allow_anonymous=True).authenticate(None, None) == 0x00
+    assert Authenticator(MemoryStorage(), allow_anonymous=False).authenticate(None, None) == 0x86
+
+
+def test_unknown_users_are_rejected_until_added():
+    authenticator = Authenticator(MemoryStorage(), iterations=1000)
+    try:
+        assert authenticator.authenticate("sensor", "secret") == 0x86
+        assert authenticator.add_user("sensor", "secret")
+        assert authenticator.authenticate("sensor", "secret") == 0x00
+        assert authenticator.authenticate("sensor", "wrong") == 0x86
+        assert authenticator.remove_user("sensor")
+        assert authenticator.authenticate("sensor", "secret") == 0x86
+    finally:
+        authenticator.shutdown()
+
+
+def test_login_verified_across_a_password_change_is_not_cached():
+    db = MemoryStorage()
+    authenticator = Authenticator(db, iterations=1000)
+    try:
+        assert authenticator.add_user("sensor", "old")
+        reading, changed = threading.Event(), threading.Event()
+        get_password_hash = db.get_password_hash
+
+        def slow_read(username):
+            stored_hash = get_password_hash(username)
+            reading.set()
+            changed.wait(5)
+            return stored_hash
+
+        db.get_password_hash = slow_read
+        login = ThreadPoolExecutor(max_workers=1).submit(authenticator.authenticate, "sensor", "old")
+        assert reading.wait(5)
+        assert authenticator.add_user("sensor", "new")
+        changed.set()
+        assert login.result(5) == 0x00  # Checked against the hash it read before the change
+        db.get_password_hash = get_password_hash
+
+        assert authenticator.authenticate("sensor", "old") == 0x86
+        assert authenticator.authenticate("sensor", "new") == 0x00
+    finally:
+        authenticator.shutdown()
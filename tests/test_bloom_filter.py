@@ -0,0 +1,61 @@
+import pytest
+from bloom_filter import CountingBloomFilter
+from memory_storage import MemoryStorage
+from sqlServer import SQLServer
+
+
+def test_counts_follow_adds_and_removes():
+    bloom = CountingBloomFilter()
+    bloom.add("=a/b")
+    bloom.add("=a/b")
+    bloom.remove("=a/b")
+    assert "=a/b" in bloom and bloom.items == 1
+    bloom.remove("=a/b")
+    assert "=a/b" not in bloom and bloom.items == 0
+    bloom.remove("=never/added")
+    assert bloom.items == 0 and not any(bloom.counters)
+
+
+def test_no_false_negatives_after_removals_in_a_crowded_filter():
+    bloom = CountingBloomFilter(size=1024, hash_count=4)
+    keys = [f"^sensors/{index}" for index in range(2000)]
+    for key in keys:
+        bloom.add(key)
+    for key in keys[::2]:
+        bloom.remove(key)
+    assert all(key in bloom for key in keys[1::2])
+
+
+def test_saturated_counters_are_never_decremented():
+    bloom = CountingBloomFilter(size=8, hash_count=1)
+    for _ in range(300):
+        bloom.add("hot")
+    for _ in range(300):
+        bloom.remove("hot")
+    assert "hot" in bloom
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def db(request, tmp_path):
+    return SQLServer(str(tmp_path / "broker.db")) if request.param == "sqlite" else MemoryStorage()
+
+
+def test_wildcard_subscriptions_are_never_missed(db):
+    filters = {"a": "plant/+/temp", "b": "office/#", "c": "#", "d": "lab/door"}
+    for client_id, topic_filter in filters.items():
+        db.save_subscriptions(client_id, [(topic_filter, 0, 0)])
+    db.save_subscriptions("e", [("plant/+/temp", 1, 1)])  # Same prefix key as "a"
+
+    db.remove_subscriptions("c", ["#"])
+    db.remove_subscriptions("a", ["plant/+/temp"])
+    for topic in ("plant/7/temp", "office", "office/2/light", "lab/door"):
+        assert db.might_have_subscribers(topic), topic
+
+    db.remove_subscriptions("e", ["plant/+/temp"])
+    db.remove_subscriptions("b", ["office/#"])
+    assert not db.might_have_subscribers("plant/7/temp")
+    assert not db.might_have_subscribers("office/2/light")
+    assert db.might_have_subscribers("lab/door")
+
+    assert db.load_subscription_filter() == 1  # Rebuilt from the stored subscriptions
+    assert db.might_have_subscribers("lab/door")
@@ -0,0 +1,40 @@
+import memory_storage
+from memory_storage import MemoryStorage
+from message import Message
+from replay import ArchiveReplay
+
+
+def test_replay_pages_through_the_archive_in_publish_order(monkeypatch):
+    db = MemoryStorage()
+    stamps = iter(f"2024-01-01 00:00:{second:02d}" for second in range(20))
+    monkeypatch.setattr(memory_storage, "_timestamp", lambda epoch=None: next(stamps))
+    for index in range(20):
+        db.save_message(Message(topic="a" if index % 3 else "b", payload=str(index), qos=0))
+
+    page = db.replay_messages("a", "2024-01-01 00:00:05", "2024-01-01 00:00:15", limit=3)
+    assert [message.payload for message in page] == ["5", "7", "8"]
+    page = db.replay_messages("a", "2024-01-01 00:00:05", "2024-01-01 00:00:15",
+                              (page[-1].published_at, page[-1].message_id), limit=3)
+    assert [message.payload for message in page] == ["10", "11", "13"]
+
+    replayed = ArchiveReplay(db, page_size=2).messages("#", 1704067202, 1704067210)
+    assert [message.payload for message in replayed] == [str(index) for index in range(2, 10)]
+
+
+def test_replay_after_the_oldest_records_were_dropped(monkeypatch):
+    db = MemoryStorage(max_messages=1500)
+    stamps = iter([memory_storage._timestamp(1704067200 + second) for second in range(5000)])
+    monkeypatch.setattr(memory_storage, "_timestamp", lambda epoch=None: next(stamps))
+    for index in range(5000):
+        db.save_message(Message(topic="a", payload=str(index), qos=1))
+
+    assert len(db.messages) - db._head == 1500
+    assert len(db.messages) < 3000  # The dropped prefix is compacted away
+    page = db.replay_messages("a", "2024-01-01 00:00:00", "2024-01-02 00:00:00", limit=3)
+    assert [message.payload for message in page] == ["3500", "3501", "3502"]
+    page = db.replay_messages("a", "2024-01-01 00:00:00", "2024-01-02 00:00:00",
+                              (page[-1].published_at, page[-1].message_id), limit=2)
+    assert [message.payload for message in page] == ["3503", "3504"]
+    assert db.prune_oldest_messages(100) == 100
+    assert db.sample_payloads("a", 1) == ["4999"]
+    assert db.topic_overflow(1000) == {"a": 400}
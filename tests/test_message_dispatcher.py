@@ -0,0 +1,59 @@
+import re
+import threading
+import time
+from client import Client
+from memory_storage import MemoryStorage
+from message import Message
+from message_dispatcher import MessageDispatcher
+
+
+class RecordingConnection:
+    """Socket stand-in: records written packets and acknowledges every pending QoS 1/2 delivery."""
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self.packets = []
+        self.writing = 0
+        self.overlapped = False
+
+    def fileno(self):
+        return 3
+
+    def sendall(self, packet):
+        self.writing += 1
+        self.overlapped |= self.writing > 1
+        time.sleep(0.001)
+        self.packets.append(bytes(packet))
+        self.writing -= 1
+        with self.dispatcher.pending_acks_lock:
+            for event in self.dispatcher.pending_acks.values():
+                event.set()
+
+
+def test_stream_writes_in_order_with_a_wide_window():
+    dispatcher = MessageDispatcher(MemoryStorage(), max_stream_window=8)
+    try:
+        conn = RecordingConnection(dispatcher)
+        client = Client("reader", receive_maximum=8)
+        deliveries = [(Message(topic="t", payload=f"m{index:03d}", qos=1), 1) for index in range(60)]
+        dispatcher._stream(client, conn, iter(deliveries))
+        payloads = [re.search(rb"m\d{3}", packet).group().decode() for packet in conn.packets]
+        assert payloads == [f"m{index:03d}" for index in range(60)]
+    finally:
+        dispatcher.shutdown(wait=False)
+
+
+def test_writes_to_one_connection_never_overlap():
+    dispatcher = MessageDispatcher(MemoryStorage())
+    try:
+        conn = RecordingConnection(dispatcher)
+        writers = [threading.Thread(target=lambda: [dispatcher.send(conn, b"packet") for _ in range(20)])
+                   for _ in range(4)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+        assert len(conn.packets) == 80
+        assert not conn.overlapped
+    finally:
+        dispatcher.shutdown(wait=False)
@@ -0,0 +1,95 @@
+import socket
+import time
+from message import Message
+from message_dispatcher import MessageDispatcher
+from message_expiry import ExpiryHeap
+from retained_store import RetainedStore
+
+
+def _message(topic="sensors/1", expires_in=60.0, retain=False):
+    return Message(topic=topic, payload="value", qos=0, retain=retain, expires_at=time.time() + expires_in)
+
+
+def test_untracked_messages_are_not_reported():
+    heap = ExpiryHeap()
+    expired = []
+    kept, delivered = _message(expires_in=-1), _message(expires_in=-1)
+    heap.track(kept, expired.extend)
+    heap.track(delivered, expired.extend)
+    assert heap.untrack(delivered, expired.extend)
+    assert len(heap) == 1
+    assert heap.purge_expired() == 1
+    assert expired == [kept]
+    assert len(heap) == 0
+
+
+def test_untracked_entries_are_compacted():
+    heap = ExpiryHeap(compact_threshold=10)
+    messages = [_message() for _ in range(100)]
+    for message in messages:
+        heap.track(message)
+    for message in messages[:90]:
+        heap.untrack(message)
+    assert len(heap) == 10
+    assert len(heap._heap) <= 2 * len(heap) + heap.compact_threshold
+
+
+def test_retained_message_is_untracked_when_replaced_or_removed():
+    heap = ExpiryHeap()
+    store = RetainedStore(expiry=heap)
+    first, second = _message(retain=True), _message(retain=True)
+    store.update(first)
+    store.update(second)
+    assert len(heap) == 1
+    store.remove("sensors/1")
+    assert len(heap) == 0
+
+
+def test_expired_retained_message_is_purged():
+    heap = ExpiryHeap()
+    store = RetainedStore(expiry=heap)
+    store.update(_message(expires_in=-1, retain=True))
+    heap.purge_expired()
+    assert store.get_raw("sensors/1") is None
+
+
+class _Subscribers:
+    def get_subscribers(self, topic):
+        return [("subscriber", 0, 0)]
+
+
+def test_dispatcher_tracks_messages_only_until_delivered():
+    heap = ExpiryHeap()
+    dispatcher = MessageDispatcher(_Subscribers(), min_workers=1, max_workers=1, expiry=heap)
+    broker_side, client_side = socket.socketpair()
+    try:
+        message = _message()
+        message.priority = "normal"
+        dispatcher.dispatch_message(message, {"subscriber": broker_side})
+        assert client_side.recv(1024)  # The PUBLISH
+        deadline = time.time() + 2
+        while len(heap) and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(heap) == 0
+        assert not dispatcher.expiring
+    finally:
+        dispatcher.shutdown(wait=False)
+        broker_side.close()
+        client_side.close()
+
+
+def test_dispatcher_drops_only_the_expired_copies():
+    heap = ExpiryHeap()
+    dispatcher = MessageDispatcher(_Subscribers(), min_workers=1, max_workers=1, expiry=heap)
+    dispatcher.shutdown_event.set()
+    time.sleep(1.1)  # Let the router stop, so the messages stay queued
+    try:
+        expiring, other = _message(expires_in=-1), _message(expires_in=60)
+        for message in (expiring, other):
+            message.priority = "normal"
+            dispatcher.dispatch_message(message, {})
+        assert heap.purge_expired() == 1
+        assert dispatcher.message_queue.qsize() == 1
+        assert list(dispatcher.expiring) == [id(other)]
+    finally:
+        dispatcher.shutdown(wait=False)
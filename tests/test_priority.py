@@ -0,0 +1,75 @@
+import threading
+from queue import Empty
+import pytest
+from priority import PriorityClassifier, WeightedFairQueue
+
+
+def _fill(queue, count=100):
+    for priority in queue.weights:
+        for index in range(count):
+            queue.put((priority, index), priority)
+
+
+def test_turns_follow_the_weights():
+    queue = WeightedFairQueue()
+    _fill(queue)
+    turns = [queue.get(timeout=0)[0] for _ in range(150)]
+    for start in range(0, 150, 15):
+        window = turns[start:start + 15]
+        assert {priority: window.count(priority) for priority in queue.weights} == \
+               {"critical": 8, "high": 4, "normal": 2, "bulk": 1}
+
+
+def test_low_classes_are_not_starved():
+    queue = WeightedFairQueue({"urgent": 100, "bulk": 1})
+    for index in range(1000):
+        queue.put(("urgent", index), "urgent")
+    queue.put(("bulk", 0), "bulk")
+    turns = [queue.get(timeout=0)[0] for _ in range(101)]
+    assert "bulk" in turns
+    assert queue.served == {"urgent": 100, "bulk": 1}
+
+
+def test_fifo_within_a_class_and_unknown_classes_fall_back():
+    queue = WeightedFairQueue()
+    queue.put("first", "high")
+    queue.put("second", "high")
+    queue.put("unknown", "urgent")
+    assert queue.depths() == {"critical": 0, "high": 2, "normal": 1, "bulk": 0}
+    taken = [queue.get(timeout=0) for _ in range(3)]
+    assert sorted(taken) == ["first", "second", "unknown"]
+    assert taken.index("first") < taken.index("second")
+    with pytest.raises(Empty):
+        queue.get(timeout=0.01)
+    queue = WeightedFairQueue({"critical": 2, "bulk": 1})
+    queue.put("unknown")
+    assert queue.depths() == {"critical": 0, "bulk": 1}  # No "normal": the least urgent class
+
+
+def test_discard_removes_matching_items():
+    queue = WeightedFairQueue()
+    _fill(queue, 10)
+    assert queue.discard(lambda item: item[1] % 2, "high") == 5
+    assert queue.discard(lambda item: item[1] >= 8) == 7
+    assert queue.qsize() == 28
+    assert queue.depths()["high"] == 4
+
+
+def test_get_waits_for_a_put():
+    queue = WeightedFairQueue()
+    threading.Timer(0.05, queue.put, args=("late", "bulk")).start()
+    assert queue.get(timeout=2) == "late"
+    assert queue.empty()
+
+
+def test_classifier_order_of_precedence():
+    classifier = PriorityClassifier([("alarms/#", "critical"), ("alarms/test", "bulk"), ("logs/+", "bulk")])
+    assert classifier.classify("alarms/test") == "critical"  # First matching rule wins
+    assert classifier.classify("logs/app") == "bulk"
+    assert classifier.classify("other") == "normal"
+    assert classifier.classify("logs/app", [{"key": "priority", "value": "high"}]) == "high"
+    assert classifier.classify("logs/app", [{"key": "priority", "value": "whatever"}]) == "bulk"
+    with pytest.raises(ValueError):
+        classifier.add_rule("x", "whatever")
+    with pytest.raises(ValueError):
+        PriorityClassifier(default="whatever")
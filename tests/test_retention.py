@@ -0,0 +1,27 @@
+import pytest
+from memory_storage import MemoryStorage
+from message import Message
+from retention import RetentionPolicy, MessagePruner
+from sqlServer import SQLServer
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def db(request, tmp_path):
+    return SQLServer(str(tmp_path / "broker.db")) if request.param == "sqlite" else MemoryStorage()
+
+
+def test_topic_overflow_is_counted_once_per_run(db, monkeypatch):
+    for topic, number in (("a", 7), ("b", 3), ("c", 1)):
+        for index in range(number):
+            db.save_message(Message(topic=topic, payload=f"{topic}{index}", qos=0))
+    counted = []
+    topic_overflow = db.topic_overflow
+    monkeypatch.setattr(db, "topic_overflow", lambda limit: counted.append(limit) or topic_overflow(limit))
+
+    report = MessagePruner(db, RetentionPolicy(max_messages_per_topic=2, batch_size=2), pause=0).run()
+
+    assert counted == [2]
+    assert report["count"] == 6
+    assert db.topic_overflow(2) == {}
+    assert db.sample_payloads("a") == ["a6", "a5"]
+    assert db.sample_payloads("b") == ["b2", "b1"]
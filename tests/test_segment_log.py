@@ -0,0 +1,84 @@
+import os
+import threading
+from message import Message
+from segment_log import SegmentLog
+
+
+def _message(number, topic="plant/1/temp"):
+    return Message(topic=topic, payload=f"value-{number}", qos=1)
+
+
+def test_read_ignores_append_between_flush_and_scan(tmp_path):
+    log = SegmentLog(str(tmp_path))
+    for number in range(5):
+        log.append(_message(number))
+    scan = log._scan
+
+    def racing_scan(*arguments, **keywords):
+        log.append(_message(99))  # Buffered, not yet on disk
+        return scan(*arguments, **keywords)
+
+    log._scan = racing_scan
+    assert [message.payload for message in log.read(0, 100)] == [f"value-{number}" for number in range(5)]
+    log._scan = scan
+    assert len(log.read(0, 100)) == 6
+    log.close()
+
+
+def test_concurrent_append_and_read(tmp_path):
+    log = SegmentLog(str(tmp_path), segment_bytes=4096, index_interval=256)
+    total = 2000
+    errors = []
+
+    def publish():
+        for number in range(total):
+            log.append(_message(number))
+
+    writer = threading.Thread(target=publish)
+    writer.start()
+    while writer.is_alive():
+        offsets = [message.message_id for message in log.read(0, total)]
+        if offsets != list(range(len(offsets))):
+            errors.append(offsets)
+    writer.join()
+    assert not errors
+    messages = log.read(0, total)
+    assert [message.payload for message in messages] == [f"value-{number}" for number in range(total)]
+    assert len(log.segments) > 1
+    log.close()
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    log = SegmentLog(str(tmp_path), index_interval=64)
+    for number in range(10):
+        log.append(_message(number))
+    log.close()
+    segment_path = log.segments[-1].path
+    intact_size = os.path.getsize(segment_path)
+    with open(segment_path, "ab") as segment_file:
+        segment_file.write(b"\x00\x00\x01\x00torn")  # Header of a record whose body never made it
+    with open(log.segments[-1].index_path, "ab") as index_file:
+        index_file.write(b"\x00\x00")  # Torn index entry
+
+    reopened = SegmentLog(str(tmp_path), index_interval=64)
+    assert os.path.getsize(segment_path) == intact_size
+    assert [message.message_id for message in reopened.read(0, 100)] == list(range(10))
+    assert reopened.append(_message(10)) == 10
+    assert reopened.read(10, 1)[0].payload == "value-10"
+    reopened.close()
+
+
+def test_index_entry_past_torn_tail_is_dropped(tmp_path):
+    log = SegmentLog(str(tmp_path), index_interval=1)  # An index entry for every record
+    for number in range(4):
+        log.append(_message(number))
+    log.close()
+    segment_path = log.segments[-1].path
+    with open(segment_path, "r+b") as segment_file:
+        segment_file.truncate(os.path.getsize(segment_path) - 3)  # Cut into the last record
+
+    reopened = SegmentLog(str(tmp_path), index_interval=1)
+    assert [message.payload for message in reopened.read(0, 100)] == ["value-0", "value-1", "value-2"]
+    assert reopened.next_offset == 3
+    assert reopened.read_since(0, 100)[-1].message_id == 2
+    reopened.close()
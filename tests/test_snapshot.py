@@ -0,0 +1,91 @@
+import time
+from types import SimpleNamespace
+from client import Client
+from memory_storage import MemoryStorage
+from message import Message
+from message_dispatcher import MessageDispatcher
+from server import MQTT5Server
+from snapshot import BrokerSnapshot
+from will_message import WillMessage
+
+
+def test_round_trip_keeps_every_section(tmp_path):
+    path = str(tmp_path / "broker.snapshot")
+    pending = [(Message(topic="t/1", payload=b"\x00\xffraw", qos=1, priority="high",
+                        user_properties=[{"key": "k", "value": "v"}]), 1),
+               (Message(topic="t/2", payload="text", qos=2, expires_at=4102444800), 0)]
+    snapshot = BrokerSnapshot(
+        sessions={"a": {"session_expiry": 300, "pending": pending}},
+        subscriptions=["t/+", "t/#", "t/+"],
+        retained=[Message(topic="r", payload=b"on", qos=0, retain=True, published_at=1700000000.5)],
+        wills=[WillMessage("b", "wills/b", b"gone", qos=1, retain=True, registered_at=1700000000,
+                           delay_interval=30, message_expiry_interval=60)],
+        created_at=1700000001,
+    )
+    assert snapshot.save(path)
+
+    loaded = BrokerSnapshot.load(path)
+    assert repr(loaded) == "<BrokerSnapshot sessions=1 subscriptions=3 retained=1 wills=1>"
+    assert loaded.created_at == 1700000001
+    assert loaded.subscriptions == ["t/+", "t/#", "t/+"]
+    (first, first_qos), (second, second_qos) = loaded.sessions["a"]["pending"]
+    assert (first.payload, first_qos, first.priority, first.user_properties) == \
+           (b"\x00\xffraw", 1, "high", [{"key": "k", "value": "v"}])
+    assert (second.payload, second_qos, second.expires_at) == ("text", 0, 4102444800)
+    assert loaded.retained[0].retain and loaded.retained[0].published_at == 1700000000.5
+    will = loaded.wills[0]
+    assert (will.client_id, will.message, will.delay_interval, will.message_expiry_interval) == ("b", b"gone", 30, 60)
+    assert BrokerSnapshot.load(path) is None  # Consumed by the first load
+
+
+def test_unusable_snapshots_are_ignored_and_removed(tmp_path):
+    path = tmp_path / "broker.snapshot"
+    path.write_bytes(b"not zlib")
+    assert BrokerSnapshot.load(str(path)) is None
+    assert not path.exists()
+    BrokerSnapshot.VERSION += 1
+    try:
+        BrokerSnapshot().save(str(path))
+    finally:
+        BrokerSnapshot.VERSION -= 1
+    assert BrokerSnapshot.load(str(path)) is None
+
+
+def test_undelivered_messages_survive_a_restart(tmp_path):
+    db = MemoryStorage()
+    db.save_subscriptions("a", [("t/#", 1, 1)])
+    dispatcher = MessageDispatcher(db)
+    dispatcher.shutdown_event.set()
+    # The router is blocked on the queue: one last message lets it see the shutdown and exit
+    dispatcher.message_queue.put((Message(topic="nobody", payload="", qos=0), {}))
+    while dispatcher.message_queue.qsize():
+        time.sleep(0.01)
+    dispatcher._enqueue_delivery("a", object(), Message(topic="t/lane", payload="lane", qos=1), 1)
+    dispatcher.message_queue.put((Message(topic="t/queued", payload="queued", qos=1), {}))
+    dispatcher.message_queue.put((Message(topic="t/old", payload="old", qos=1, expires_at=1), {}))
+    pending = dispatcher.take_pending()
+    dispatcher.shutdown(wait=False)
+    assert [(message.payload, qos) for message, qos in pending["a"]] == [("lane", 1), ("queued", 1)]
+
+    path = str(tmp_path / "broker.snapshot")
+    assert BrokerSnapshot(sessions={"a": {"session_expiry": 60, "pending": pending["a"]}}).save(path)
+    streams = []
+    server = SimpleNamespace(
+        pending_sessions=BrokerSnapshot.load(path).sessions,
+        dispatcher=SimpleNamespace(stream_to_session=lambda client, conn, deliveries: streams.append(list(deliveries))),
+    )
+    client = Client("a")
+    client.session_present = True
+    MQTT5Server._resume_pending(server, client, "conn")
+    assert [[(message.payload, qos) for message, qos in stream] for stream in streams] == [[("lane", 1), ("queued", 1)]]
+    assert not server.pending_sessions
+
+
+def test_pending_messages_are_dropped_without_a_resumed_session():
+    streams = []
+    server = SimpleNamespace(
+        pending_sessions={"a": {"session_expiry": 60, "pending": [(Message(topic="t", payload="x", qos=1), 1)]}},
+        dispatcher=SimpleNamespace(stream_to_session=lambda *args: streams.append(args)),
+    )
+    MQTT5Server._resume_pending(server, Client("a"), "conn")  # Clean Start: session_present stays False
+    assert not streams and not server.pending_sessions
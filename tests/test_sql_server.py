@@ -0,0 +1,27 @@
+from archive_compression import ArchiveCompression
+from message import Message
+from sqlServer import SQLServer
+
+
+def test_read_returns_none_when_the_database_cannot_be_opened(tmp_path):
+    db = SQLServer(str(tmp_path / "broker.db"))
+    db.db_name = str(tmp_path / "missing" / "broker.db")
+    assert db.list_topics() is None
+    assert db.last_messages("sensors/1") is None
+    db.db_name = str(tmp_path / "broker.db")
+    assert db.list_topics() == []
+
+
+def test_reading_compressed_rows_leaves_compression_off(tmp_path):
+    db = SQLServer(str(tmp_path / "broker.db"))
+    db.set_compression(ArchiveCompression(default="zlib", min_size=0))
+    dictionary_id = db.save_compression_dictionary("sensors/", b'{"temperature": ' * 64)
+    assert dictionary_id is not None
+    assert db.save_message(Message(topic="sensors/1", payload='{"temperature": 21}' * 20, qos=0))
+    assert db._read("SELECT payload_encoding FROM messages") == [(f"zlib:d{dictionary_id}",)]
+    db.set_compression(None)
+
+    assert db.sample_payloads("sensors/") == ['{"temperature": 21}' * 20]
+    assert db.compression is None
+    assert db.save_message(Message(topic="sensors/1", payload="x" * 500, qos=0))
+    assert db._read("SELECT payload_encoding FROM messages ORDER BY id DESC LIMIT 1") == [(None,)]
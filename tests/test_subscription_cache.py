@@ -0,0 +1,46 @@
+from sqlServer import SQLServer
+from subscription_cache import SubscriptionCache
+from topic import matches_topic_filter
+
+
+def test_filters_only_evict_the_topics_they_match():
+    cache = SubscriptionCache(matches_topic_filter)
+    for topic in ("plant/1/temp", "plant/2/temp", "office/temp"):
+        assert cache.put(topic, [("a", 1, 1)], cache.generation())
+    assert cache.invalidate_filter("plant/+/temp") == 2
+    assert cache.get("plant/1/temp") is None
+    assert cache.get("office/temp") == [("a", 1, 1)]
+    assert cache.invalidate_filter("office/temp") == 1
+    assert len(cache) == 0
+
+
+def test_client_invalidation_and_capacity():
+    cache = SubscriptionCache(matches_topic_filter, capacity=2)
+    cache.put("a", [("one", 0, 0)], cache.generation())
+    cache.put("b", [("two", 0, 0)], cache.generation())
+    cache.get("a")
+    cache.put("c", [("one", 0, 0)], cache.generation())  # Evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.invalidate_client("one") == 2
+    assert len(cache) == 0 and not cache._by_client
+
+
+def test_lookup_started_before_a_change_is_not_cached():
+    cache = SubscriptionCache(matches_topic_filter)
+    generation = cache.generation()  # A lookup reads the old subscriptions...
+    cache.invalidate_filter("sensors/#")  # ...while a SUBSCRIBE changes them
+    assert not cache.put("sensors/1", [("old", 0, 0)], generation)
+    assert cache.get("sensors/1") is None
+
+
+def test_subscribe_and_unsubscribe_refresh_cached_subscribers(tmp_path):
+    db = SQLServer(str(tmp_path / "broker.db"))
+    assert db.save_subscriptions("a", [("sensors/+", 1, 1)]) is not None
+    assert db.get_subscribers("sensors/1") == [("a", 1, 1)]
+    assert db.subscription_cache.get("sensors/1") is not None
+
+    db.save_subscriptions("b", [("sensors/#", 0, 0)])
+    assert sorted(db.get_subscribers("sensors/1")) == [("a", 1, 1), ("b", 0, 0)]
+
+    db.remove_subscriptions("a", ["sensors/+"])
+    assert db.get_subscribers("sensors/1") == [("b", 0, 0)]
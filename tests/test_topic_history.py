@@ -0,0 +1,30 @@
+from message import Message
+from retention import RetentionPolicy, MessagePruner
+from sqlServer import SQLServer
+from topic_history import TopicHistory
+
+
+def test_least_recently_published_topic_is_evicted():
+    history = TopicHistory(depth=2, max_topics=2)
+    history.record(Message(topic="a", payload="1", qos=0))
+    history.record(Message(topic="b", payload="2", qos=0))
+    history.record(Message(topic="a", payload="3", qos=0))
+    history.record(Message(topic="c", payload="4", qos=0))
+    assert list(history.topics) == ["a", "c"]
+    assert [entry[0] for entry in history.last("a")] == ["3", "1"]
+    assert history.last("b") == []
+
+
+def test_retention_drops_history_of_idle_topics(tmp_path):
+    db = SQLServer(str(tmp_path / "broker.db"))
+    db.save_topic_history_batch([("old", "x", 0, "2000-01-01 00:00:00")], 10)
+    history = TopicHistory(db, depth=10)
+    assert history.load() == 1
+    history.record(Message(topic="new", payload="y", qos=0))
+    history.flush()
+
+    report = MessagePruner(db, RetentionPolicy(max_age=3600), history=history).run()
+
+    assert report["history_topics"] == 1
+    assert list(history.topics) == ["new"]
+    assert list(db.load_topic_history(10)) == ["new"]
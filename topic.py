@@ -12,3 +12,28 @@ class Topic:
 
     def __repr__(self):
         return f"<Topic full_path={self.full_path} retained={bool(self.retained_message)}>"
+
+
+def matches_topic_filter(topic_filter: str, topic: str) -> bool:
+    """
+    Checks if a topic name matches a topic filter.
+    Supports:
+    - Single-level wildcard `+`
+    - Multi-level wildcard `#`
+    """
+    filter_levels = topic_filter.split('/')
+    topic_levels = topic.split('/')
+
+    for filter_level, topic_level in zip(filter_levels, topic_levels):
+        if filter_level == '+':
+            continue  # Single-level wildcard matches anything at this level
+        if filter_level == '#':
+            return True  # Multi-level wildcard matches everything after
+        if filter_level != topic_level:
+            return False
+
+    # If all levels match, check for trailing wildcards
+    if len(filter_levels) > len(topic_levels):
+        return filter_levels[len(topic_levels)] == '#'
+
+    return len(filter_levels) == len(topic_levels)
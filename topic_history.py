@@ -0,0 +1,101 @@
+import threading
+from collections import deque, OrderedDict
+from time import time, gmtime, strftime
+
+
+class TopicHistory:
+    """
+    The last `depth` messages of every topic, kept in memory as ring buffers so "last N messages"
+    lookups cost O(N) whatever the size of the `messages` table. New entries are written behind to
+    the `topic_history` table through `flush`, which also trims each topic to `depth` rows, and the
+    buffers are reloaded from that table at startup. At most `max_topics` topics are kept in memory,
+    the least recently published one is dropped first (its rows stay until retention removes them).
+    """
+
+    def __init__(self, db=None, depth=10, max_topics=10000):
+        if depth < 1 or max_topics < 1:
+            raise ValueError("History depth and max_topics must be at least 1")
+        self.db = db
+        self.depth = depth
+        self.max_topics = max_topics
+        self.topics = OrderedDict()  # {topic: deque of (payload, qos, published_at)}, oldest first, LRU order
+        self.lock = threading.Lock()
+        self._pending = []  # [(topic, payload, qos, published_at)] not written yet
+
+    def load(self) -> int:
+        """Fills the buffers from the database. Returns the number of entries loaded."""
+        if self.db is None:
+            return 0
+        loaded = 0
+        with self.lock:
+            for topic, entries in self.db.load_topic_history(self.depth).items():
+                self.topics[topic] = deque(entries, maxlen=self.depth)
+                loaded += len(entries)
+                if len(self.topics) > self.max_topics:
+                    loaded -= len(self.topics.popitem(last=False)[1])
+        return loaded
+
+    def record(self, message) -> None:
+        """Appends a published message to its topic's ring, evicting the oldest entry when full."""
+        # Same format as SQLite's CURRENT_TIMESTAMP, used by the `messages` table
+        entry = (message.payload, message.qos, strftime("%Y-%m-%d %H:%M:%S", gmtime()))
+        with self.lock:
+            ring = self.topics.get(message.topic)
+            if ring is None:
+                ring = self.topics[message.topic] = deque(maxlen=self.depth)
+                if len(self.topics) > self.max_topics:
+                    self.topics.popitem(last=False)
+            else:
+                self.topics.move_to_end(message.topic)
+            ring.append(entry)
+            self._pending.append((message.topic,) + entry)
+
+    def forget(self, topics, max_age=None) -> int:
+        """
+        Drops the rings of topics whose history was pruned from the database. With `max_age`, a topic
+        published to again since the prune started is kept. Returns the number of topics dropped.
+        """
+        cutoff = strftime("%Y-%m-%d %H:%M:%S", gmtime(time() - max_age)) if max_age is not None else None
+        dropped = 0
+        with self.lock:
+            for topic in topics:
+                ring = self.topics.get(topic)
+                if ring is None or (cutoff is not None and ring and ring[-1][2] >= cutoff):
+                    continue
+                del self.topics[topic]
+                dropped += 1
+        return dropped
+
+    def last(self, topic: str, count=None) -> list:
+        """Returns up to `count` (default: all kept) recent (payload, qos, published_at) entries, newest first."""
+        with self.lock:
+            ring = self.topics.get(topic)
+            if ring is None:
+                return []
+            entries = list(ring)
+        entries.reverse()
+        return entries if count is None else entries[:count]
+
+    def flush(self) -> int:
+        """Writes new entries and trims the touched topics in one batch. Returns the number written."""
+        if self.db is None:
+            return 0
+        with self.lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        # Entries already pushed out of their ring would be trimmed right after the write
+        kept, written = {}, []
+        for entry in reversed(pending):
+            if kept.get(entry[0], 0) < self.depth:
+                kept[entry[0]] = kept.get(entry[0], 0) + 1
+                written.append(entry)
+        written.reverse()
+        if not self.db.save_topic_history_batch(written, self.depth):
+            with self.lock:
+                self._pending[:0] = written
+            return 0
+        return len(written)
+
+    def __len__(self):
+        return len(self.topics)
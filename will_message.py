@@ -1,5 +1,5 @@
 class WillMessage:
-    def __init__(self, client_id, topic, message, qos=0, retain=False, registered_at=None):
+    def __init__(self, client_id, topic, message, qos=0, retain=False, registered_at=None, delay_interval=0, message_expiry_interval=None):
         self.client_id = client_id
         self.topic = topic
         self.message = message
@@ -7,6 +7,8 @@ class WillMessage:
         self.retain = retain
         self.registered_at = registered_at  # Optional: Timestamp when the will was registered
         self.sent = False  # Optional: Flag to indicate if the will message has been sent
+        self.delay_interval = delay_interval  # Will Delay Interval in seconds
+        self.message_expiry_interval = message_expiry_interval  # Message Expiry Interval of the published will
 
     def __repr__(self):
         return f"<WillMessage client_id={self.client_id} topic={self.topic}>"
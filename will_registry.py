@@ -0,0 +1,143 @@
+import threading
+from will_message import WillMessage
+
+
+class WillRegistry:
+    """
+    Keeps the will message of every session in memory, keyed by client ID, and persists changes lazily
+    through `flush`. When a connection drops, the will is published after its Will Delay Interval
+    (or when the session expires, if that comes first); reconnecting within the delay cancels it.
+    """
+
+    def __init__(self, db, publish):
+        self.db = db
+        self.publish = publish  # Callback receiving the WillMessage to route to subscribers
+        self.wills = {}  # {client_id: WillMessage}
+        self.timers = {}  # {client_id: threading.Timer} for wills waiting for their delay
+        self._dirty = {}  # {client_id: WillMessage or None}, pending writes for the next flush
+        self.lock = threading.Lock()
+
+    def load(self, wills=None) -> int:
+        """
+        Restores the wills of a previous run, from `wills` (e.g. a shutdown snapshot) or from the database.
+        Their sessions did not survive the restart, so each one is scheduled for publication.
+        Returns the number of wills loaded.
+        """
+        if wills is None:
+            wills = self.db.load_will_messages()
+        with self.lock:
+            for will in wills:
+                self.wills[will.client_id] = will
+        for will in wills:
+            self.trigger(will.client_id)
+        return len(wills)
+
+    def register(self, client_id, decoded_packet) -> None:
+        """Registers the will of a new connection, replacing any previous will and cancelling its timer."""
+        self.cancel(client_id)
+        if not decoded_packet.get("will_flag"):
+            self.discard(client_id)
+            return
+        will_properties = decoded_packet.get("will_properties", {})
+        will = WillMessage(
+            client_id=client_id,
+            topic=decoded_packet.get("will_topic"),
+            message=decoded_packet.get("will_message"),
+            qos=decoded_packet.get("will_qos", 0),
+            retain=decoded_packet.get("will_retain", False),
+            delay_interval=will_properties.get("will_delay_interval", 0),
+            message_expiry_interval=will_properties.get("message_expiry_interval")
+        )
+        with self.lock:
+            self.wills[client_id] = will
+            self._dirty[client_id] = will
+
+    def cancel(self, client_id) -> bool:
+        """Stops a pending will timer without publishing, e.g. when the client reconnects."""
+        with self.lock:
+            timer = self.timers.pop(client_id, None)
+        if timer is None:
+            return False
+        timer.cancel()
+        print(f"Cancelled pending Last Will for client '{client_id}'")
+        return True
+
+    def discard(self, client_id) -> bool:
+        """Removes a will without publishing it (normal DISCONNECT)."""
+        self.cancel(client_id)
+        with self.lock:
+            if self.wills.pop(client_id, None) is None:
+                return False
+            self._dirty[client_id] = None
+        return True
+
+    def trigger(self, client_id, session_expiry=None) -> bool:
+        """
+        Schedules the will of a dropped connection. It is published after the Will Delay Interval,
+        or when the session expires if that happens first. Returns False if the client has no will.
+        """
+        with self.lock:
+            will = self.wills.get(client_id)
+            if will is None:
+                return False
+            delay = will.delay_interval or 0
+            if session_expiry is not None:
+                delay = min(delay, session_expiry)
+            if delay <= 0:
+                timer = None
+            else:
+                timer = threading.Timer(delay, self._fire, args=(client_id, will))
+                timer.daemon = True
+                previous = self.timers.pop(client_id, None)
+                self.timers[client_id] = timer
+        if timer is None:
+            self._fire(client_id, will)
+        else:
+            if previous is not None:
+                previous.cancel()
+            timer.start()
+            print(f"Last Will for client '{client_id}' scheduled in {delay} second(s)")
+        return True
+
+    def _fire(self, client_id, will) -> None:
+        with self.lock:
+            # The will may have been replaced or cancelled while the timer was pending
+            if self.wills.get(client_id) is not will:
+                return
+            del self.wills[client_id]
+            self.timers.pop(client_id, None)
+            self._dirty[client_id] = None
+        will.sent = True
+        try:
+            self.publish(will)
+            print(f"Dispatched Last Will for client '{client_id}'")
+        except Exception as e:
+            print(f"Error publishing Last Will for client '{client_id}': {e}")
+
+    def pending_wills(self):
+        """Returns the wills that have not been published or discarded."""
+        with self.lock:
+            return list(self.wills.values())
+
+    def shutdown(self) -> None:
+        """Stops the pending will timers. The wills stay registered, so they can be saved and rescheduled."""
+        with self.lock:
+            timers, self.timers = self.timers, {}
+        for timer in timers.values():
+            timer.cancel()
+
+    def flush(self) -> int:
+        """Writes pending will changes to the database in one batch. Returns the number of clients written."""
+        with self.lock:
+            pending, self._dirty = self._dirty, {}
+        if not pending:
+            return 0
+        if not self.db.save_will_batch(pending):
+            with self.lock:
+                for client_id, will in pending.items():
+                    self._dirty.setdefault(client_id, will)
+            return 0
+        return len(pending)
+
+    def __len__(self):
+        return len(self.wills)